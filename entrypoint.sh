@@ -16,6 +16,13 @@ if [ "$DB_ENGINE" = "postgres" ]; then
     echo "[i] PostgreSQL started"
 fi
 
+# Celery worker (with beat): transcoding and the periodic maintenance tasks;
+# the web containers own the migrations
+if [ "$APP_SERVER" = "worker" ]; then
+    echo "[~] Spawning the Celery worker"
+    exec celery -A myproject worker --beat --loglevel=INFO
+fi
+
 # Function to perform database migrations and initialization
 perform_migrations() {
     echo "[~] Migrating changes to the database"
@@ -49,8 +56,25 @@ elif [ "$DB_ENGINE" = "postgres" ]; then
 fi
 
 # Perform database migrations
-perform_migrations
+# FAST_START (default): one Django process that only migrates/collects static
+# when the schema or the assets changed; set FAST_START=False for the old steps
+if [ "${FAST_START:-True}" = "True" ]; then
+    echo "[~] Preparing the application"
+    if [ -z "$DB_INITIALIZED" ]; then
+        python manage.py startup --init
+    else
+        python manage.py startup
+    fi
+else
+    perform_migrations
+fi
 
-# Spawn the web server
+# Spawn the web server (ASGI by default, APP_SERVER=uwsgi for the legacy WSGI setup)
 echo "[~] Spawning the application server"
-uwsgi --ini docker/docker_uwsgi.ini
+if [ "$APP_SERVER" = "uwsgi" ]; then
+    # %k would be the node's cores; gunicorn's count honours the CPU limit
+    export WEB_CONCURRENCY=$(python -c "import runpy; print(runpy.run_path('docker/gunicorn.conf.py')['workers'])")
+    exec uwsgi --ini docker/docker_uwsgi.ini
+else
+    exec gunicorn --config docker/gunicorn.conf.py
+fi
@@ -0,0 +1,83 @@
+# ASGI server profile: gunicorn managing uvicorn (asyncio) workers
+# the async views and SSE streams only need one event loop per worker
+import math
+import os
+import signal
+import sys
+import threading
+import time
+
+bind = ":8000"
+chdir = "/opt/app"
+wsgi_app = "myproject.asgi:application"
+worker_class = "uvicorn_worker.UvicornWorker"
+
+
+def _available_cpus():
+    # honour the pod's CPU limit (cgroup v2), not the node's core count
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return max(1, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    return len(os.sched_getaffinity(0))
+
+
+def _local_events():
+    # myapp/events.py's LocalBroker only reaches the SSE clients of the
+    # worker that published the event
+    realtime = os.environ.get("REALTIME_UPDATES", "False").lower() == "true"
+    return realtime and not os.environ.get("REDIS_HOST")
+
+
+if os.environ.get("WEB_CONCURRENCY"):
+    workers = int(os.environ["WEB_CONCURRENCY"])
+    if workers > 1 and _local_events():
+        sys.stderr.write(
+            f"[!] REALTIME_UPDATES without REDIS_HOST: live updates only reach "
+            f"browsers on the same worker of {workers}\n"
+        )
+else:
+    # one event loop serves all SSE clients; more workers need Redis
+    workers = 1 if _local_events() else _available_cpus()
+
+# import Django, URLconf, templates and the storage backend once in the
+# master (see myproject/warmup.py), then fork workers that share it
+preload_app = True
+
+# recycle workers after a number of requests (jittered so they don't
+# all restart at once) or once they grow past WORKER_MAX_RSS_MB
+max_requests = int(os.environ.get("WORKER_MAX_REQUESTS", "5000"))
+max_requests_jitter = max_requests // 10
+worker_max_rss_mb = int(os.environ.get("WORKER_MAX_RSS_MB", "512"))
+
+# long-lived SSE connections are fine; this only reaps stuck workers
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = "-"
+errorlog = "-"
+
+
+def _rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+
+def post_worker_init(worker):
+    if not worker_max_rss_mb:
+        return
+
+    def watch():
+        while True:
+            time.sleep(10)
+            if _rss_mb() > worker_max_rss_mb:
+                worker.log.info("Worker RSS above %s MB, recycling", worker_max_rss_mb)
+                # graceful: finish in-flight requests, master forks a fresh one
+                os.kill(os.getpid(), signal.SIGTERM)
+                return
+
+    threading.Thread(target=watch, daemon=True).start()
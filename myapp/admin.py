@@ -1,13 +1,30 @@
 import os
+import shutil
 import zipfile
 from io import BytesIO
+from itertools import chain
+from uuid import uuid4
+from django import forms
 from django.contrib import admin, messages
+from django.contrib.admin import helpers
+from django.contrib.auth import get_user_model
 from django.core import serializers
-from django.db.models import Count
+from django.core.exceptions import PermissionDenied
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db.models import Count, Q
 from django.http import HttpResponse
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.template.defaultfilters import filesizeformat
+from django.utils.text import slugify
 from django.utils.html import format_html
 from django.core.management import call_command
 
+from . import background, bulkactions, ratelimit, tasks, titlesearch
+from .adminlist import AutocompleteFilter, LargeTableMixin
+from .forms import MediaAlbumForm, MediaBulkTagsForm, MediaImportForm, get_tags
 from .models import Tag, Album, Media, Comment
 
 
@@ -50,7 +67,123 @@ class CommentInline(admin.TabularInline):
     show_change_link = False
 
 
-class MediaAdmin(admin.ModelAdmin):
+def _with_tags_and_albums(queryset):
+    return chain(
+        Tag.objects.filter(media_items__in=queryset).distinct(),
+        Album.objects.filter(media_items__in=queryset).distinct(),
+        queryset,
+    )
+
+
+class RangeListFilter(admin.SimpleListFilter):
+    """
+    Buckets of a numeric (indexed) field: ranges = {value: (label, low, high)}.
+    """
+    field = None
+    ranges = {}
+
+    def lookups(self, request, model_admin):
+        return [(value, label) for value, (label, _, _) in self.ranges.items()] + [
+            ("unknown", "Unknown"),
+        ]
+
+    def queryset(self, request, queryset):
+        if self.value() == "unknown":
+            return queryset.filter(**{f"{self.field}__isnull": True})
+        if self.value() not in self.ranges:
+            return queryset
+        _, low, high = self.ranges[self.value()]
+        if low is not None:
+            queryset = queryset.filter(**{f"{self.field}__gte": low})
+        if high is not None:
+            queryset = queryset.filter(**{f"{self.field}__lt": high})
+        return queryset
+
+
+class ByteSizeListFilter(RangeListFilter):
+    title = "file size"
+    parameter_name = "size"
+    field = "byte_size"
+    ranges = {
+        "small": ("Under 1 MB", None, 1024 ** 2),
+        "medium": ("1 – 10 MB", 1024 ** 2, 10 * 1024 ** 2),
+        "large": ("10 – 100 MB", 10 * 1024 ** 2, 100 * 1024 ** 2),
+        "huge": ("Over 100 MB", 100 * 1024 ** 2, None),
+    }
+
+
+class DurationListFilter(RangeListFilter):
+    title = "duration"
+    parameter_name = "duration"
+    field = "duration"
+    ranges = {
+        "short": ("Under 10 s", None, 10),
+        "medium": ("10 s – 1 min", 10, 60),
+        "long": ("1 – 10 min", 60, 600),
+        "very_long": ("Over 10 min", 600, None),
+    }
+
+
+class CodecListFilter(admin.SimpleListFilter):
+    title = "codec"
+    parameter_name = "codec"
+    # the distinct codecs take a scan of the codec index
+    cache_seconds = 3600
+
+    def lookups(self, request, model_admin):
+        codecs = cache.get_or_set(
+            "admin_media_codecs",
+            lambda: list(
+                Media.objects.exclude(codec="").order_by("codec").values_list("codec", flat=True).distinct()
+            ),
+            self.cache_seconds,
+        )
+        return [(codec, codec) for codec in codecs]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(codec=self.value())
+        return queryset
+
+
+class UploaderFilter(AutocompleteFilter):
+    title = "uploader"
+    parameter_name = "uploader"
+    search_field = "username"
+
+    def get_related_model(self):
+        return get_user_model()
+
+    def filter(self, queryset, pk):
+        return queryset.filter(uploader_id=pk)
+
+
+class AlbumFilter(AutocompleteFilter):
+    title = "album"
+    parameter_name = "album"
+    search_field = "title"
+
+    def get_related_model(self):
+        return Album
+
+    def filter(self, queryset, pk):
+        return queryset.filter(album_id=pk)
+
+
+class TagFilter(AutocompleteFilter):
+    title = "tag"
+    parameter_name = "tag"
+    search_field = "name"
+
+    def get_related_model(self):
+        return Tag
+
+    def filter(self, queryset, pk):
+        # a subquery on the through table's tag index, no join to deduplicate
+        return queryset.filter(pk__in=Media.tags.through.objects.filter(tag_id=pk).values("media_id"))
+
+
+class MediaAdmin(LargeTableMixin, admin.ModelAdmin):
     ordering = ("-created_at",)
     list_display = (
         "id",
@@ -61,28 +194,51 @@ class MediaAdmin(admin.ModelAdmin):
         "is_public",
         "album",
         "tag_list",
+        "dimensions",
+        "size",
+        "length",
         "created_at",
     )
     list_select_related = ("uploader", "album")
-    search_fields = (
-        "title",
-        "uploader__username",
-        "uploader__email",
-        "tags__name",
-    )
+    # searched through indexes by get_search_results()
+    search_fields = ("title", "uploader__username", "tags__name")
+    search_help_text = "Title, #tag or @uploader."
     list_filter = (
         "media_type",
         "is_public",
-        "album",
-        "tags",
+        UploaderFilter,
+        AlbumFilter,
+        TagFilter,
+        ByteSizeListFilter,
+        DurationListFilter,
+        CodecListFilter,
         "created_at",
     )
-    date_hierarchy = "created_at"
     filter_horizontal = ("tags",)
-    readonly_fields = ("preview", "created_at", "updated_at")
+    readonly_fields = (
+        "preview",
+        "byte_size",
+        "width",
+        "height",
+        "duration",
+        "frame_count",
+        "codec",
+        "created_at",
+        "updated_at",
+    )
     inlines = [CommentInline]
     list_per_page = 50
-    actions = ["download_media_as_zip"]
+    actions = [
+        "add_tags",
+        "remove_tags",
+        "move_to_album",
+        "make_public",
+        "make_private",
+        "delete_media",
+        "download_media_as_zip",
+        "export_as_json",
+    ]
+    change_list_template = "admin/myapp/media/change_list.html"
 
     fieldsets = (
         (None, {
@@ -94,6 +250,9 @@ class MediaAdmin(admin.ModelAdmin):
         ("Preview", {
             "fields": ("preview",),
         }),
+        ("Metadata", {
+            "fields": (("byte_size", "codec"), ("width", "height"), ("duration", "frame_count")),
+        }),
         ("Timestamps", {
             "fields": ("created_at", "updated_at"),
         }),
@@ -101,7 +260,151 @@ class MediaAdmin(admin.ModelAdmin):
 
     def get_queryset(self, request):
         qs = super().get_queryset(request)
-        return qs.prefetch_related("tags", "uploader", "album")
+        # uploader and album are joined (list_select_related)
+        return qs.prefetch_related("tags")
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        "#tag" and "@uploader" by exact name, anything else by title
+        (trigram index, myapp/titlesearch.py), tag or uploader name. Each
+        goes through an index and a subquery, so no DISTINCT.
+        """
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        tagged = Media.tags.through.objects.filter(tag__slug=slugify(term.lstrip("#"))).values("media_id")
+        uploaders = get_user_model().objects.filter(username=term.lstrip("@")).values("pk")
+        if term.startswith("#"):
+            return queryset.filter(pk__in=tagged), False
+        if term.startswith("@"):
+            return queryset.filter(uploader__in=uploaders), False
+        return queryset.filter(
+            titlesearch.title_filter(term, queryset.db)
+            | Q(pk__in=tagged)
+            | Q(uploader__in=uploaders)
+        ), False
+
+    def get_urls(self):
+        return [
+            path(
+                "import/",
+                self.admin_site.admin_view(self.import_view),
+                name="myapp_media_import",
+            ),
+        ] + super().get_urls()
+
+    def import_view(self, request):
+        """
+        Upload an export and restore it in the worker (import_media).
+        """
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+
+        form = MediaImportForm(request.POST or None, request.FILES or None)
+        if request.method == "POST" and form.is_valid():
+            upload = form.cleaned_data["archive"]
+            ext = os.path.splitext(upload.name)[1].lower()
+            name = default_storage.save(f"imports/{uuid4().hex}{ext}", upload)
+            background.send(tasks.import_media, name)
+            self.message_user(
+                request,
+                f"Importing {upload.name}; the media show up as their batches finish.",
+                level=messages.SUCCESS,
+            )
+            return redirect("admin:myapp_media_changelist")
+
+        context = {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "title": "Import media",
+            "form": form,
+        }
+        return TemplateResponse(request, "admin/myapp/media/import.html", context)
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        # deletes row by row, and leaves the files behind; see delete_media
+        actions.pop("delete_selected", None)
+        return actions
+
+    def _action_page(self, request, queryset, action, form, submit, warning=None):
+        """
+        The intermediate page of an action that asks first; posts the
+        selection back with "apply".
+        """
+        context = {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "title": self.get_actions(request)[action][2],
+            "media": self.media + form.media,
+            "form": form,
+            "count": queryset.count(),
+            "warning": warning,
+            "action": action,
+            "submit": submit,
+            "select_across": request.POST.get("select_across") == "1",
+            "selected": request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+            "action_checkbox_name": helpers.ACTION_CHECKBOX_NAME,
+            "query_string": request.GET.urlencode(),
+        }
+        return TemplateResponse(request, "admin/myapp/media/bulk_action.html", context)
+
+    @admin.action(description="Add tags to selected media", permissions=["change"])
+    def add_tags(self, request, queryset):
+        form = MediaBulkTagsForm(request.POST if "apply" in request.POST else None)
+        if not form.is_valid():
+            return self._action_page(request, queryset, "add_tags", form, "Add tags")
+        count = bulkactions.add_tags(queryset, get_tags(form.cleaned_data["tags"]))
+        self.message_user(request, f"Tagged {count} media.", level=messages.SUCCESS)
+
+    @admin.action(description="Remove tags from selected media", permissions=["change"])
+    def remove_tags(self, request, queryset):
+        form = MediaBulkTagsForm(request.POST if "apply" in request.POST else None)
+        if not form.is_valid():
+            return self._action_page(request, queryset, "remove_tags", form, "Remove tags")
+        names = Q()
+        for name in form.cleaned_data["tags"]:
+            names |= Q(name__iexact=name)
+        count = bulkactions.remove_tags(queryset, Tag.objects.filter(names))
+        self.message_user(request, f"Removed the tags from {count} media.", level=messages.SUCCESS)
+
+    @admin.action(description="Move selected media to an album", permissions=["change"])
+    def move_to_album(self, request, queryset):
+        form = MediaAlbumForm(request.POST if "apply" in request.POST else None)
+        if not form.is_valid():
+            return self._action_page(request, queryset, "move_to_album", form, "Move")
+        album = form.cleaned_data["album"]
+        count = bulkactions.move_to_album(queryset, album)
+        self.message_user(
+            request,
+            f"Moved {count} media to {album}." if album else f"Took {count} media out of their albums.",
+            level=messages.SUCCESS,
+        )
+
+    @admin.action(description="Make selected media public", permissions=["change"])
+    def make_public(self, request, queryset):
+        count = bulkactions.set_public(queryset, True)
+        self.message_user(request, f"Made {count} media public.", level=messages.SUCCESS)
+
+    @admin.action(description="Make selected media private", permissions=["change"])
+    def make_private(self, request, queryset):
+        count = bulkactions.set_public(queryset, False)
+        self.message_user(request, f"Made {count} media private.", level=messages.SUCCESS)
+
+    @admin.action(description="Delete selected media", permissions=["delete"])
+    def delete_media(self, request, queryset):
+        """
+        Set-based replacement for delete_selected, which deletes through
+        the queryset (skipping Media.delete(), so the files stay) and lists
+        every object on its confirmation page.
+        """
+        if "apply" not in request.POST:
+            return self._action_page(
+                request, queryset, "delete_media", forms.Form(), "Yes, delete",
+                warning="Their comments, files and renditions are deleted too.",
+            )
+        count = bulkactions.delete_media(queryset)
+        self.message_user(request, f"Deleted {count} media.", level=messages.SUCCESS)
 
     @admin.display(description="Preview")
     def thumbnail(self, obj):
@@ -123,6 +426,18 @@ class MediaAdmin(admin.ModelAdmin):
         names = [t.name for t in obj.tags.all()]
         return ", ".join(names) if names else "—"
 
+    @admin.display(description="Size", ordering="byte_size")
+    def size(self, obj):
+        return filesizeformat(obj.byte_size) if obj.byte_size is not None else "—"
+
+    @admin.display(description="Dimensions")
+    def dimensions(self, obj):
+        return f"{obj.width}×{obj.height}" if obj.width and obj.height else "—"
+
+    @admin.display(description="Duration", ordering="duration")
+    def length(self, obj):
+        return f"{obj.duration:.1f} s" if obj.duration is not None else "—"
+
     @admin.display(description="Preview (full)")
     def preview(self, obj):
         """Bigger preview on the detail page."""
@@ -142,6 +457,18 @@ class MediaAdmin(admin.ModelAdmin):
 
     @admin.action(description="Download selected media as ZIP (with JSON metadata)")
     def download_media_as_zip(self, request, queryset):
+        # reads every file through the storage, CONCURRENCY_LIMITS["export"] at once
+        with ratelimit.slot("export") as held:
+            if not held:
+                self.message_user(
+                    request,
+                    "Another export is running, try again in a moment.",
+                    level=messages.WARNING,
+                )
+                return None
+            return self._media_zip(request, queryset)
+
+    def _media_zip(self, request, queryset):
         """
         Create a ZIP file containing all selected media files plus a JSON metadata file.
         Preserves the original folder structure so files can be extracted directly to MEDIA_ROOT.
@@ -158,15 +485,13 @@ class MediaAdmin(admin.ModelAdmin):
                     continue
                 
                 try:
-                    # Get the file path on disk
-                    file_path = media.file.path
-                    
                     # Use the same path structure as stored in the database
                     # e.g., "memes/user_1/filename.jpg"
                     zip_filename = media.file.name
                     
-                    # Add file to ZIP with original path structure
-                    zip_file.write(file_path, zip_filename)
+                    # Copy through the storage API, works for S3 as well
+                    with media.file.open("rb") as src, zip_file.open(zip_filename, "w") as dst:
+                        shutil.copyfileobj(src, dst, 1024 * 1024)
                     files_added += 1
                     
                 except Exception as e:
@@ -177,10 +502,11 @@ class MediaAdmin(admin.ModelAdmin):
                         level=messages.WARNING
                     )
             
-            # Add JSON metadata
+            # Add JSON metadata; tags and albums first, import_media
+            # restores them by name
             json_data = serializers.serialize(
                 'json',
-                queryset,
+                _with_tags_and_albums(queryset),
                 use_natural_foreign_keys=True,
                 use_natural_primary_keys=False,
                 indent=2
@@ -208,41 +534,26 @@ class MediaAdmin(admin.ModelAdmin):
         
         return response
 
-    @admin.action(description="Export selected media as JSON only")
-    def export_as_json(self, request, queryset):
-        """
-        Export selected media objects as JSON (dumpdata format) - standalone option.
-        """
-        # Serialize the queryset
-        data = serializers.serialize(
-            'json',
-            queryset,
-            use_natural_foreign_keys=True,
-            use_natural_primary_keys=False,
-            indent=2
-        )
-        
-        # Create the response
-        response = HttpResponse(data, content_type='application/json')
-        response['Content-Disposition'] = 'attachment; filename="media_export.json"'
-        
-        self.message_user(
-            request,
-            f"Successfully exported {queryset.count()} media object(s) as JSON.",
-            level=messages.SUCCESS
-        )
-        
-        return response
-
     @admin.action(description="Export selected media as JSON")
     def export_as_json(self, request, queryset):
+        with ratelimit.slot("export") as held:
+            if not held:
+                self.message_user(
+                    request,
+                    "Another export is running, try again in a moment.",
+                    level=messages.WARNING,
+                )
+                return None
+            return self._media_json(request, queryset)
+
+    def _media_json(self, request, queryset):
         """
         Export selected media objects as JSON (dumpdata format).
         """
         # Serialize the queryset
         data = serializers.serialize(
             'json',
-            queryset,
+            _with_tags_and_albums(queryset),
             use_natural_foreign_keys=True,
             use_natural_primary_keys=False,
             indent=2
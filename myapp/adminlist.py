@@ -0,0 +1,297 @@
+# myapp/adminlist.py
+"""
+Admin changelists that stay fast on tables with millions of rows.
+
+Django's changelist counts every filtered row (twice, with the unfiltered
+total), pages with OFFSET, and renders a sidebar entry for every related
+row of a relation filter. LargeTableMixin replaces each of those:
+
+- EstimatedCountPaginator counts exactly up to EXACT_COUNT_LIMIT rows and
+  asks the query planner beyond that (estimate_count()); the total count
+  and the filter facets are off.
+- KeysetChangeList pages the default ordering with ?after=<pk>, a range
+  scan on the ordering's index however deep the page. A column sort
+  (?o=) falls back to numbered pages.
+- AutocompleteFilter picks the related row with the admin's select2
+  widget, searched by prefix through filter_autocomplete_view, instead of
+  listing all of them.
+"""
+import json
+
+from django import forms
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.db.models import Q
+from django.http import JsonResponse
+from django.urls import path, reverse
+from django.utils.functional import cached_property
+
+# counted exactly up to this many rows, estimated beyond
+EXACT_COUNT_LIMIT = 10000
+CURSOR_VAR = "after"
+AUTOCOMPLETE_PAGE_SIZE = 20
+
+
+def estimate_count(queryset):
+    """
+    The planner's row estimate for `queryset`: EXPLAIN on PostgreSQL, the
+    table's row count from ANALYZE (sqlite_stat1) for an unfiltered queryset
+    on SQLite. None if there is none.
+    """
+    connection = connections[queryset.db]
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                sql, params = queryset.query.sql_with_params()
+                cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+                plan = cursor.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                return int(plan[0]["Plan"]["Plan Rows"])
+            if connection.vendor == "sqlite" and not queryset.query.where:
+                cursor.execute(
+                    "SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1",
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+                return int(row[0].split()[0]) if row else None
+    except DatabaseError:
+        # no statistics yet
+        return None
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Exact counts of small results, the planner's estimate of big ones;
+    count_prefix says which ("", "about" or "over" if there is no
+    estimate).
+    """
+    count_prefix = ""
+
+    @cached_property
+    def count(self):
+        exact = self.object_list[:EXACT_COUNT_LIMIT + 1].count()
+        if exact <= EXACT_COUNT_LIMIT:
+            return exact
+        estimate = estimate_count(self.object_list)
+        if estimate is None or estimate <= EXACT_COUNT_LIMIT:
+            self.count_prefix = "over"
+            return EXACT_COUNT_LIMIT
+        self.count_prefix = "about"
+        return estimate
+
+
+class KeysetChangeList(ChangeList):
+    """
+    ChangeList paging the model admin's keyset_ordering by cursor.
+    """
+    keyset = False
+    next_query_string = None
+    first_query_string = None
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_query_string(self, new_params=None, remove=None):
+        # filter, sort and search links start from the first page
+        if not new_params or CURSOR_VAR not in new_params:
+            remove = [*(remove or []), CURSOR_VAR]
+        return super().get_query_string(new_params, remove)
+
+    def _after(self, queryset, pk):
+        field = self.model_admin.keyset_ordering[0].lstrip("-")
+        value = self.model._default_manager.filter(pk=pk).values_list(field, flat=True).first()
+        if value is None:
+            raise IncorrectLookupParameters(f"Unknown {CURSOR_VAR}={pk}")
+        # the first condition bounds the index scan, the rest breaks ties
+        return queryset.filter(
+            Q(**{f"{field}__lte": value}) & (Q(**{f"{field}__lt": value}) | Q(pk__lt=pk))
+        )
+
+    def get_results(self, request):
+        if (
+            self.show_all
+            or self.list_editable
+            # the changelist repeats the model's ordering after the admin's
+            or tuple(dict.fromkeys(self.queryset.query.order_by)) != self.model_admin.keyset_ordering
+        ):
+            return super().get_results(request)
+
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        queryset = self.queryset
+        after = self.params.get(CURSOR_VAR)
+        if after:
+            try:
+                queryset = self._after(queryset, int(after))
+            except ValueError as e:
+                raise IncorrectLookupParameters(e) from e
+        rows = list(queryset[:self.list_per_page + 1])
+        has_next = len(rows) > self.list_per_page
+
+        self.result_count = paginator.count
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.full_result_count = None
+        self.result_list = rows[:self.list_per_page]
+        self.can_show_all = False
+        self.multi_page = has_next or bool(after)
+        self.paginator = paginator
+        self.keyset = True
+        if has_next:
+            self.next_query_string = self.get_query_string({CURSOR_VAR: rows[self.list_per_page - 1].pk})
+        if after:
+            self.first_query_string = self.get_query_string()
+
+
+class AutocompleteFilter(admin.ListFilter):
+    """
+    A sidebar filter on one related row, picked with select2. Subclasses
+    set title, parameter_name and search_field (the column the related
+    rows are searched by prefix and ordered by) and implement
+    get_related_model() and filter().
+    """
+    template = "admin/myapp/autocomplete_filter.html"
+    parameter_name = None
+    search_field = None
+
+    def __init__(self, request, params, model, model_admin):
+        super().__init__(request, params, model, model_admin)
+        self.model_admin = model_admin
+        if self.parameter_name in params:
+            self.used_parameters[self.parameter_name] = params.pop(self.parameter_name)[-1]
+
+    def get_related_model(self):
+        raise NotImplementedError
+
+    def filter(self, queryset, pk):
+        raise NotImplementedError
+
+    def value(self):
+        return self.used_parameters.get(self.parameter_name)
+
+    def has_output(self):
+        return True
+
+    def expected_parameters(self):
+        return [self.parameter_name]
+
+    def queryset(self, request, queryset):
+        if not self.value():
+            return queryset
+        try:
+            pk = int(self.value())
+        except ValueError as e:
+            raise IncorrectLookupParameters(e) from e
+        return self.filter(queryset, pk)
+
+    @cached_property
+    def selected(self):
+        if not self.value() or not self.value().isdigit():
+            return None
+        return self.get_related_model()._default_manager.filter(pk=self.value()).first()
+
+    def url(self):
+        opts = self.model_admin.opts
+        return reverse(
+            f"admin:{opts.app_label}_{opts.model_name}_filter_autocomplete",
+            args=[self.parameter_name],
+        )
+
+    def choices(self, changelist):
+        yield {
+            "selected": self.value() is None,
+            "query_string": changelist.get_query_string(remove=[self.parameter_name]),
+            "display": "All",
+        }
+
+    def search(self, term, page):
+        """
+        One page of related rows whose search_field starts with `term`.
+        """
+        queryset = self.get_related_model()._default_manager.order_by(self.search_field, "pk")
+        if term:
+            queryset = queryset.filter(**{f"{self.search_field}__istartswith": term})
+        start = (page - 1) * AUTOCOMPLETE_PAGE_SIZE
+        rows = list(queryset.values_list("pk", self.search_field)[start:start + AUTOCOMPLETE_PAGE_SIZE + 1])
+        return rows[:AUTOCOMPLETE_PAGE_SIZE], len(rows) > AUTOCOMPLETE_PAGE_SIZE
+
+
+def autocomplete_media():
+    # what the admin's autocomplete widgets load
+    extra = "" if settings.DEBUG else ".min"
+    return forms.Media(
+        js=(
+            f"admin/js/vendor/jquery/jquery{extra}.js",
+            f"admin/js/vendor/select2/select2.full{extra}.js",
+            "admin/js/jquery.init.js",
+            "admin/js/autocomplete.js",
+            "assets/js/autocomplete-filter.js",
+        ),
+        css={
+            "screen": (f"admin/css/vendor/select2/select2{extra}.css", "admin/css/autocomplete.css"),
+        },
+    )
+
+
+class LargeTableMixin:
+    """
+    ModelAdmin settings for big tables; see the module docstring.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+    # the ordering with an index to page along; ties are broken by pk
+    keyset_ordering = ("-created_at", "-pk")
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    @property
+    def media(self):
+        return super().media + autocomplete_media()
+
+    def get_urls(self):
+        opts = self.opts
+        return [
+            path(
+                "filter-autocomplete/<str:parameter_name>/",
+                self.admin_site.admin_view(self.filter_autocomplete_view),
+                name=f"{opts.app_label}_{opts.model_name}_filter_autocomplete",
+            ),
+        ] + super().get_urls()
+
+    def filter_autocomplete_view(self, request, parameter_name):
+        """
+        select2's JSON for an AutocompleteFilter in list_filter.
+        """
+        if not self.has_view_or_change_permission(request):
+            raise PermissionDenied
+        filter_class = next(
+            (
+                list_filter for list_filter in self.get_list_filter(request)
+                if isinstance(list_filter, type)
+                and issubclass(list_filter, AutocompleteFilter)
+                and list_filter.parameter_name == parameter_name
+            ),
+            None,
+        )
+        if filter_class is None:
+            raise PermissionDenied
+        try:
+            page = max(1, int(request.GET.get("page", 1)))
+        except ValueError:
+            page = 1
+        spec = filter_class(request, {}, self.model, self)
+        rows, more = spec.search(request.GET.get("term", "").strip(), page)
+        return JsonResponse({
+            "results": [{"id": str(pk), "text": str(label)} for pk, label in rows],
+            "pagination": {"more": more},
+        })
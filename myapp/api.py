@@ -0,0 +1,397 @@
+# myapp/api.py
+"""
+Read API (/api/v1/): media, tags and a media's comments as compact JSON,
+for clients that have no use for the feed's server-rendered HTML.
+
+Rows are read with .values(), only the columns the requested fields need,
+and serialized without model instances or templates. Every list endpoint:
+
+- takes fields=a,b,c, a sparse fieldset (default: every field),
+- pages by cursor: ?cursor=<next_cursor of the previous page> is a keyset
+  on the ordering columns, so a deep page costs the same as the first,
+- or fetches specific rows with ids=1,2,3 (at most MAX_LIMIT), in one
+  query; ids the user can't see are left out.
+
+Responses are ETagged from the version stamps the HTML views use (feed
+version, comment_version), so polling clients mostly get a 304.
+"""
+import datetime
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import Count, Q
+from django.http import JsonResponse
+from django.shortcuts import aget_object_or_404
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+from django.views.decorators.http import require_safe
+
+from . import archive
+from .dbrouting import replica_reads
+from .decorators import aetag, api_login_required
+from .models import CommentArchive, Media, Tag
+from .usercache import user_names
+from .versioning import aget_feed_version
+
+DEFAULT_LIMIT = 24
+MAX_LIMIT = 100
+
+
+def _file_url(name):
+    # as Media.get_file_url(), from the bare file name
+    if not name:
+        return ""
+    if settings.MEDIA_PROXY:
+        return reverse("myapp:media_file", args=[name])
+    return default_storage.url(name)
+
+
+# field name → (column, conversion)
+MEDIA_FIELDS = {
+    "id": ("id", None),
+    "title": ("title", None),
+    "type": ("media_type", None),
+    "url": ("file", _file_url),
+    "video_url": ("video_file", _file_url),
+    "video_low_url": ("video_low_file", _file_url),
+    "hls_url": ("hls_playlist", _file_url),
+    "webp_url": ("webp_file", _file_url),
+    "processing": ("processing", None),
+    "width": ("width", None),
+    "height": ("height", None),
+    "duration": ("duration", None),
+    "byte_size": ("byte_size", None),
+    "codec": ("codec", None),
+    "uploader": ("uploader", None),
+    "album": ("album_id", None),
+    "is_public": ("is_public", None),
+    "comment_count": ("comment_count", None),
+    "created_at": ("created_at", None),
+    "updated_at": ("updated_at", None),
+    # ids, see /api/v1/tags/?ids=
+    "tags": ("tags", None),
+}
+URL_FIELDS = {"url", "video_url", "video_low_url", "hls_url", "webp_url"}
+
+TAG_FIELDS = {
+    "id": ("id", None),
+    "name": ("name", None),
+    "slug": ("slug", None),
+    # media tagged with it; only counted when asked for
+    "count": ("count", None),
+}
+
+COMMENT_FIELDS = {
+    "id": ("id", None),
+    "author": ("author", None),
+    "text": ("text", None),
+    "created_at": ("created_at", None),
+    "updated_at": ("updated_at", None),
+    "archived": ("archived", None),
+}
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _error(e):
+    return JsonResponse({"error": str(e)}, status=e.status)
+
+
+def _response(results, next_cursor=None):
+    return JsonResponse(
+        {"results": results, "next_cursor": next_cursor},
+        json_dumps_params={"separators": (",", ":")},
+    )
+
+
+def _fields(request, available):
+    value = request.GET.get("fields")
+    if not value:
+        return list(available)
+    fields = list(dict.fromkeys(name.strip() for name in value.split(",") if name.strip()))
+    unknown = [name for name in fields if name not in available]
+    if unknown:
+        raise ApiError(f"Unknown field(s) {', '.join(unknown)}; available: {', '.join(available)}")
+    return fields
+
+
+def _ids(request):
+    value = request.GET.get("ids")
+    if value is None:
+        return None
+    try:
+        ids = list(dict.fromkeys(int(pk) for pk in value.split(",") if pk.strip()))
+    except ValueError:
+        raise ApiError("ids must be comma separated integers")
+    if len(ids) > MAX_LIMIT:
+        raise ApiError(f"At most {MAX_LIMIT} ids per request")
+    return ids
+
+
+def _limit(request):
+    try:
+        limit = int(request.GET.get("limit") or DEFAULT_LIMIT)
+    except ValueError:
+        raise ApiError("limit must be an integer")
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def _encode_cursor(*values):
+    return urlsafe_base64_encode(json.dumps(values, separators=(",", ":")).encode())
+
+
+def _aware_datetime(value):
+    """
+    A cursor's datetime; None if it has no timezone, as the cursors we
+    hand out always do.
+    """
+    value = parse_datetime(value)
+    if value is not None and timezone.is_naive(value):
+        return None
+    return value
+
+
+def _decode_cursor(request, *types):
+    """
+    The ?cursor= values converted by `types`, None without a cursor.
+    """
+    value = request.GET.get("cursor")
+    if not value:
+        return None
+    try:
+        values = json.loads(urlsafe_base64_decode(value))
+        if len(values) != len(types):
+            raise ValueError
+        values = [convert(v) for convert, v in zip(types, values)]
+    except (ValueError, TypeError):
+        raise ApiError("Invalid cursor")
+    if any(v is None for v in values):
+        raise ApiError("Invalid cursor")
+    return values
+
+
+def _columns(fields, available, always=(), computed=()):
+    """
+    The columns to read for `fields`, less those filled in separately.
+    """
+    columns = [available[name][0] for name in fields if name not in computed]
+    return list(dict.fromkeys([*always, *columns]))
+
+
+def _serialize(rows, fields, available):
+    converters = [(name, *available[name]) for name in fields]
+    return [
+        {
+            name: convert(row[column]) if convert else row[column]
+            for name, column, convert in converters
+        }
+        for row in rows
+    ]
+
+
+def _in_order(rows, ids):
+    by_id = {row["id"]: row for row in rows}
+    return [by_id[pk] for pk in ids if pk in by_id]
+
+
+async def _feed_version(request, *args):
+    return await aget_feed_version()
+
+
+async def _comments_version(request, pk):
+    return await (
+        Media.objects.filter(pk=pk)
+        .values_list("comment_version", flat=True)
+        .afirst()
+    )
+
+
+@require_safe
+@api_login_required
+@replica_reads
+@aetag(_feed_version)
+async def media_list(request):
+    """
+    Media visible to the user, newest first. ?tag=<slug> and
+    ?type=image|video filter.
+    """
+    try:
+        fields = _fields(request, MEDIA_FIELDS)
+        ids = _ids(request)
+        limit = _limit(request)
+        cursor = _decode_cursor(request, _aware_datetime, int)
+    except ApiError as e:
+        return _error(e)
+
+    qs = Media.objects.visible_to(request.user)
+    if ids is not None:
+        qs = qs.filter(pk__in=ids)
+    else:
+        if tag := request.GET.get("tag"):
+            qs = qs.filter(tags__slug=tag)
+        if media_type := request.GET.get("type"):
+            qs = qs.filter(media_type=media_type)
+        if cursor:
+            created_at, pk = cursor
+            qs = qs.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk))
+        qs = qs.order_by("-created_at", "-pk")[:limit + 1]
+
+    rows = [row async for row in qs.values(*_columns(
+        fields, MEDIA_FIELDS, always=("id", "created_at", "uploader_id"), computed=("tags", "uploader")
+    ))]
+    next_cursor = None
+    if ids is not None:
+        rows = _in_order(rows, ids)
+    elif len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1]["created_at"].isoformat(), rows[-1]["id"])
+
+    if "uploader" in fields:
+        names = await user_names(request).aresolve(row["uploader_id"] for row in rows)
+        for row in rows:
+            row["uploader"] = names.get(row["uploader_id"], "")
+    if "tags" in fields:
+        tag_ids = {row["id"]: [] for row in rows}
+        async for media_id, tag_id in Media.tags.through.objects.filter(
+            media_id__in=list(tag_ids)
+        ).values_list("media_id", "tag_id"):
+            tag_ids[media_id].append(tag_id)
+        for row in rows:
+            row["tags"] = tag_ids[row["id"]]
+
+    if URL_FIELDS.intersection(fields) and not settings.MEDIA_PROXY:
+        # storage URLs may be signed (S3): off the event loop
+        results = await sync_to_async(_serialize, thread_sensitive=False)(rows, fields, MEDIA_FIELDS)
+    else:
+        results = _serialize(rows, fields, MEDIA_FIELDS)
+    return _response(results, next_cursor)
+
+
+@require_safe
+@api_login_required
+@replica_reads
+@aetag(_feed_version)
+async def tag_list(request):
+    """
+    Tags by name.
+    """
+    try:
+        fields = _fields(request, TAG_FIELDS)
+        ids = _ids(request)
+        limit = _limit(request)
+        cursor = _decode_cursor(request, str)
+    except ApiError as e:
+        return _error(e)
+
+    qs = Tag.objects.all()
+    if "count" in fields:
+        qs = qs.annotate(count=Count("media_items"))
+    if ids is not None:
+        qs = qs.filter(pk__in=ids)
+    else:
+        if cursor:
+            qs = qs.filter(name__gt=cursor[0])
+        qs = qs.order_by("name")[:limit + 1]
+
+    rows = [row async for row in qs.values(*_columns(fields, TAG_FIELDS, always=("id", "name")))]
+    next_cursor = None
+    if ids is not None:
+        rows = _in_order(rows, ids)
+    elif len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1]["name"])
+    return _response(_serialize(rows, fields, TAG_FIELDS), next_cursor)
+
+
+async def _archived_comments(request, media, cursor, limit):
+    """
+    Up to `limit` comments of the media's archive older than `cursor`,
+    as rows like the live ones.
+    """
+    archived = await CommentArchive.objects.filter(media_id=media.pk).afirst()
+    if archived is None:
+        return []
+    entries = archive.unpack(archived.data)
+    if cursor:
+        created_at, pk = cursor
+        entries = [
+            entry for entry in entries
+            if (datetime.datetime.fromisoformat(entry["created"]), entry["id"]) < (created_at, pk)
+        ]
+    names = await user_names(request).aresolve({entry["author"] for entry in entries})
+    # a deleted user's comments are on their way out (archive.forget_authors())
+    entries = [entry for entry in entries if entry["author"] in names][:limit]
+    return [
+        {
+            "id": entry["id"],
+            "author_id": entry["author"],
+            "author": names[entry["author"]],
+            "text": entry["text"],
+            "created_at": datetime.datetime.fromisoformat(entry["created"]),
+            "updated_at": datetime.datetime.fromisoformat(entry["updated"]),
+            "archived": True,
+        }
+        for entry in entries
+    ]
+
+
+@require_safe
+@api_login_required
+@replica_reads
+@aetag(_comments_version)
+async def comment_list(request, pk):
+    """
+    The media's comments, newest first, continuing into the archived
+    comments of cold threads. ids= only finds live comments.
+    """
+    try:
+        fields = _fields(request, COMMENT_FIELDS)
+        ids = _ids(request)
+        limit = _limit(request)
+        cursor = _decode_cursor(request, _aware_datetime, int)
+    except ApiError as e:
+        return _error(e)
+
+    media = await aget_object_or_404(
+        Media.objects.visible_to(request.user).only("pk", "comment_count"), pk=pk
+    )
+    qs = media.comments.all()
+    if ids is not None:
+        qs = qs.filter(pk__in=ids)
+    else:
+        if cursor:
+            created_at, comment_pk = cursor
+            qs = qs.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=comment_pk))
+        qs = qs.order_by("-created_at", "-pk")[:limit + 1]
+
+    columns = _columns(
+        fields, COMMENT_FIELDS, always=("id", "created_at", "author_id"), computed=("author", "archived")
+    )
+    rows = [{**row, "archived": False} async for row in qs.values(*columns)]
+    if ids is not None:
+        rows = _in_order(rows, ids)
+    elif len(rows) <= limit and media.comment_count > len(rows):
+        # archived comments are older than every live one
+        last = (rows[-1]["created_at"], rows[-1]["id"]) if rows else cursor
+        rows += await _archived_comments(request, media, last, limit + 1 - len(rows))
+
+    next_cursor = None
+    if ids is None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1]["created_at"].isoformat(), rows[-1]["id"])
+    if "author" in fields:
+        names = await user_names(request).aresolve(
+            row["author_id"] for row in rows if not row["archived"]
+        )
+        for row in rows:
+            if not row["archived"]:
+                row["author"] = names.get(row["author_id"], "")
+    return _response(_serialize(rows, fields, COMMENT_FIELDS), next_cursor)
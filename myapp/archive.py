@@ -0,0 +1,208 @@
+# myapp/archive.py
+"""
+Archival of cold comment threads.
+
+Once a meme's thread has been quiet for COMMENT_ARCHIVE_AFTER_DAYS, the
+`archive_comments` command moves its comments out of the comment table
+into one zlib-compressed JSON blob per media (CommentArchive). The comment
+views page through live rows first and then the archive (archived comments
+are always older), so readers can't tell the difference, except that
+archived comments can't be deleted.
+
+Media.comment_count keeps counting archived comments, which lets the views
+skip the archive lookup for the vast majority of threads that have none.
+
+Deleting a user deletes their live comments by cascade; their archived
+ones are dropped from the blobs in the background (forget_authors()).
+"""
+import datetime
+import json
+import zlib
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+from .models import Comment, CommentArchive, Media
+from .versioning import bump_feed_version
+
+
+def pack(entries):
+    return zlib.compress(json.dumps(entries, separators=(",", ":")).encode(), 9)
+
+
+def unpack(data):
+    return json.loads(zlib.decompress(bytes(data)))
+
+
+def _entry(comment):
+    return {
+        "id": comment.pk,
+        "author": comment.author_id,
+        "text": comment.text,
+        "created": comment.created_at.isoformat(),
+        "updated": comment.updated_at.isoformat(),
+    }
+
+
+def _comment(media_id, entry):
+    comment = Comment(
+        pk=entry["id"],
+        media_id=media_id,
+        author_id=entry["author"],
+        text=entry["text"],
+        created_at=datetime.datetime.fromisoformat(entry["created"]),
+        updated_at=datetime.datetime.fromisoformat(entry["updated"]),
+    )
+    comment.is_archived = True
+    return comment
+
+
+def archive_thread(media_id, cutoff):
+    """
+    Move the media's comments older than `cutoff` into its archive.
+    Returns the number of comments archived.
+    """
+    with transaction.atomic():
+        # serializes concurrent archive runs for the same thread
+        Media.objects.select_for_update().filter(pk=media_id).values_list("pk").first()
+        comments = list(
+            Comment.objects
+            .select_related("author")
+            .filter(media_id=media_id, created_at__lt=cutoff)
+            .order_by("-created_at", "-pk")
+        )
+        if not comments:
+            return 0
+
+        archive = CommentArchive.objects.filter(media_id=media_id).first()
+        entries = [_entry(comment) for comment in comments]
+        if archive is not None:
+            entries += unpack(archive.data)
+        else:
+            archive = CommentArchive(media_id=media_id)
+        entries.sort(key=lambda entry: (entry["created"], entry["id"]), reverse=True)
+        archive.data = pack(entries)
+        archive.comment_count = len(entries)
+        archive.save()
+
+        # a raw delete skips the per-comment signals: comment_count stays as
+        # it is and open pages must not be told these comments were deleted
+        Comment.objects.filter(
+            pk__in=[comment.pk for comment in comments],
+            # lets PostgreSQL prune to the old partitions
+            created_at__lt=cutoff,
+        )._raw_delete(Comment.objects.db)
+        Media.objects.filter(pk=media_id).update(comment_version=F("comment_version") + 1)
+    return len(comments)
+
+
+def forget_authors(user_ids, batch_size=100):
+    """
+    Drop the archived comments of deleted users, as the cascade does with
+    their live ones. Returns the number of comments dropped.
+    """
+    user_ids = set(user_ids)
+    dropped = 0
+    last = 0
+    while True:
+        archives = list(
+            CommentArchive.objects.filter(pk__gt=last).order_by("pk").values_list("pk", "media_id", "data")[:batch_size]
+        )
+        if not archives:
+            break
+        last = archives[-1][0]
+        for _, media_id, data in archives:
+            if any(entry["author"] in user_ids for entry in unpack(data)):
+                dropped += _forget_in_thread(media_id, user_ids)
+    if dropped:
+        transaction.on_commit(bump_feed_version)
+    return dropped
+
+
+def _forget_in_thread(media_id, user_ids):
+    with transaction.atomic():
+        # as archive_thread(), which may be rewriting the same archive
+        Media.objects.select_for_update().filter(pk=media_id).values_list("pk").first()
+        archive = CommentArchive.objects.filter(media_id=media_id).first()
+        if archive is None:
+            return 0
+        entries = unpack(archive.data)
+        kept = [entry for entry in entries if entry["author"] not in user_ids]
+        dropped = len(entries) - len(kept)
+        if not dropped:
+            return 0
+        if kept:
+            archive.data = pack(kept)
+            archive.comment_count = len(kept)
+            archive.save()
+        else:
+            archive.delete()
+        Media.objects.filter(pk=media_id).update(
+            comment_count=Greatest(F("comment_count") - dropped, 0),
+            comment_version=F("comment_version") + 1,
+        )
+    return dropped
+
+
+class Thread:
+    """
+    A media's comments, newest first: live rows followed by archived ones.
+    Sliceable, so Paginator can page through it; slices hold the live
+    queryset part unevaluated (see aresolve()).
+    """
+    def __init__(self, live, live_count, archived_entries, media_id):
+        self.live = live
+        self.live_count = live_count
+        self.archived = archived_entries
+        self.media_id = media_id
+
+    def count(self):
+        return self.live_count + len(self.archived)
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        start, stop, _ = key.indices(self.count())
+        return ThreadSlice(
+            self.live[start:min(stop, self.live_count)] if start < self.live_count else None,
+            [
+                _comment(self.media_id, entry)
+                for entry in self.archived[max(start - self.live_count, 0):max(stop - self.live_count, 0)]
+            ],
+        )
+
+
+class ThreadSlice:
+    def __init__(self, live, archived):
+        self.live = live
+        self.archived = archived
+
+    async def aresolve(self):
+        comments = [comment async for comment in self.live] if self.live is not None else []
+        if self.archived:
+            User = get_user_model()
+            authors = {
+                user.pk: user async for user in
+                User.objects.filter(pk__in={comment.author_id for comment in self.archived})
+            }
+            # a deleted user's comments are on their way out (forget_authors())
+            self.archived = [comment for comment in self.archived if comment.author_id in authors]
+            for comment in self.archived:
+                comment.author = authors[comment.author_id]
+        return comments + self.archived
+
+
+async def athread(media, live):
+    """
+    Thread of `media` whose live part is the queryset `live`.
+    """
+    live_count = await live.acount()
+    archived = []
+    if media.comment_count > live_count:
+        archive = await CommentArchive.objects.filter(media_id=media.pk).afirst()
+        if archive is not None:
+            archived = unpack(archive.data)
+    return Thread(live, live_count, archived, media.pk)
@@ -0,0 +1,83 @@
+# myapp/background.py
+"""
+Sending Celery tasks without making the request wait for them.
+
+Without a broker (no REDIS_HOST) Celery runs tasks eagerly, in the thread
+that sends them, so a transcode, an import or a bulk file cleanup would
+run inside the web request. send() hands them to one daemon thread of the
+web process instead, which runs them one after another. With a broker it
+is task.delay().
+
+Jobs queued in a process that exits are lost; `transcode_media --missing`
+catches up on renditions, the maintenance sweep on files left behind.
+"""
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class Runner:
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, task, args):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="background-tasks", daemon=True)
+                self._thread.start()
+        self._queue.put((task, args))
+
+    def join(self):
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            task, args = self._queue.get()
+            close_old_connections()
+            try:
+                task(*args)
+            except Exception:
+                logger.exception("Background task %s failed", task.name)
+            finally:
+                close_old_connections()
+                self._queue.task_done()
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_runner():
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = Runner()
+        return _runner
+
+
+def send(task, *args):
+    """
+    Queue a Celery task: to the broker if there is one, to the background
+    thread otherwise.
+    """
+    if getattr(settings, "CELERY_TASK_ALWAYS_EAGER", False):
+        get_runner().submit(task, args)
+    else:
+        # the configured app has to be current for shared_task to send
+        # through it; web processes only load Celery once they do
+        import myproject.celery  # noqa: F401
+        task.delay(*args)
+
+
+def wait():
+    """
+    Block until the background thread has run everything queued so far.
+    """
+    get_runner().join()
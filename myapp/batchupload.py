@@ -0,0 +1,198 @@
+# myapp/batchupload.py
+"""
+Batch uploads: many files, or a ZIP of them, with shared tags and album.
+
+Every file runs through the same steps as a single upload (whitelists,
+magic bytes, header metadata) plus a checksum, so files the uploader
+already has are skipped. Validation, hashing and the storage writes run on
+a thread pool, at most BATCH_UPLOAD_WORKERS at a time and pipelined: while
+some files are being stored, the next ones are validated. Rows are
+inserted through the write queue as files finish.
+
+process() yields one event per file as it completes, for the view to
+stream back as NDJSON.
+"""
+import asyncio
+import logging
+import mimetypes
+import os
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.urls import reverse
+
+from . import transcode
+from .forms import ALLOWED_EXTS, validate_media_file
+from .models import Media
+from .writequeue import arun_write
+
+logger = logging.getLogger(__name__)
+
+
+class BatchUploadError(Exception):
+    pass
+
+
+@dataclass
+class BatchItem:
+    name: str
+    size: int
+    content_type: str
+    open: Callable[[], File]
+
+
+def items_from_files(files):
+    return [
+        BatchItem(f.name, f.size, getattr(f, "content_type", "") or "", lambda f=f: f)
+        for f in files
+    ]
+
+
+def _extract(archive, info):
+    """
+    A ZIP member as a file: spooled to memory up to the upload memory limit,
+    to a temporary file beyond.
+    """
+    tmp = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+    with archive.open(info) as src:
+        while chunk := src.read(1024 * 1024):
+            tmp.write(chunk)
+    tmp.seek(0)
+    return File(tmp, name=os.path.basename(info.filename))
+
+
+def items_from_zip(upload):
+    """
+    The media files of a ZIP upload; folders are flattened, other files
+    (and macOS resource forks) ignored.
+    """
+    try:
+        archive = zipfile.ZipFile(upload)
+    except zipfile.BadZipFile:
+        raise BatchUploadError(f"{upload.name} is not a ZIP file")
+    items = []
+    for info in archive.infolist():
+        name = os.path.basename(info.filename)
+        if (
+            info.is_dir()
+            or name.startswith(".")
+            or info.filename.startswith("__MACOSX/")
+            or os.path.splitext(name)[1].lower() not in ALLOWED_EXTS
+        ):
+            continue
+        items.append(BatchItem(
+            name,
+            info.file_size,
+            mimetypes.guess_type(name)[0] or "",
+            lambda info=info: _extract(archive, info),
+        ))
+    return items
+
+
+def check_limits(items):
+    if not items:
+        raise BatchUploadError("No media files in the upload")
+    if len(items) > settings.BATCH_UPLOAD_MAX_FILES:
+        raise BatchUploadError(f"At most {settings.BATCH_UPLOAD_MAX_FILES} files per batch")
+    # ZIP members are extracted only up to their declared size
+    if sum(item.size for item in items) > settings.BATCH_UPLOAD_MAX_MB * 1024 * 1024:
+        raise BatchUploadError(f"At most {settings.BATCH_UPLOAD_MAX_MB} MB per batch")
+
+
+def _prepare(item):
+    f = item.open()
+    try:
+        media_type, metadata = validate_media_file(f, item.content_type)
+    except Exception:
+        f.close()
+        raise
+    return f, media_type, metadata
+
+
+def _store(user, f):
+    name = Media._meta.get_field("file").generate_filename(Media(uploader=user), f.name)
+    f.seek(0)
+    return default_storage.save(name, f)
+
+
+def create_media(user, name, title, media_type, metadata, tags=(), album=None):
+    """
+    The Media row of a validated file already in the storage.
+    """
+    media = Media.objects.create(
+        uploader=user,
+        title=title,
+        file=name,
+        media_type=media_type,
+        album=album,
+        **metadata,
+    )
+    media.tags.set(tags)
+    transcode.schedule(media)
+    return media
+
+
+async def process(user, items, tags=(), album=None):
+    """
+    Upload the items; yields {"file", "status", ...} per item as it is done
+    ("created" with "id" and "url", "duplicate" or "error" with "error").
+    """
+    loop = asyncio.get_running_loop()
+    pool = ThreadPoolExecutor(settings.BATCH_UPLOAD_WORKERS, thread_name_prefix="batch-upload")
+    # bounds the files held open (validated, not stored yet)
+    slots = asyncio.Semaphore(settings.BATCH_UPLOAD_WORKERS * 2)
+    seen = set()
+
+    async def handle(item):
+        event = {"file": item.name}
+        async with slots:
+            try:
+                f, media_type, metadata = await loop.run_in_executor(pool, _prepare, item)
+            except ValidationError as e:
+                return {**event, "status": "error", "error": " ".join(e.messages)}
+            except Exception:
+                logger.exception("Batch upload of %s failed", item.name)
+                return {**event, "status": "error", "error": "The file could not be read."}
+
+            name = None
+            try:
+                checksum = metadata["checksum"]
+                duplicate = checksum in seen
+                seen.add(checksum)
+                if duplicate or await Media.objects.filter(uploader=user, checksum=checksum).aexists():
+                    return {**event, "status": "duplicate"}
+                name = await loop.run_in_executor(pool, _store, user, f)
+                title = os.path.splitext(item.name)[0][:Media._meta.get_field("title").max_length]
+                media = await arun_write(
+                    create_media, user, name, title, media_type, metadata, tags, album
+                )
+            except Exception:
+                logger.exception("Batch upload of %s failed", item.name)
+                if name:
+                    await loop.run_in_executor(pool, default_storage.delete, name)
+                return {**event, "status": "error", "error": "The file could not be saved."}
+            finally:
+                f.close()
+        return {
+            **event,
+            "status": "created",
+            "id": media.pk,
+            "url": reverse("myapp:meme_detail", args=[media.pk]),
+        }
+
+    tasks = [asyncio.ensure_future(handle(item)) for item in items]
+    try:
+        for done, task in enumerate(asyncio.as_completed(tasks), 1):
+            yield {**await task, "done": done, "total": len(tasks)}
+    finally:
+        # the client went away: drop what hasn't started
+        for task in tasks:
+            task.cancel()
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,146 @@
+# myapp/bulkactions.py
+"""
+Edits of many media at once, as a handful of set-based statements.
+
+Saving or deleting media one at a time costs several queries and signals
+per row, tens of thousands of them inside one transaction. These functions
+UPDATE ... WHERE id IN (the selection), insert and delete tag links on the
+through table in bulk and delete by batches of BATCH_SIZE primary keys,
+in one transaction each.
+
+No per-row signals fire, so they do what the receivers in myapp/signals.py
+would: updated_at moves (cached feed cards and media ETags go with it) and
+the feed version is bumped on commit. Deleted media's files, renditions and
+disk cache entries are removed after the commit by the delete_media_files
+task, FILE_BATCH_SIZE files per task.
+"""
+from itertools import islice
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from . import background, transcode
+from .mediacache import get_media_cache
+from .models import Comment, CommentArchive, Media
+from .versioning import bump_feed_version
+
+BATCH_SIZE = 1000
+FILE_BATCH_SIZE = 500
+RENDITION_FIELDS = ("video_file", "video_low_file", "hls_playlist", "webp_file")
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def _selected(queryset):
+    # a plain pk subquery: one UPDATE whatever joins or ordering the selection has
+    return Media.objects.filter(pk__in=queryset.values("pk"))
+
+
+def _update(queryset, **fields):
+    with transaction.atomic():
+        count = _selected(queryset).update(updated_at=timezone.now(), **fields)
+        transaction.on_commit(bump_feed_version)
+    return count
+
+
+def set_public(queryset, is_public):
+    """
+    Make the selected media public or private; returns how many.
+    """
+    return _update(queryset, is_public=is_public)
+
+
+def move_to_album(queryset, album):
+    """
+    Move the selected media to `album` (None: out of their album).
+    """
+    return _update(queryset, album=album)
+
+
+def add_tags(queryset, tags):
+    """
+    Tag the selected media with `tags`; links they already have are kept.
+    """
+    through = Media.tags.through
+    with transaction.atomic():
+        # tags are part of the cached feed card
+        count = _update(queryset)
+        pks = queryset.values_list("pk", flat=True).order_by().iterator(chunk_size=BATCH_SIZE)
+        for batch in _batches(pks, BATCH_SIZE):
+            through.objects.bulk_create(
+                [through(media_id=pk, tag_id=tag.pk) for pk in batch for tag in tags],
+                batch_size=BATCH_SIZE,
+                ignore_conflicts=True,
+            )
+    return count
+
+
+def remove_tags(queryset, tags):
+    """
+    Take `tags` off the selected media.
+    """
+    with transaction.atomic():
+        # before the selection (say, by one of these tags) changes
+        count = _update(queryset)
+        Media.tags.through.objects.filter(
+            media_id__in=queryset.values("pk"),
+            tag__in=tags,
+        ).delete()
+    return count
+
+
+def delete_media(queryset):
+    """
+    Delete the selected media with their comments, comment archives and tag
+    links; returns how many. Media.delete() and the post_delete receivers
+    don't run: their files and renditions are deleted once the transaction
+    commits.
+    """
+    pks, names, renditions = [], [], []
+    deleted = 0
+    with transaction.atomic():
+        rows = queryset.values_list("pk", "file", *RENDITION_FIELDS).order_by()
+        for pk, name, *rendition_names in rows.iterator(chunk_size=BATCH_SIZE):
+            pks.append(pk)
+            if name:
+                names.append(name)
+            if any(rendition_names):
+                renditions.append(pk)
+        for batch in _batches(pks, BATCH_SIZE):
+            # nobody is left to be told about these comments, and comment_count
+            # would be kept up to date on rows about to go
+            Comment.objects.filter(media_id__in=batch)._raw_delete(Comment.objects.db)
+            CommentArchive.objects.filter(media_id__in=batch)._raw_delete(CommentArchive.objects.db)
+            Media.tags.through.objects.filter(media_id__in=batch)._raw_delete(Media.objects.db)
+            deleted += Media.objects.filter(pk__in=batch)._raw_delete(Media.objects.db)
+        transaction.on_commit(lambda: _schedule_file_deletes(names, renditions))
+        transaction.on_commit(bump_feed_version)
+    return deleted
+
+
+def _schedule_file_deletes(names, renditions):
+    from .tasks import delete_media_files
+
+    for batch in _batches(names, FILE_BATCH_SIZE):
+        background.send(delete_media_files, batch, [])
+    for batch in _batches(renditions, FILE_BATCH_SIZE):
+        background.send(delete_media_files, [], batch)
+
+
+def delete_files(names, rendition_pks, storage=default_storage):
+    """
+    Delete uploads by name and the renditions of media by pk, with their
+    disk cache entries.
+    """
+    for name in names:
+        storage.delete(name)
+        if settings.MEDIA_PROXY:
+            get_media_cache().evict(name)
+    for pk in rendition_pks:
+        transcode.delete_renditions(pk, storage)
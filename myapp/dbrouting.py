@@ -0,0 +1,92 @@
+# myapp/dbrouting.py
+"""
+Read-replica routing for the read-heavy views.
+
+Only views wrapped in @replica_reads send their myapp queries to a replica,
+everything else (auth, sessions, writes, admin) stays on the primary.
+
+Replicas lag behind, so once a browser has written something (any
+successful POST) PinPrimaryMiddleware sets a short-lived cookie and that
+browser reads from the primary until it expires: you always see your own
+comment, even if the rest of the world sees it a moment later.
+"""
+import random
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.deprecation import MiddlewareMixin
+
+PIN_COOKIE = "memelord_primary"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS", "TRACE")
+
+# set for the duration of a @replica_reads view; asgiref copies context vars
+# into sync_to_async threads, so async ORM calls see it too
+_replica_reads = ContextVar("replica_reads", default=False)
+
+
+def replica_aliases():
+    return getattr(settings, "DATABASE_REPLICAS", [])
+
+
+def _pinned(request):
+    return PIN_COOKIE in request.COOKIES
+
+
+def replica_reads(view_func):
+    """
+    Serve this view's reads from a replica unless the browser is pinned
+    to the primary after a recent write.
+    """
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def _wrapped_view(request, *args, **kwargs):
+            token = _replica_reads.set(not _pinned(request))
+            try:
+                return await view_func(request, *args, **kwargs)
+            finally:
+                _replica_reads.reset(token)
+    else:
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            token = _replica_reads.set(not _pinned(request))
+            try:
+                return view_func(request, *args, **kwargs)
+            finally:
+                _replica_reads.reset(token)
+    return _wrapped_view
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = replica_aliases()
+        if replicas and _replica_reads.get() and model._meta.app_label == "myapp":
+            return random.choice(replicas)
+        return None
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in replica_aliases():
+            return False
+        return None
+
+
+class PinPrimaryMiddleware(MiddlewareMixin):
+    def process_response(self, request, response):
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            response.set_cookie(
+                PIN_COOKIE,
+                "1",
+                max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True,
+                samesite="Lax",
+                secure=settings.SESSION_COOKIE_SECURE,
+            )
+        return response
@@ -1,6 +1,14 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import JsonResponse
 from django.shortcuts import redirect
 from django.urls import resolve, Resolver404
-from functools import wraps
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import quote_etag
 
 def custom_decorator(view_func):
     @wraps(view_func)
@@ -9,3 +17,79 @@ def custom_decorator(view_func):
             print("User is not authenticated.")
         return view_func(request, *args, **kwargs)
     return _wrapped_view
+
+
+def aetag(version_func):
+    """
+    Async counterpart of django.views.decorators.http.etag() for
+    authenticated HTML/JSON views.
+
+    version_func(request, *args, **kwargs) is awaited before the view runs and
+    returns the resource's version (or None to skip). The ETag also covers the
+    path, the user, their CSRF cookie (pages embed the token), the query
+    string, the app version and the age of signed media URLs, so a 304 is
+    only sent when the client's copy is still exact and its URLs still work.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        async def _wrapped_view(request, *args, **kwargs):
+            res_etag = None
+            if request.method in ("GET", "HEAD"):
+                version = await version_func(request, *args, **kwargs)
+                if version is not None:
+                    user = await request.auser()
+                    key = "|".join(str(part) for part in (
+                        request.path,
+                        version,
+                        user.pk,
+                        request.COOKIES.get(settings.CSRF_COOKIE_NAME, ""),
+                        request.META.get("QUERY_STRING", ""),
+                        request.headers.get("x-requested-with", ""),
+                        settings.VERSION,
+                        _signed_url_period(),
+                    ))
+                    res_etag = quote_etag(hashlib.sha256(key.encode()).hexdigest()[:32])
+                    response = get_conditional_response(request, etag=res_etag)
+                    if response is not None:
+                        return _with_validators(response, res_etag)
+
+            response = await view_func(request, *args, **kwargs)
+            if res_etag:
+                _with_validators(response, res_etag)
+            return response
+        return _wrapped_view
+    return decorator
+
+
+def _signed_url_period():
+    """
+    Without MEDIA_PROXY, S3 hands out URLs signed for querystring_expire
+    seconds. Responses carry them, so a cached copy must be replaced while
+    they are still valid: the ETag changes every half of that lifetime,
+    which leaves every URL a client holds at least the other half.
+    """
+    if settings.MEDIA_PROXY or not getattr(default_storage, "querystring_auth", False):
+        return ""
+    return int(time.time() // max(default_storage.querystring_expire // 2, 1))
+
+
+def _with_validators(response, etag):
+    response.headers.setdefault("ETag", etag)
+    # revalidate every time; the version check is a single indexed lookup
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ("Cookie",))
+    return response
+
+
+def api_login_required(view_func):
+    """
+    login_required for the JSON API (async views): a 401 instead of the
+    redirect to the login page. Sets request.user.
+    """
+    @wraps(view_func)
+    async def _wrapped_view(request, *args, **kwargs):
+        request.user = await request.auser()
+        if not request.user.is_authenticated:
+            return JsonResponse({"error": "Authentication required"}, status=401)
+        return await view_func(request, *args, **kwargs)
+    return _wrapped_view
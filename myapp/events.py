@@ -0,0 +1,157 @@
+# myapp/events.py
+"""
+Tiny pub/sub layer for pushing live updates (new comments, new uploads)
+to browsers over Server-Sent Events.
+
+- LocalBroker fans out in-process; good enough for single-node SQLite installs
+- RedisBroker publishes through Redis so every replica sees every event.
+  Each process keeps a single pattern subscription and fans out locally,
+  so idle browser connections don't cost a Redis connection each.
+"""
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = "memelord:events:"
+FEED_CHANNEL = "feed"
+HEARTBEAT_SECONDS = 15
+QUEUE_SIZE = 100
+
+
+def comments_channel(media_id):
+    return f"media.{media_id}.comments"
+
+
+def _offer(queue, message):
+    # runs on the subscriber's loop; slow consumers just miss events
+    try:
+        queue.put_nowait(message)
+    except asyncio.QueueFull:
+        pass
+
+
+class LocalBroker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def publish(self, channel, event, data):
+        self._dispatch({"channel": channel, "event": event, "data": data})
+
+    def _dispatch(self, message):
+        with self._lock:
+            targets = list(self._subscribers.get(message["channel"], ()))
+        for loop, queue in targets:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, message)
+            except RuntimeError:
+                # loop already closed, subscription is about to go away
+                pass
+
+    async def subscribe(self, channels, heartbeat=HEARTBEAT_SECONDS):
+        """
+        Yield messages for the given channels; yields None every
+        `heartbeat` seconds of silence so callers can send keep-alives.
+        """
+        subscription = (asyncio.get_running_loop(), asyncio.Queue(QUEUE_SIZE))
+        with self._lock:
+            for channel in channels:
+                self._subscribers[channel].add(subscription)
+        try:
+            while True:
+                try:
+                    yield await asyncio.wait_for(subscription[1].get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            with self._lock:
+                for channel in channels:
+                    self._subscribers[channel].discard(subscription)
+                    if not self._subscribers[channel]:
+                        del self._subscribers[channel]
+
+
+class RedisBroker(LocalBroker):
+    def __init__(self, host, port, db, password=None):
+        super().__init__()
+        self._params = {"host": host, "port": int(port), "db": int(db), "password": password or None}
+        self._client = None
+        self._listeners = {}
+
+    def publish(self, channel, event, data):
+        import redis
+
+        if self._client is None:
+            self._client = redis.Redis(**self._params)
+        message = {"channel": channel, "event": event, "data": data}
+        # delivered back to us (and every other replica) by _listen()
+        self._client.publish(CHANNEL_PREFIX + channel, json.dumps(message))
+
+    async def subscribe(self, channels, heartbeat=HEARTBEAT_SECONDS):
+        loop = asyncio.get_running_loop()
+        listener = self._listeners.get(loop)
+        if listener is None or listener.done():
+            self._listeners[loop] = loop.create_task(self._listen())
+
+        async for message in super().subscribe(channels, heartbeat):
+            yield message
+
+    async def _listen(self):
+        import redis.asyncio
+
+        while True:
+            try:
+                client = redis.asyncio.Redis(**self._params)
+                async with client.pubsub() as pubsub:
+                    await pubsub.psubscribe(CHANNEL_PREFIX + "*")
+                    async for raw in pubsub.listen():
+                        if raw["type"] != "pmessage":
+                            continue
+                        self._dispatch(json.loads(raw["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning("Redis event listener failed, reconnecting", exc_info=True)
+                await asyncio.sleep(1)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            if settings.REDIS_HOST:
+                _broker = RedisBroker(
+                    settings.REDIS_HOST,
+                    settings.REDIS_PORT,
+                    settings.REDIS_DB,
+                    settings.REDIS_PASSWORD,
+                )
+            else:
+                _broker = LocalBroker()
+        return _broker
+
+
+def publish(channel, event, data):
+    """
+    Fire-and-forget; a broken broker must never break the request.
+    """
+    if not settings.REALTIME_UPDATES:
+        return
+    try:
+        get_broker().publish(channel, event, data)
+    except Exception:
+        logger.warning("Failed to publish %s on %s", event, channel, exc_info=True)
+
+
+def subscribe(channels, heartbeat=HEARTBEAT_SECONDS):
+    return get_broker().subscribe(channels, heartbeat)
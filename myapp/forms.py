@@ -1,6 +1,7 @@
 import os
 import re
 from django import forms
+from . import mediainfo
 from .models import *
 
 
@@ -56,6 +57,61 @@ def validate_magic_header(file, ext):
     return False
 
 
+def validate_media_file(f, content_type):
+    """
+    Check an upload against the whitelists and its magic bytes. Returns
+    (media type, metadata fields); raises forms.ValidationError.
+    """
+    ext = os.path.splitext(f.name)[1].lower()
+
+    # 1) Validate extension whitelist
+    if ext not in ALLOWED_EXTS:
+        raise forms.ValidationError(
+            f"File type not allowed. Allowed extensions: {', '.join(sorted(ALLOWED_EXTS))}"
+        )
+
+    # 2) Validate MIME whitelist
+    if content_type not in ALLOWED_MIME_TYPES:
+        raise forms.ValidationError(
+            "Invalid or unsafe file type (blocked MIME type)."
+        )
+
+    # 3) Validate magic bytes
+    if not validate_magic_header(f, ext):
+        raise forms.ValidationError(
+            "File signature does not match its extension. Upload rejected."
+        )
+
+    # 4) Media type for the model
+    if content_type.startswith("image/"):
+        media_type = Media.MediaType.IMAGE
+    else:
+        media_type = Media.MediaType.VIDEO
+
+    # 5) Header metadata (the transcoding worker completes it) and checksum
+    metadata = {
+        "byte_size": f.size,
+        "checksum": mediainfo.checksum(f),
+        **mediainfo.read_metadata(f, f.name),
+    }
+    return media_type, metadata
+
+
+def get_tags(names):
+    """
+    The tags of the given names, created if needed; names match
+    case-insensitively.
+    """
+    tags = []
+    for name in names:
+        tag, _ = Tag.objects.get_or_create(
+            name__iexact=name,
+            defaults={"name": name},
+        )
+        tags.append(tag)
+    return tags
+
+
 class MediaUploadForm(forms.ModelForm):
     tags_input = forms.CharField(
         max_length=200,
@@ -81,33 +137,9 @@ class MediaUploadForm(forms.ModelForm):
 
     def clean_file(self):
         f = self.cleaned_data["file"]
-        content_type = getattr(f, "content_type", "") or ""
-        ext = os.path.splitext(f.name)[1].lower()
-
-        # 1) Validate extension whitelist
-        if ext not in ALLOWED_EXTS:
-            raise forms.ValidationError(
-                f"File type not allowed. Allowed extensions: {', '.join(sorted(ALLOWED_EXTS))}"
-            )
-
-        # 2) Validate MIME whitelist
-        if content_type not in ALLOWED_MIME_TYPES:
-            raise forms.ValidationError(
-                "Invalid or unsafe file type (blocked MIME type)."
-            )
-
-        # 3) Validate magic bytes
-        if not validate_magic_header(f, ext):
-            raise forms.ValidationError(
-                "File signature does not match its extension. Upload rejected."
-            )
-
-        # 4) Set media type for model
-        if content_type.startswith("image/"):
-            self.cleaned_data["media_type"] = Media.MediaType.IMAGE
-        else:
-            self.cleaned_data["media_type"] = Media.MediaType.VIDEO
-
+        media_type, metadata = validate_media_file(f, getattr(f, "content_type", "") or "")
+        self.cleaned_data["media_type"] = media_type
+        self.cleaned_data["metadata"] = metadata
         return f
 
     # --- Tag parsing helpers ---
@@ -122,19 +154,14 @@ class MediaUploadForm(forms.ModelForm):
         media = super().save(commit=False)
         media.uploader = user
         media.media_type = self.cleaned_data["media_type"]
+        for field, value in self.cleaned_data.get("metadata", {}).items():
+            setattr(media, field, value)
 
         if commit:
             media.save()
 
         # Tags
-        tag_names = self._parse_tags()
-        tags = []
-        for name in tag_names:
-            tag, _ = Tag.objects.get_or_create(
-                name__iexact=name,
-                defaults={"name": name},
-            )
-            tags.append(tag)
+        tags = get_tags(self._parse_tags())
 
         if commit:
             media.tags.set(tags)
@@ -190,4 +217,37 @@ class MediaTagForm(forms.Form):
     def parse_tags(self):
         raw = self.cleaned_data.get("tags_input") or ""
         parts = re.split(r"[,#;]", raw)
-        return [p.strip() for p in parts if p.strip()]
\ No newline at end of file
+        return [p.strip() for p in parts if p.strip()]
+
+class MediaImportForm(forms.Form):
+    archive = forms.FileField(
+        label="Export",
+        help_text="ZIP (files + metadata.json) or JSON from the media export actions.",
+    )
+
+    def clean_archive(self):
+        f = self.cleaned_data["archive"]
+        if os.path.splitext(f.name)[1].lower() not in {".zip", ".json"}:
+            raise forms.ValidationError("Upload a .zip or .json export.")
+        return f
+
+
+class MediaBulkTagsForm(forms.Form):
+    tags = forms.CharField(
+        max_length=200,
+        help_text="Comma separated tags, e.g. 'funny, cat, linux'",
+    )
+
+    def clean_tags(self):
+        names = [p.strip() for p in re.split(r"[,#;]", self.cleaned_data["tags"]) if p.strip()]
+        if not names:
+            raise forms.ValidationError("Enter at least one tag.")
+        return names
+
+
+class MediaAlbumForm(forms.Form):
+    album = forms.ModelChoiceField(
+        Album.objects.order_by("title"),
+        required=False,
+        empty_label="No album",
+    )
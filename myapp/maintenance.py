@@ -0,0 +1,258 @@
+# myapp/maintenance.py
+"""
+Periodic upkeep of the database, the media storage and the caches.
+
+Celery beat runs each job through its task in myapp/tasks.py (schedules
+registered by migration 0014, editable in the admin); `manage.py
+maintenance <job>` runs them by hand:
+
+- optimize: fresh planner statistics for the hot tables (ANALYZE; on
+  SQLite sampled, followed by a WAL checkpoint). Autovacuum never analyzes
+  the partitioned comment table on PostgreSQL, only its partitions.
+- vacuum: SQLite VACUUM, weekly; PostgreSQL leaves it to autovacuum.
+- reconcile: Media.comment_count back in line with the live and archived
+  comments.
+- sweep: stored files nothing refers to any more: uploads without a media
+  row, renditions of deleted media and imports a dead worker left behind.
+- warm: the first feed pages' cards and uploader names, before the first
+  visitor after an edit asks for them.
+- uploads: unfinished resumable uploads past RESUMABLE_UPLOAD_EXPIRE_HOURS.
+
+A job holds a lock in the cache while it runs, so if several beat
+instances (one per replica) schedule it, or a run outlasts its interval,
+only one copy does the work. With Redis as the cache the lock is shared
+by all replicas.
+"""
+import datetime
+from contextlib import contextmanager
+from itertools import islice
+from uuid import uuid4
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from . import resumable, transcode
+from .mediacache import get_media_cache
+from .models import Comment, CommentArchive, Media
+from .usercache import UserNames
+from .versioning import aget_feed_version, bump_feed_version
+
+LOCK_PREFIX = "memelord:maintenance:"
+# the tables every page reads or writes
+HOT_TABLES = ("myapp_media", "myapp_media_tags", "myapp_tag", "myapp_comment", "myapp_commentarchive")
+# rows SQLite's ANALYZE samples per index
+SQLITE_ANALYSIS_LIMIT = 1000
+RECONCILE_BATCH_SIZE = 10000
+SWEEP_BATCH_SIZE = 1000
+UPLOADS_DIR = "memes"
+IMPORTS_DIR = "imports"
+
+
+@contextmanager
+def lock(job, timeout):
+    """
+    Hold the job's lock for at most `timeout` seconds; yields False if
+    another run holds it.
+    """
+    key = f"{LOCK_PREFIX}{job}"
+    token = uuid4().hex
+    if not cache.add(key, token, timeout):
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        # not if it expired and another run took it meanwhile
+        if cache.get(key) == token:
+            cache.delete(key)
+
+
+def optimize_database(using="default"):
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute(f"ANALYZE {', '.join(HOT_TABLES)}")
+            return f"Analyzed {len(HOT_TABLES)} tables"
+        if connection.vendor != "sqlite":
+            return f"Nothing to do on {connection.vendor}"
+        cursor.execute(f"PRAGMA analysis_limit={SQLITE_ANALYSIS_LIMIT}")
+        for table in HOT_TABLES:
+            cursor.execute(f"ANALYZE {table}")
+        # the WAL only shrinks when a checkpoint finds no reader in it
+        cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        busy, _, _ = cursor.fetchone()
+    return f"Analyzed {len(HOT_TABLES)} tables, " + (
+        "WAL busy, checkpoint left for later" if busy else "WAL checkpointed"
+    )
+
+
+def vacuum_database(using="default"):
+    connection = connections[using]
+    if connection.vendor != "sqlite":
+        return f"Left to autovacuum on {connection.vendor}"
+    # rewrites the whole file; writers wait on the busy timeout meanwhile
+    with connection.cursor() as cursor:
+        cursor.execute("VACUUM")
+    return "Vacuumed the database"
+
+
+def reconcile_comment_counts(batch_size=RECONCILE_BATCH_SIZE):
+    """
+    Fix the comment_count of media that drifted from their live plus
+    archived comments, by primary key ranges; returns how many.
+    """
+    live = (
+        Comment.objects.filter(media=OuterRef("pk"))
+        .order_by()
+        .values("media")
+        .annotate(count=Count("pk"))
+        .values("count")
+    )
+    archived = CommentArchive.objects.filter(media=OuterRef("pk")).values("comment_count")
+    actual = Coalesce(Subquery(live), 0) + Coalesce(Subquery(archived), 0)
+
+    last = Media.objects.aggregate(last=Max("pk"))["last"] or 0
+    fixed = 0
+    for start in range(0, last + 1, batch_size):
+        drifted = (
+            Media.objects.filter(pk__gte=start, pk__lt=start + batch_size)
+            .annotate(actual=actual)
+            .exclude(comment_count=F("actual"))
+            .values("pk")
+        )
+        fixed += Media.objects.filter(pk__in=drifted).update(
+            comment_count=actual,
+            comment_version=F("comment_version") + 1,
+        )
+    if fixed:
+        bump_feed_version()
+    return fixed
+
+
+def _batches(iterable, size=SWEEP_BATCH_SIZE):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def _older_than(storage, name, cutoff):
+    try:
+        return storage.get_modified_time(name) < cutoff
+    except FileNotFoundError:
+        return False
+
+
+def sweep_orphans(storage=default_storage):
+    """
+    Delete stored files without a media row; returns (uploads, renditions,
+    imports) deleted. Files younger than ORPHAN_GRACE_HOURS are kept: an
+    upload is stored before its row is committed.
+    """
+    cutoff = timezone.now() - datetime.timedelta(hours=settings.ORPHAN_GRACE_HOURS)
+
+    uploads = 0
+    for batch in _batches(transcode._walk(storage, UPLOADS_DIR)):
+        known = set(Media.objects.filter(file__in=batch).values_list("file", flat=True))
+        for name in batch:
+            if name not in known and _older_than(storage, name, cutoff):
+                storage.delete(name)
+                if settings.MEDIA_PROXY:
+                    get_media_cache().evict(name)
+                uploads += 1
+
+    try:
+        directories, _ = storage.listdir(transcode.RENDITIONS_DIR)
+    except FileNotFoundError:
+        directories = []
+    renditions = 0
+    for batch in _batches(int(name) for name in directories if name.isdigit()):
+        known = set(Media.objects.filter(pk__in=batch).values_list("pk", flat=True))
+        for pk in batch:
+            # the file system keeps the emptied directories
+            if pk not in known and any(transcode._walk(storage, transcode.rendition_dir(pk))):
+                transcode.delete_renditions(pk, storage)
+                renditions += 1
+
+    imports = 0
+    try:
+        _, files = storage.listdir(IMPORTS_DIR)
+    except FileNotFoundError:
+        files = []
+    for name in files:
+        # the import task deletes its upload when done; what's left is from a dead worker
+        if _older_than(storage, f"{IMPORTS_DIR}/{name}", cutoff):
+            storage.delete(f"{IMPORTS_DIR}/{name}")
+            imports += 1
+    return uploads, renditions, imports
+
+
+def warm_caches(pages=None):
+    """
+    Render the cards of the first `pages` feed pages (default
+    CACHE_WARM_FEED_PAGES) into the fragment cache, with their uploaders'
+    names; returns how many cards.
+    """
+    from .views import MEDIA_PER_PAGE
+
+    async_to_sync(aget_feed_version)()
+    pages = settings.CACHE_WARM_FEED_PAGES if pages is None else pages
+    # the feed's first pages, as meme_list queries them for everyone
+    # (visible_to()'s public part)
+    queryset = (
+        Media.objects.filter(Q(is_public=True) & (Q(album__isnull=True) | Q(album__is_private=False)))
+        .select_related("album")
+        .prefetch_related("tags")
+    )
+    paginator = Paginator(queryset[:pages * MEDIA_PER_PAGE], MEDIA_PER_PAGE)
+    names = UserNames()
+    cards = 0
+    for number in paginator.page_range:
+        page = paginator.page(number)
+        page.object_list = list(page.object_list)
+        resolved = async_to_sync(names.aresolve)(media.uploader_id for media in page.object_list)
+        for media in page.object_list:
+            media.resolve_urls()
+            media.uploader_name = resolved.get(media.uploader_id, "")
+        render_to_string("myapp/partials/meme_grid.html", {"page_obj": page})
+        cards += len(page.object_list)
+    return cards
+
+
+def delete_stale_uploads():
+    return resumable.delete_stale(max_age=None)
+
+
+# job: (function, seconds its lock lasts at most, report of the result)
+JOBS = {
+    "optimize": (optimize_database, 30 * 60, "{}"),
+    "vacuum": (vacuum_database, 2 * 60 * 60, "{}"),
+    "reconcile": (reconcile_comment_counts, 60 * 60, "Fixed the comment count of {} media"),
+    "sweep": (
+        sweep_orphans,
+        2 * 60 * 60,
+        "Deleted {} orphaned upload(s), the renditions of {} deleted media and {} abandoned import(s)",
+    ),
+    "warm": (warm_caches, 5 * 60, "Rendered {} feed card(s)"),
+    "uploads": (delete_stale_uploads, 30 * 60, "Deleted {} stale resumable upload(s)"),
+}
+
+
+def run(job):
+    """
+    Run a job under its lock; returns its report, None if another run holds
+    the lock.
+    """
+    function, timeout, report = JOBS[job]
+    with lock(job, timeout) as held:
+        if not held:
+            return None
+        result = function()
+    return report.format(*result) if isinstance(result, tuple) else report.format(result)
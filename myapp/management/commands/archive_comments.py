@@ -0,0 +1,67 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+from django.utils import timezone
+
+from myapp.archive import archive_thread
+from myapp.models import Comment
+
+
+class Command(BaseCommand):
+    help = (
+        "Compact the comments of threads that have been quiet for a while "
+        "into one compressed archive per media."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.COMMENT_ARCHIVE_AFTER_DAYS,
+            help="Archive threads without new comments for this many days (default: COMMENT_ARCHIVE_AFTER_DAYS).",
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=1000,
+            help="Archive at most this many threads per run.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report which threads would be archived.",
+        )
+
+    def handle(self, *args, **options):
+        if options["days"] <= 0:
+            self.stdout.write("[i] Comment archival is disabled (COMMENT_ARCHIVE_AFTER_DAYS=0)")
+            return
+
+        cutoff = timezone.now() - datetime.timedelta(days=options["days"])
+        # an index-only scan of the (media, -created_at) index
+        cold = (
+            Comment.objects
+            .order_by()
+            .values("media_id")
+            .annotate(newest=Max("created_at"))
+            .filter(newest__lt=cutoff)
+            .values_list("media_id", flat=True)[:options["limit"]]
+        )
+
+        threads = comments = 0
+        for media_id in list(cold):
+            if options["dry_run"]:
+                self.stdout.write(f"[i] Would archive comments of media #{media_id}")
+                threads += 1
+                continue
+            archived = archive_thread(media_id, cutoff)
+            if archived:
+                threads += 1
+                comments += archived
+
+        if options["dry_run"]:
+            self.stdout.write(f"[i] {threads} thread(s) to archive")
+        else:
+            self.stdout.write(f"[~] Archived {comments} comment(s) from {threads} thread(s)")
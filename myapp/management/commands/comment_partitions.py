@@ -0,0 +1,45 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from myapp import partitions
+
+
+class Command(BaseCommand):
+    help = (
+        "PostgreSQL: create the comment table's monthly partitions ahead of "
+        "time and drop old partitions that archival has emptied."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--months-ahead",
+            type=int,
+            default=settings.COMMENT_PARTITION_PREMAKE_MONTHS,
+            help="Partitions to keep ready after the current month.",
+        )
+
+    def handle(self, *args, **options):
+        connection = connections[DEFAULT_DB_ALIAS]
+        if not partitions.is_partitioned(connection):
+            self.stdout.write("[i] Comments are not partitioned on this database, nothing to do")
+            return
+
+        this_month = partitions.month_start(datetime.date.today())
+        with transaction.atomic():
+            # months missed earlier (rows parked in the default partition) first
+            stray = partitions.oldest_default_row(connection)
+            created = partitions.create_partitions(
+                connection,
+                min(this_month, stray.date()) if stray else this_month,
+                partitions.add_months(this_month, options["months_ahead"]),
+            )
+            # last month stays, comments posted around midnight UTC may still land there
+            dropped = partitions.drop_empty_partitions(connection, partitions.add_months(this_month, -1))
+
+        for name in created:
+            self.stdout.write(f"[+] Created partition {name}")
+        for name in dropped:
+            self.stdout.write(f"[-] Dropped empty partition {name}")
@@ -0,0 +1,43 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp.mediaimport import MediaImportError, import_path
+
+
+class Command(BaseCommand):
+    help = (
+        "Restore media from the admin's ZIP export (files + metadata.json) or a "
+        "JSON export, in batches and with parallel uploads. Safe to run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="ZIP or JSON export.")
+        parser.add_argument("--batch-size", type=int, default=500, help="Media rows per transaction.")
+        parser.add_argument("--workers", type=int, default=8, help="Parallel file uploads.")
+        parser.add_argument("--user", help="Username owning media without an uploader.")
+
+    def handle(self, *args, **options):
+        default_user = None
+        if options["user"]:
+            try:
+                default_user = get_user_model().objects.get(username=options["user"])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"No user {options['user']}")
+
+        try:
+            stats = import_path(
+                options["path"],
+                batch_size=max(1, options["batch_size"]),
+                workers=max(1, options["workers"]),
+                default_user=default_user,
+                log=self.stdout.write,
+            )
+        except (OSError, MediaImportError) as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(
+            f"[+] Imported {stats.created} media ({stats.uploaded} file(s) uploaded), "
+            f"{stats.existing} already there, {stats.missing} skipped, {stats.failed} failed"
+        )
+        if stats.created:
+            self.stdout.write("[i] Run transcode_media --missing for the video and GIF renditions")
@@ -0,0 +1,50 @@
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# what a web worker imports before it can serve its first request
+STARTUP_CODE = """
+import django
+django.setup()
+from django.urls import get_resolver
+get_resolver()._populate()
+"""
+
+
+class Command(BaseCommand):
+    help = "Report where process start-up spends its import time, per top-level package."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=20, help="Number of packages to show.")
+
+    def handle(self, *args, **options):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", STARTUP_CODE],
+            capture_output=True,
+            text=True,
+            env={**os.environ, "DJANGO_SETTINGS_MODULE": settings.SETTINGS_MODULE},
+        )
+        if result.returncode:
+            self.stderr.write(result.stderr)
+            return
+
+        # lines look like "import time:  self [us] | cumulative | imported package"
+        per_package = defaultdict(int)
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:"):
+                continue
+            self_us, _, name = line[len("import time:"):].split("|")
+            if not self_us.strip().isdigit():
+                continue  # header line
+            per_package[name.strip().split(".")[0]] += int(self_us)
+
+        total = sum(per_package.values())
+        self.stdout.write(f"{'package':<30} {'ms':>8} {'share':>7}")
+        for name, us in sorted(per_package.items(), key=lambda item: -item[1])[: options["limit"]]:
+            self.stdout.write(f"{name:<30} {us / 1000:>8.1f} {us / total:>7.1%}")
+        self.stdout.write(f"{'total':<30} {total / 1000:>8.1f}")
+
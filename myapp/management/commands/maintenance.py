@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from myapp import maintenance
+
+
+class Command(BaseCommand):
+    help = (
+        "Run periodic maintenance jobs (see myapp/maintenance.py): planner "
+        "statistics, VACUUM, comment count reconciliation, orphaned file "
+        "sweeps, cache warming and stale upload cleanup."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("jobs", nargs="+", choices=list(maintenance.JOBS))
+
+    def handle(self, *args, **options):
+        for job in options["jobs"]:
+            report = maintenance.run(job)
+            if report is None:
+                self.stdout.write(f"[i] '{job}' is running elsewhere, skipping")
+            else:
+                self.stdout.write(f"[~] {report}")
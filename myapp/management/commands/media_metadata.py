@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from myapp import mediainfo, transcode
+from myapp.models import Media
+from myapp.versioning import bump_feed_version
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill in the size, dimensions, duration, frame count, codec and checksum "
+        "of media uploaded or imported before they were recorded, from the file "
+        "headers (and ffprobe for videos, if installed)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("ids", nargs="*", type=int, help="Media to read.")
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Read all media again, not only those without metadata.",
+        )
+
+    def _probe(self, media):
+        with tempfile.TemporaryDirectory(prefix="metadata-") as tmp:
+            source = os.path.join(tmp, "source" + os.path.splitext(media.file.name)[1])
+            with media.file.open("rb") as src, open(source, "wb") as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            return mediainfo.metadata_from_probe(transcode.probe(source))
+
+    def handle(self, *args, **options):
+        media_items = Media.objects.order_by("pk")
+        if options["ids"]:
+            media_items = media_items.filter(pk__in=options["ids"])
+        elif not options["all"]:
+            media_items = media_items.filter(Q(byte_size__isnull=True) | Q(checksum=""))
+        can_probe = shutil.which(settings.FFPROBE_BINARY) is not None
+
+        done = failed = 0
+        for media in media_items.iterator():
+            try:
+                with media.file.open("rb") as f:
+                    fields = {
+                        "byte_size": media.file.size,
+                        "checksum": mediainfo.checksum(f),
+                        **mediainfo.read_metadata(f, f.name),
+                    }
+                if media.media_type == Media.MediaType.VIDEO and can_probe:
+                    fields.update(self._probe(media))
+            except (OSError, transcode.TranscodeError) as e:
+                self.stdout.write(f"[!] Reading media #{media.pk} ({media.file.name}) failed: {e}")
+                failed += 1
+                continue
+            # updated_at: the cached cards change with it
+            Media.objects.filter(pk=media.pk).update(updated_at=timezone.now(), **fields)
+            done += 1
+
+        if done:
+            bump_feed_version()
+        self.stdout.write(f"[+] Read metadata of {done} file(s), {failed} failed")
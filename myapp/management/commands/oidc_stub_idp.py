@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from myapp.oidcstub import StubIdP
+
+
+class Command(BaseCommand):
+    help = (
+        "Run a local OpenID provider for development: signs everyone in as "
+        "--email without asking, with RS256 tokens, refresh tokens and "
+        "optional key rotation. Never expose it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8001)
+        parser.add_argument("--email", default="dev@example.com", help="The user everyone signs in as.")
+        parser.add_argument("--client-id", default="memelord")
+        parser.add_argument("--client-secret", default="memelord")
+        parser.add_argument("--token-lifetime", type=int, default=300, help="ID token lifetime in seconds.")
+        parser.add_argument(
+            "--rotate-keys",
+            type=int,
+            default=0,
+            metavar="SECONDS",
+            help="Switch to a new signing key this often (0: never).",
+        )
+
+    def handle(self, *args, **options):
+        idp = StubIdP(
+            host=options["host"],
+            port=options["port"],
+            email=options["email"],
+            client_id=options["client_id"],
+            client_secret=options["client_secret"],
+            token_lifetime=options["token_lifetime"],
+        ).start()
+        self.stdout.write(f"[+] Stub OpenID provider on {idp.url}, signing in as {options['email']}")
+        self.stdout.write("[i] Environment for the app:")
+        self.stdout.write("OIDC_ENABLED=True")
+        for name, value in idp.settings().items():
+            self.stdout.write(f"{name}={value}")
+        try:
+            while True:
+                time.sleep(options["rotate_keys"] or 3600)
+                if options["rotate_keys"]:
+                    idp.rotate_key()
+                    self.stdout.write("[~] Rotated the signing key")
+        except KeyboardInterrupt:
+            idp.stop()
@@ -0,0 +1,107 @@
+import hashlib
+import secrets
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.staticfiles.finders import get_finders
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.migrations.executor import MigrationExecutor
+
+from myapp import partitions
+
+STATIC_FINGERPRINT_FILE = ".static-fingerprint"
+IGNORE_PATTERNS = ["CVS", ".*", "*~"]  # collectstatic's defaults
+
+
+class Command(BaseCommand):
+    help = (
+        "Container start-up in a single process: migrate and collectstatic "
+        "only when something changed, optionally create the admin account."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--init",
+            action="store_true",
+            help="Create the 'admin' superuser with a random password.",
+        )
+        parser.add_argument(
+            "--static-only",
+            action="store_true",
+            help="Only build the static files (used at image build time, no database needed).",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Run migrate and collectstatic regardless of fingerprints.",
+        )
+
+    def handle(self, *args, **options):
+        if options["static_only"]:
+            self.collectstatic(force=options["force"])
+            return
+        self.migrate(force=options["force"])
+        self.comment_partitions()
+        self.collectstatic(force=options["force"])
+        if options["init"]:
+            self.create_admin()
+
+    def migrate(self, force=False):
+        connection = connections[DEFAULT_DB_ALIAS]
+        executor = MigrationExecutor(connection)
+        plan = executor.migration_plan(executor.loader.graph.leaf_nodes())
+        if not plan and not force:
+            self.stdout.write("[i] Database schema up to date, skipping migrate")
+            return
+        self.stdout.write(f"[~] Applying {len(plan)} migration(s)")
+        call_command("migrate", interactive=False, verbosity=0)
+
+    def comment_partitions(self):
+        # keeps months covered even where no Celery beat is running
+        if partitions.is_partitioned(connections[DEFAULT_DB_ALIAS]):
+            call_command("comment_partitions")
+
+    def static_fingerprint(self):
+        digest = hashlib.sha256()
+        # hashing/compression depends on the backend, pruning on the templates (via the finders)
+        digest.update(settings.STORAGES["staticfiles"]["BACKEND"].encode())
+        entries = []
+        for finder in get_finders():
+            for path, storage in finder.list(IGNORE_PATTERNS):
+                stat = Path(storage.path(path)).stat()
+                entries.append(f"{path}:{stat.st_size}:{stat.st_mtime_ns}")
+        for entry in sorted(entries):
+            digest.update(entry.encode())
+        return digest.hexdigest()
+
+    def collectstatic(self, force=False):
+        fingerprint_file = Path(settings.STATIC_ROOT) / STATIC_FINGERPRINT_FILE
+        fingerprint = self.static_fingerprint()
+        try:
+            unchanged = fingerprint_file.read_text() == fingerprint
+        except OSError:
+            unchanged = False
+        if unchanged and not force:
+            self.stdout.write("[i] Static files up to date, skipping collectstatic")
+            return
+
+        self.stdout.write("[~] Collecting static files")
+        call_command("collectstatic", interactive=False, verbosity=0)
+        try:
+            fingerprint_file.write_text(fingerprint)
+        except OSError as e:
+            self.stderr.write(f"[!] Could not store static fingerprint: {e}")
+
+    def create_admin(self):
+        User = get_user_model()
+        if User.objects.filter(username="admin").exists():
+            return
+        password = secrets.token_urlsafe(15)
+        User.objects.create_superuser("admin", "admin@example.com", password)
+        self.stdout.write("------------------------------------")
+        self.stdout.write("[!!] Creating admin superuser account")
+        self.stdout.write(f"[>] Randomly generated password: {password}")
+        self.stdout.write("------------------------------------")
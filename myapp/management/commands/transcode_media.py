@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from myapp import transcode
+from myapp.models import Media
+
+
+class Command(BaseCommand):
+    help = (
+        "Make the web renditions of uploaded videos (faststart MP4, low bitrate "
+        "MP4, optionally HLS) and animated GIFs (MP4, animated WebP) with ffmpeg."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("ids", nargs="*", type=int, help="Media to transcode.")
+        parser.add_argument(
+            "--pending",
+            action="store_true",
+            help="Transcode all media still waiting for their renditions.",
+        )
+        parser.add_argument(
+            "--missing",
+            action="store_true",
+            help="Transcode all videos and GIFs without renditions, e.g. uploads from before transcoding.",
+        )
+
+    def handle(self, *args, **options):
+        if not transcode.enabled():
+            raise CommandError("Transcoding is disabled (TRANSCODE_VIDEOS) or ffmpeg is not installed")
+
+        videos = Media.objects.filter(
+            Q(media_type=Media.MediaType.VIDEO) | Q(file__iendswith=".gif")
+        ).order_by("pk")
+        if options["ids"]:
+            videos = videos.filter(pk__in=options["ids"])
+        elif options["pending"]:
+            videos = videos.filter(processing=Media.Processing.PENDING)
+        elif options["missing"]:
+            videos = videos.filter(video_file="").exclude(processing=Media.Processing.FAILED)
+        else:
+            raise CommandError("Give media ids, --pending or --missing")
+
+        done = failed = 0
+        for media in videos.iterator():
+            self.stdout.write(f"[~] Transcoding media #{media.pk} ({media.file.name})")
+            if transcode.process(media):
+                done += 1
+            else:
+                self.stdout.write(f"[!] Transcoding media #{media.pk} failed")
+                failed += 1
+        self.stdout.write(f"[+] Transcoded {done} file(s), {failed} failed")
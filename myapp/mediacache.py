@@ -0,0 +1,220 @@
+# myapp/mediacache.py
+"""
+Read-through disk cache for media kept in remote storage (S3).
+
+Objects are downloaded once into MEDIA_CACHE_DIR and then served from local
+disk. The cache is bounded (MEDIA_CACHE_MAX_MB) and evicts the least
+recently used files; hits refresh a file's mtime, which is what eviction
+sorts on.
+
+Misses are single-flight: threads of one process wait for the download
+already in progress, and an flock per object does the same across worker
+processes, so a burst of requests for a new meme costs one S3 GET.
+"""
+import fcntl
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+# refresh the LRU position at most this often per file
+TOUCH_INTERVAL_SECONDS = 60
+# evict down to this fraction of the limit, so not every miss triggers a scan
+LOW_WATER = 0.9
+
+
+class CachedFile:
+    def __init__(self, path, size, etag, last_modified, content_type):
+        self.path = path
+        self.size = size
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_type = content_type
+
+    def open(self):
+        return open(self.path, "rb")
+
+
+@contextmanager
+def _flock(path):
+    with open(path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class MediaCache:
+    def __init__(self, root, max_bytes):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._added_since_scan = None
+
+    def _paths(self, name):
+        digest = hashlib.sha256(name.encode()).hexdigest()
+        directory = self.root / digest[:2]
+        return directory, directory / digest, directory / f"{digest}.json"
+
+    def _lookup(self, name):
+        _, data_path, meta_path = self._paths(name)
+        try:
+            meta = json.loads(meta_path.read_text())
+            stat = data_path.stat()
+        except (OSError, ValueError):
+            return None
+        if stat.st_size != meta["size"]:
+            return None
+        if time.time() - stat.st_mtime > TOUCH_INTERVAL_SECONDS:
+            try:
+                os.utime(data_path)
+            except OSError:
+                pass
+        return CachedFile(
+            data_path,
+            meta["size"],
+            meta["etag"],
+            timezone.datetime.fromisoformat(meta["last_modified"]),
+            meta["content_type"],
+        )
+
+    def get(self, storage, name):
+        """
+        The cached copy of `name` from `storage`, downloading it on a miss.
+        """
+        entry = self._lookup(name)
+        if entry is not None:
+            return entry
+
+        with self._lock:
+            done = self._inflight.get(name)
+            owner = done is None
+            if owner:
+                done = self._inflight[name] = threading.Event()
+        if not owner:
+            done.wait()
+            # if that download failed, this one tries again
+            return self.get(storage, name)
+
+        try:
+            directory, data_path, _ = self._paths(name)
+            directory.mkdir(parents=True, exist_ok=True)
+            with _flock(f"{data_path}.lock"):
+                # another worker process may have fetched it meanwhile
+                entry = self._lookup(name)
+                if entry is None:
+                    entry = self._download(storage, name)
+            return entry
+        finally:
+            with self._lock:
+                del self._inflight[name]
+            done.set()
+
+    def _download(self, storage, name):
+        directory, data_path, meta_path = self._paths(name)
+        digest = hashlib.sha256()
+        size = 0
+        with tempfile.NamedTemporaryFile(dir=directory, prefix=".download-", delete=False) as tmp:
+            try:
+                with storage.open(name, "rb") as source:
+                    while chunk := source.read(CHUNK_SIZE):
+                        digest.update(chunk)
+                        tmp.write(chunk)
+                        size += len(chunk)
+            except BaseException:
+                os.unlink(tmp.name)
+                raise
+        os.replace(tmp.name, data_path)
+
+        try:
+            last_modified = storage.get_modified_time(name)
+        except (NotImplementedError, OSError):
+            last_modified = timezone.now()
+        meta = {
+            "name": name,
+            "size": size,
+            "etag": f'"{digest.hexdigest()[:32]}"',
+            "last_modified": last_modified.isoformat(),
+            "content_type": mimetypes.guess_type(name)[0] or "application/octet-stream",
+        }
+        with tempfile.NamedTemporaryFile("w", dir=directory, prefix=".meta-", delete=False) as tmp:
+            json.dump(meta, tmp)
+        os.replace(tmp.name, meta_path)
+
+        logger.debug("Cached %s (%d bytes)", name, size)
+        self._account(size)
+        return self._lookup(name)
+
+    def evict(self, name):
+        _, data_path, meta_path = self._paths(name)
+        for path in (meta_path, data_path):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def _account(self, size):
+        with self._lock:
+            # scan on this process' first download, then every 5% of the limit
+            if self._added_since_scan is not None:
+                self._added_since_scan += size
+                if self._added_since_scan < self.max_bytes * 0.05:
+                    return
+            self._added_since_scan = 0
+        self.enforce_limit()
+
+    def enforce_limit(self):
+        """
+        Delete least recently used files until the cache is below the limit.
+        """
+        files = []
+        total = 0
+        for path in self.root.glob("*/*"):
+            if path.suffix or path.name.startswith("."):
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        if total <= self.max_bytes:
+            return
+
+        files.sort()
+        for _, size, path in files:
+            if total <= self.max_bytes * LOW_WATER:
+                break
+            # responses already streaming this file keep their open handle
+            for stale in (path.with_suffix(".json"), path):
+                try:
+                    stale.unlink()
+                except FileNotFoundError:
+                    pass
+            total -= size
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_media_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = MediaCache(settings.MEDIA_CACHE_DIR, settings.MEDIA_CACHE_MAX_MB * 1024 * 1024)
+        return _cache
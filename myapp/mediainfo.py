@@ -0,0 +1,316 @@
+# myapp/mediainfo.py
+"""
+Facts about media files read from their headers, without decoding them.
+
+read_metadata() is cheap enough for the upload request: it reads a few
+header bytes of images and walks the box tree of MP4s (seeking over the
+media data). What it can't tell (WebM, odd files) the transcoding worker
+fills in from ffprobe (metadata_from_probe()).
+"""
+import hashlib
+import os
+import struct
+
+GIF_TRAILER = 0x3B
+GIF_EXTENSION = 0x21
+GIF_IMAGE = 0x2C
+GIF_GRAPHIC_CONTROL = 0xF9
+
+METADATA_FIELDS = ("width", "height", "duration", "frame_count", "codec")
+
+MP4_CODECS = {
+    b"avc1": "h264", b"avc3": "h264",
+    b"hvc1": "hevc", b"hev1": "hevc",
+    b"av01": "av1", b"vp09": "vp9",
+    b"mp4v": "mpeg4",
+}
+
+
+def checksum(file):
+    """
+    sha256 hex digest of the file's content; the file position is preserved.
+    """
+    position = file.tell()
+    file.seek(0)
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: file.read(1024 * 1024), b""):
+        digest.update(chunk)
+    file.seek(position)
+    return digest.hexdigest()
+
+
+def _skip_sub_blocks(file):
+    while True:
+        size = file.read(1)
+        if not size or size[0] == 0:
+            return
+        file.seek(size[0], 1)
+
+
+def gif_info(file, limit=None):
+    """
+    (frames, seconds) of a GIF, counting at most `limit` frames; the file
+    position is preserved. Only block headers are read, the image data is
+    skipped.
+    """
+    position = file.tell()
+    try:
+        file.seek(0)
+        header = file.read(13)
+        if len(header) < 13 or header[:3] != b"GIF":
+            return 0, 0
+        flags = header[10]
+        if flags & 0x80:
+            # global color table
+            file.seek(3 * 2 ** ((flags & 0x07) + 1), 1)
+
+        frames = delay = 0
+        while limit is None or frames < limit:
+            block = file.read(1)
+            if not block or block[0] == GIF_TRAILER:
+                break
+            if block[0] == GIF_EXTENSION:
+                label = file.read(1)
+                if label and label[0] == GIF_GRAPHIC_CONTROL:
+                    control = file.read(5)
+                    if len(control) == 5:
+                        # frame delay in 1/100 s
+                        delay += struct.unpack("<H", control[2:4])[0]
+                    file.seek(-len(control), 1)
+                _skip_sub_blocks(file)
+            elif block[0] == GIF_IMAGE:
+                descriptor = file.read(9)
+                if len(descriptor) < 9:
+                    break
+                frames += 1
+                if descriptor[8] & 0x80:
+                    # local color table
+                    file.seek(3 * 2 ** ((descriptor[8] & 0x07) + 1), 1)
+                file.seek(1, 1)  # LZW minimum code size
+                _skip_sub_blocks(file)
+            else:
+                # corrupt; what was read so far counts
+                break
+        return frames, delay / 100
+    finally:
+        file.seek(position)
+
+
+def gif_frame_count(file, limit=None):
+    return gif_info(file, limit)[0]
+
+
+def is_animated_gif(file):
+    return gif_frame_count(file, limit=2) > 1
+
+
+def _gif(file):
+    header = file.read(10)
+    width, height = struct.unpack("<HH", header[6:10])
+    frames, seconds = gif_info(file)
+    return {
+        "width": width,
+        "height": height,
+        "frame_count": frames,
+        "duration": seconds if frames > 1 else None,
+        "codec": "gif",
+    }
+
+
+def _png(file):
+    header = file.read(24)
+    width, height = struct.unpack(">II", header[16:24])
+    meta = {"width": width, "height": height, "frame_count": 1, "codec": "png"}
+    # an acTL chunk before the image data makes it an APNG
+    file.seek(8)
+    while True:
+        chunk = file.read(8)
+        if len(chunk) < 8:
+            break
+        length, kind = struct.unpack(">I4s", chunk)
+        if kind == b"acTL":
+            meta["frame_count"] = struct.unpack(">I", file.read(4))[0]
+            meta["codec"] = "apng"
+            break
+        if kind == b"IDAT":
+            break
+        file.seek(length + 4, 1)
+    return meta
+
+
+def _jpeg(file):
+    file.seek(2)
+    while True:
+        marker = file.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return {}
+        kind = marker[1]
+        if kind == 0xFF:
+            # fill byte
+            file.seek(-1, 1)
+            continue
+        if kind in (0x01, *range(0xD0, 0xDA)):
+            continue
+        length = struct.unpack(">H", file.read(2))[0]
+        # SOFn carries the frame size; C4, C8 and CC are other segments
+        if 0xC0 <= kind <= 0xCF and kind not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack(">xHH", file.read(5))
+            return {"width": width, "height": height, "frame_count": 1, "codec": "jpeg"}
+        file.seek(length - 2, 1)
+
+
+def _webp(file):
+    header = file.read(30)
+    kind = header[12:16]
+    meta = {"frame_count": 1, "codec": "webp"}
+    if kind == b"VP8 ":
+        width, height = struct.unpack("<HH", header[26:30])
+        meta.update(width=width & 0x3FFF, height=height & 0x3FFF)
+    elif kind == b"VP8L":
+        bits = struct.unpack("<I", header[21:25])[0]
+        meta.update(width=(bits & 0x3FFF) + 1, height=((bits >> 14) & 0x3FFF) + 1)
+    elif kind == b"VP8X":
+        meta.update(
+            width=int.from_bytes(header[24:27], "little") + 1,
+            height=int.from_bytes(header[27:30], "little") + 1,
+        )
+        if header[20] & 0x02:
+            # animated: count the frame chunks
+            frames = 0
+            position = 12
+            while True:
+                file.seek(position)
+                chunk = file.read(8)
+                if len(chunk) < 8:
+                    break
+                chunk_kind, length = struct.unpack("<4sI", chunk)
+                frames += chunk_kind == b"ANMF"
+                position += 8 + length + (length & 1)
+            meta["frame_count"] = frames
+    return meta
+
+
+def _boxes(file, start, end):
+    position = start
+    while position + 8 <= end:
+        file.seek(position)
+        size, kind = struct.unpack(">I4s", file.read(8))
+        header = 8
+        if size == 1:
+            size = struct.unpack(">Q", file.read(8))[0]
+            header = 16
+        elif size == 0:
+            size = end - position
+        if size < header:
+            return
+        yield kind, position + header, position + size
+        position += size
+
+
+def _child(file, start, end, *path):
+    for kind, child_start, child_end in _boxes(file, start, end):
+        if kind == path[0]:
+            if len(path) == 1:
+                return child_start, child_end
+            return _child(file, child_start, child_end, *path[1:])
+    return None
+
+
+def _mp4(file):
+    file.seek(0, os.SEEK_END)
+    moov = _child(file, 0, file.tell(), b"moov")
+    if moov is None:
+        return {}
+    meta = {}
+
+    mvhd = _child(file, *moov, b"mvhd")
+    if mvhd:
+        file.seek(mvhd[0])
+        version = file.read(4)[0]
+        if version == 1:
+            timescale, duration = struct.unpack(">16xIQ", file.read(28))
+        else:
+            timescale, duration = struct.unpack(">8xII", file.read(16))
+        if timescale:
+            meta["duration"] = duration / timescale
+
+    for kind, start, end in _boxes(file, *moov):
+        if kind != b"trak":
+            continue
+        hdlr = _child(file, start, end, b"mdia", b"hdlr")
+        if not hdlr:
+            continue
+        file.seek(hdlr[0] + 8)
+        if file.read(4) != b"vide":
+            continue
+
+        tkhd = _child(file, start, end, b"tkhd")
+        if tkhd:
+            file.seek(tkhd[0])
+            version = file.read(1)[0]
+            file.seek(tkhd[0] + (88 if version == 1 else 76))
+            # 16.16 fixed point
+            width, height = struct.unpack(">II", file.read(8))
+            meta.update(width=width >> 16, height=height >> 16)
+        stbl = _child(file, start, end, b"mdia", b"minf", b"stbl")
+        if stbl:
+            stsd = _child(file, *stbl, b"stsd")
+            if stsd:
+                file.seek(stsd[0] + 12)
+                fourcc = file.read(4)
+                meta["codec"] = MP4_CODECS.get(fourcc, fourcc.decode("latin-1").strip())
+            stsz = _child(file, *stbl, b"stsz")
+            if stsz:
+                file.seek(stsz[0] + 8)
+                meta["frame_count"] = struct.unpack(">I", file.read(4))[0]
+        break
+    return meta
+
+
+_READERS = {
+    ".gif": _gif,
+    ".png": _png,
+    ".jpg": _jpeg,
+    ".jpeg": _jpeg,
+    ".webp": _webp,
+    ".mp4": _mp4,
+}
+
+
+def read_metadata(file, name):
+    """
+    {field: value} of what the headers of `file` tell about it, for the
+    Media fields in METADATA_FIELDS. Never raises; unknown or broken files
+    give {}. The file position is preserved.
+    """
+    reader = _READERS.get(os.path.splitext(name)[1].lower())
+    if reader is None:
+        return {}
+    position = file.tell()
+    try:
+        file.seek(0)
+        meta = reader(file)
+    except (struct.error, IndexError, TypeError, ValueError, OSError):
+        return {}
+    finally:
+        file.seek(position)
+    return {field: value for field, value in meta.items() if value not in (None, "", 0)}
+
+
+def metadata_from_probe(info):
+    """
+    The METADATA_FIELDS of an ffprobe result (see transcode.probe()).
+    """
+    video = next((s for s in info.get("streams", []) if s.get("codec_type") == "video"), None)
+    meta = {}
+    if video:
+        meta.update(
+            width=video.get("width"),
+            height=video.get("height"),
+            codec=video.get("codec_name"),
+            frame_count=int(video["nb_frames"]) if video.get("nb_frames", "").isdigit() else None,
+        )
+    duration = info.get("format", {}).get("duration")
+    if duration:
+        meta["duration"] = float(duration)
+    return {field: value for field, value in meta.items() if value not in (None, "", 0)}
@@ -0,0 +1,161 @@
+# myapp/mediaserve.py
+"""
+Serving local files with conditional GET and byte ranges.
+
+Video players seek with Range requests and revalidate with If-Range, so
+both have to be right: a single `bytes=` range is answered with 206, an
+unsatisfiable one with 416, and If-Range only honours the range when the
+client's validator (strong ETag or exact Last-Modified) still matches.
+Multi-range requests get the whole file, which RFC 9110 allows.
+
+Under WSGI whole files go out as FileResponse, which uWSGI hands to
+sendfile(2) through wsgi.file_wrapper. Under ASGI there is no zero-copy
+path, so files are read in chunks off the event loop.
+
+Where a front server can deliver the file itself, offload_response()
+only tells it which file to send (MEDIA_SENDFILE).
+"""
+import mimetypes
+import re
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+CHUNK_SIZE = 256 * 1024
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _requested_range(request, size, etag, last_modified):
+    """
+    (start, end) of the single range to send, None for the whole file, or
+    False if the range can't be satisfied.
+    """
+    header = request.headers.get("Range", "").replace(" ", "")
+    match = _RANGE_RE.match(header)
+    if not match or not any(match.groups()):
+        return None
+
+    if_range = request.headers.get("If-Range")
+    if if_range:
+        if if_range.startswith('"'):
+            # strong comparison only
+            if if_range != etag:
+                return None
+        elif parse_http_date_safe(if_range) != int(last_modified.timestamp()):
+            return None
+
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if start >= size or end < start:
+            return False
+    else:
+        # suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        start, end = max(size - length, 0), size - 1
+    return start, end
+
+
+def _read_range(file, start, length):
+    try:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+async def _aread_range(file, start, length):
+    read = sync_to_async(file.read, thread_sensitive=False)
+    try:
+        await sync_to_async(file.seek, thread_sensitive=False)(start)
+        while length > 0:
+            chunk = await read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        await sync_to_async(file.close, thread_sensitive=False)()
+
+
+def serve_file(request, file, size, etag, last_modified, content_type, cache_control):
+    """
+    Response for GET/HEAD of an open binary `file`, which it takes
+    ownership of.
+    """
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Last-Modified": http_date(last_modified.timestamp()),
+        "Cache-Control": cache_control,
+    }
+
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(last_modified.timestamp())
+    )
+    if response is not None:
+        file.close()
+        for header, value in headers.items():
+            response.headers[header] = value
+        return response
+
+    byte_range = _requested_range(request, size, etag, last_modified)
+    if byte_range is False:
+        file.close()
+        response = HttpResponse(status=416)
+        response.headers["Content-Range"] = f"bytes */{size}"
+        response.headers["Accept-Ranges"] = "bytes"
+        return response
+
+    start, end = byte_range or (0, size - 1)
+    length = end - start + 1 if size else 0
+
+    if request.method == "HEAD":
+        file.close()
+        response = HttpResponse(content_type=content_type)
+    elif byte_range is None and not isinstance(request, ASGIRequest):
+        # zero-copy through wsgi.file_wrapper
+        response = FileResponse(file, content_type=content_type)
+    elif isinstance(request, ASGIRequest):
+        response = StreamingHttpResponse(_aread_range(file, start, length), content_type=content_type)
+    else:
+        response = StreamingHttpResponse(_read_range(file, start, length), content_type=content_type)
+
+    if byte_range is not None:
+        response.status_code = 206
+        response.headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    response.headers["Content-Length"] = str(length)
+    for header, value in headers.items():
+        response.headers[header] = value
+    return response
+
+
+def offload_response(name, path, cache_control):
+    """
+    Empty response telling the front server to send the local file at
+    `path` (storage name `name`): X-Sendfile for uWSGI's offload threads,
+    Apache or lighttpd, X-Accel-Redirect for an nginx internal location
+    at MEDIA_ACCEL_PREFIX. The front server handles Range and conditional
+    requests.
+    """
+    response = HttpResponse(content_type=mimetypes.guess_type(name)[0] or "application/octet-stream")
+    if settings.MEDIA_SENDFILE == "x-accel-redirect":
+        response.headers["X-Accel-Redirect"] = settings.MEDIA_ACCEL_PREFIX + quote(name)
+    else:
+        response.headers["X-Sendfile"] = str(path)
+    response.headers["Cache-Control"] = cache_control
+    return response
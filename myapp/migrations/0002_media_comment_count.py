@@ -0,0 +1,34 @@
+# Generated by Django 5.2.9 on 2026-10-19 18:07
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_comment_count(apps, schema_editor):
+    Media = apps.get_model("myapp", "Media")
+    Comment = apps.get_model("myapp", "Comment")
+    counts = (
+        Comment.objects.filter(media=OuterRef("pk"))
+        .order_by()
+        .values("media")
+        .annotate(n=Count("pk"))
+        .values("n")
+    )
+    Media.objects.update(comment_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='media',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_comment_count, migrations.RunPython.noop),
+    ]
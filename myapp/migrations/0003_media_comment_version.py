@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-19 18:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0002_media_comment_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='media',
+            name='comment_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
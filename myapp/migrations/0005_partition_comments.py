@@ -0,0 +1,84 @@
+import datetime
+
+from django.db import migrations
+
+from myapp import partitions
+
+# months of partitions to create ahead of the current one
+PREMAKE_MONTHS = 3
+
+
+def partition_comments(apps, schema_editor):
+    """
+    Rebuild myapp_comment as a table range-partitioned by created_at (one
+    partition per month).
+
+    PostgreSQL requires the partition key in the primary key, so the table's
+    primary key becomes (id, created_at); ids still come from one sequence and
+    stay unique, so Django keeps treating `id` as the primary key. Index and
+    foreign key definitions are copied over with their names, so later
+    migrations find what they expect.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != "postgresql" or partitions.is_partitioned(connection):
+        return
+
+    table = partitions.TABLE
+    old = f"{table}_unpartitioned"
+    execute = schema_editor.execute
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT indexdef FROM pg_indexes WHERE tablename = %s "
+            "AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'p')",
+            [table, table],
+        )
+        index_defs = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = %s::regclass AND contype = 'f'",
+            [table],
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute(f"SELECT min(created_at) FROM {table}")
+        oldest = cursor.fetchone()[0]
+
+    execute(f"ALTER TABLE {table} RENAME TO {old}")
+    # frees the name myapp_comment_id_seq for the new table
+    execute(f"ALTER TABLE {old} ALTER COLUMN id DROP IDENTITY IF EXISTS")
+    execute(f"ALTER TABLE {old} ALTER COLUMN id DROP DEFAULT")
+    execute(f"DROP SEQUENCE IF EXISTS {table}_id_seq")
+
+    execute(f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)")
+    execute(f"CREATE SEQUENCE {table}_id_seq OWNED BY {table}.id")
+    execute(f"ALTER TABLE {table} ALTER COLUMN id SET DEFAULT nextval('{table}_id_seq')")
+
+    today = datetime.date.today()
+    partitions.create_partitions(
+        connection,
+        oldest.date() if oldest else today,
+        partitions.add_months(partitions.month_start(today), PREMAKE_MONTHS),
+    )
+
+    execute(f"INSERT INTO {table} SELECT * FROM {old}")
+    execute(f"SELECT setval('{table}_id_seq', COALESCE((SELECT max(id) FROM {table}), 0) + 1, false)")
+    execute(f"DROP TABLE {old}")
+
+    # built after the copy, which is much faster than maintaining them row by row
+    execute(f"ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id, created_at)")
+    for index_def in index_defs:
+        execute(index_def)
+    for name, definition in foreign_keys:
+        execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0004_comment_thread_index_commentarchive'),
+    ]
+
+    operations = [
+        # the partitioned table behaves like the plain one, nothing to undo
+        migrations.RunPython(partition_comments, migrations.RunPython.noop),
+    ]
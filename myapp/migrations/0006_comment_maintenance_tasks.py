@@ -0,0 +1,38 @@
+from django.db import migrations
+
+TASKS = [
+    # (name, task, minute, hour)
+    ("Rotate comment partitions", "myapp.tasks.rotate_comment_partitions", "15", "3"),
+    ("Archive cold comment threads", "myapp.tasks.archive_cold_comments", "45", "3"),
+]
+
+
+def register_tasks(apps, schema_editor):
+    CrontabSchedule = apps.get_model("django_celery_beat", "CrontabSchedule")
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+    for name, task, minute, hour in TASKS:
+        schedule, _ = CrontabSchedule.objects.get_or_create(
+            minute=minute,
+            hour=hour,
+            day_of_week="*",
+            day_of_month="*",
+            month_of_year="*",
+        )
+        PeriodicTask.objects.get_or_create(name=name, defaults={"task": task, "crontab": schedule})
+
+
+def unregister_tasks(apps, schema_editor):
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+    PeriodicTask.objects.filter(task__in=[task for _, task, _, _ in TASKS]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0005_partition_comments'),
+        ('django_celery_beat', '0019_alter_periodictasks_options'),
+    ]
+
+    operations = [
+        migrations.RunPython(register_tasks, unregister_tasks),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.9 on 2026-10-19 18:39
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0006_comment_maintenance_tasks'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='media',
+            index=models.Index(fields=['file'], name='myapp_media_file_idx'),
+        ),
+    ]
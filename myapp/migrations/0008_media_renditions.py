@@ -0,0 +1,33 @@
+# Generated by Django 5.2.9 on 2026-10-19 18:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0007_media_file_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='media',
+            name='hls_playlist',
+            field=models.FileField(blank=True, editable=False, upload_to='renditions/'),
+        ),
+        migrations.AddField(
+            model_name='media',
+            name='processing',
+            field=models.CharField(choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], default='ready', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='media',
+            name='video_file',
+            field=models.FileField(blank=True, editable=False, upload_to='renditions/'),
+        ),
+        migrations.AddField(
+            model_name='media',
+            name='video_low_file',
+            field=models.FileField(blank=True, editable=False, upload_to='renditions/'),
+        ),
+    ]
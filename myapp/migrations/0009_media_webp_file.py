@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-19 18:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0008_media_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='media',
+            name='webp_file',
+            field=models.FileField(blank=True, editable=False, upload_to='renditions/'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.9 on 2026-10-19 18:58
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0010_media_metadata'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='media',
+            name='checksum',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='media',
+            index=models.Index(fields=['uploader', 'checksum'], name='myapp_media_checksum_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.9 on 2026-10-19 19:08
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0011_media_checksum'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='media',
+            index=models.Index(fields=['-created_at', '-id'], name='myapp_media_feed_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.9 on 2026-10-19 21:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+from myapp import titlesearch
+
+
+def create_title_index(apps, schema_editor):
+    titlesearch.ensure_index(schema_editor.connection)
+
+
+def drop_title_index(apps, schema_editor):
+    titlesearch.drop_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0012_media_feed_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='media',
+            index=models.Index(fields=['codec'], name='myapp_media_codec_idx'),
+        ),
+        migrations.RunPython(create_title_index, drop_title_index),
+    ]
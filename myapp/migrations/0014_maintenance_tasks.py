@@ -0,0 +1,42 @@
+from django.db import migrations
+
+TASKS = [
+    # (name, task, minute, hour, day_of_week)
+    ("Refresh planner statistics", "myapp.tasks.optimize_database", "5", "*", "*"),
+    ("Vacuum the database", "myapp.tasks.vacuum_database", "30", "4", "0"),
+    ("Reconcile comment counts", "myapp.tasks.reconcile_comment_counts", "15", "4", "*"),
+    ("Sweep orphaned files", "myapp.tasks.sweep_orphaned_files", "45", "4", "*"),
+    ("Warm feed caches", "myapp.tasks.warm_caches", "*/5", "*", "*"),
+    ("Delete stale resumable uploads", "myapp.tasks.delete_stale_uploads", "35", "*", "*"),
+]
+
+
+def register_tasks(apps, schema_editor):
+    CrontabSchedule = apps.get_model("django_celery_beat", "CrontabSchedule")
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+    for name, task, minute, hour, day_of_week in TASKS:
+        schedule, _ = CrontabSchedule.objects.get_or_create(
+            minute=minute,
+            hour=hour,
+            day_of_week=day_of_week,
+            day_of_month="*",
+            month_of_year="*",
+        )
+        PeriodicTask.objects.get_or_create(name=name, defaults={"task": task, "crontab": schedule})
+
+
+def unregister_tasks(apps, schema_editor):
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+    PeriodicTask.objects.filter(task__in=[task for _, task, _, _, _ in TASKS]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0013_media_search_indexes'),
+        ('django_celery_beat', '0019_alter_periodictasks_options'),
+    ]
+
+    operations = [
+        migrations.RunPython(register_tasks, unregister_tasks),
+    ]
@@ -1,5 +1,7 @@
 from django.conf import settings
 from django.db import models
+from django.urls import reverse
+from django.utils.functional import cached_property
 from django.utils.text import slugify
 
 User = settings.AUTH_USER_MODEL
@@ -55,11 +57,31 @@ class Album(TimeStampedModel):
         return self.title
 
 
+class MediaQuerySet(models.QuerySet):
+    def visible_to(self, user):
+        """
+        Media the user may see: public media outside private albums, their
+        own uploads and everything in their albums. Superusers see all.
+        """
+        if user.is_superuser:
+            return self
+        return self.filter(
+            models.Q(is_public=True) & (models.Q(album__isnull=True) | models.Q(album__is_private=False))
+            | models.Q(uploader=user)
+            | models.Q(album__owner=user)
+        )
+
+
 class Media(TimeStampedModel):
     class MediaType(models.TextChoices):
         IMAGE = "image", "Image"
         VIDEO = "video", "Video"
 
+    class Processing(models.TextChoices):
+        PENDING = "pending", "Pending"
+        READY = "ready", "Ready"
+        FAILED = "failed", "Failed"
+
     uploader = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -89,12 +111,92 @@ class Media(TimeStampedModel):
     # future proofing for private albums, etc.
     is_public = models.BooleanField(default=True)
 
+    # denormalized so feeds and comment endpoints don't need COUNT(*)
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    # bumped on every comment add/delete; part of the comment endpoints' ETags
+    comment_version = models.PositiveIntegerField(default=0, editable=False)
+
+    # web renditions of videos and animated GIFs (myapp/transcode.py); the
+    # templates fall back to the upload itself while they are missing
+    processing = models.CharField(
+        max_length=10,
+        choices=Processing.choices,
+        default=Processing.READY,
+    )
+    video_file = models.FileField(upload_to="renditions/", blank=True, editable=False)
+    video_low_file = models.FileField(upload_to="renditions/", blank=True, editable=False)
+    hls_playlist = models.FileField(upload_to="renditions/", blank=True, editable=False)
+    webp_file = models.FileField(upload_to="renditions/", blank=True, editable=False)
+
+    # read from the headers at upload (myapp/mediainfo.py), completed by the
+    # transcoding worker; lets feeds and the admin sort and filter by them
+    # and templates reserve the space before the media loads
+    byte_size = models.PositiveBigIntegerField(null=True, blank=True, editable=False)
+    width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    duration = models.FloatField(null=True, blank=True, editable=False, help_text="Seconds")
+    frame_count = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    codec = models.CharField(max_length=20, blank=True, editable=False)
+    # sha256 of the upload; batch uploads skip files the uploader already has
+    checksum = models.CharField(max_length=64, blank=True, editable=False)
+
+    objects = MediaQuerySet.as_manager()
+
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            # protected media delivery looks media up by file name
+            models.Index(fields=["file"], name="myapp_media_file_idx"),
+            # keyset pagination of the feed and the API, newest first
+            models.Index(fields=["-created_at", "-id"], name="myapp_media_feed_idx"),
+            models.Index(fields=["byte_size"], name="myapp_media_byte_size_idx"),
+            models.Index(fields=["duration"], name="myapp_media_duration_idx"),
+            models.Index(fields=["codec"], name="myapp_media_codec_idx"),
+            models.Index(fields=["uploader", "checksum"], name="myapp_media_checksum_idx"),
+        ]
 
     def __str__(self):
         return self.title or f"Meme #{self.pk}"
 
+    # storage URLs (signed on S3) aren't free; templates use them several times per card
+    @cached_property
+    def file_url(self):
+        return self.get_file_url()
+
+    @cached_property
+    def video_url(self):
+        return self.get_file_url(self.video_file) if self.video_file else ""
+
+    @cached_property
+    def video_low_url(self):
+        return self.get_file_url(self.video_low_file) if self.video_low_file else ""
+
+    @cached_property
+    def hls_url(self):
+        return self.get_file_url(self.hls_playlist) if self.hls_playlist else ""
+
+    @cached_property
+    def webp_url(self):
+        return self.get_file_url(self.webp_file) if self.webp_file else ""
+
+    # feed pages set it for all cards in one batch (myapp.usercache.UserNames)
+    @cached_property
+    def uploader_name(self):
+        return self.uploader.get_username()
+
+    def resolve_urls(self):
+        """
+        Compute every URL the templates may ask for.
+        """
+        return self.file_url, self.video_url, self.video_low_url, self.hls_url, self.webp_url
+
+    def get_file_url(self, field_file=None):
+        field_file = field_file or self.file
+        if settings.MEDIA_PROXY:
+            # served by the app, access-checked (myapp.views.media_file)
+            return reverse("myapp:media_file", args=[field_file.name])
+        return field_file.url
+
     def delete(self, *args, **kwargs):
         """
         Ensure the file is removed from disk when the Media object is deleted.
@@ -122,8 +224,35 @@ class Comment(TimeStampedModel):
     )
     text = models.TextField(max_length=2000)
 
+    # comments rebuilt from a CommentArchive are read-only
+    is_archived = False
+
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            # every comment query is "this media's thread, newest first"
+            models.Index(fields=["media", "-created_at"], name="myapp_comment_thread_idx"),
+        ]
 
     def __str__(self):
         return f"Comment by {self.author} on {self.media}"
+
+
+class CommentArchive(models.Model):
+    """
+    Comments of a cold thread, compacted into one compressed blob.
+    See myapp/archive.py.
+    """
+    media = models.OneToOneField(
+        Media,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="comment_archive",
+    )
+    # zlib-compressed JSON list, newest comment first
+    data = models.BinaryField()
+    comment_count = models.PositiveIntegerField(default=0)
+    archived_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.comment_count} archived comments on {self.media}"
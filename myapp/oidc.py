@@ -0,0 +1,321 @@
+# myapp/oidc.py
+"""
+OIDC sign-in without identity provider round trips on page loads.
+
+mozilla-django-oidc fetches OIDC_OP_JWKS_ENDPOINT for every RS256/ES256
+token it verifies, and its SessionRefresh middleware sends the browser
+through the provider (prompt=none) every OIDC_RENEW_ID_TOKEN_EXPIRY_SECONDS.
+
+- JWKSCache keeps the provider's keys in memory and in the cache, shared
+  by the workers, for OIDC_JWKS_CACHE_SECONDS. Stale keys keep verifying
+  while a background fetch replaces them. A kid that isn't known means the
+  provider rotated its keys, so they are fetched again (at most once per
+  JWKS_REFETCH_SECONDS, so forged kids can't turn it into a request per
+  token).
+- OIDCBackend verifies ID tokens locally against those keys, including
+  the expiry, audience and (with OIDC_OP_ISSUER) issuer, which the library
+  leaves unchecked.
+- With OIDC_SILENT_REFRESH, SessionRefresh renews a due session with the
+  refresh token on a background thread. The request that finds it due goes
+  through unchanged, a later one picks up the result. Only if renewal is
+  refused or doesn't finish within OIDC_SILENT_REFRESH_GRACE_SECONDS does
+  the browser take the library's redirect.
+
+myapp/oidcstub.py is a local provider to develop and test against.
+"""
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import SuspiciousOperation
+from django.utils.encoding import force_bytes, smart_str
+from josepy.jws import JWS, Header
+from mozilla_django_oidc.auth import OIDCAuthenticationBackend
+from mozilla_django_oidc.middleware import SessionRefresh as BaseSessionRefresh
+
+logger = logging.getLogger(__name__)
+
+JWKS_CACHE_KEY = "oidc_jwks"
+# unknown kids fetch the keys again at most this often
+JWKS_REFETCH_SECONDS = 60
+# clock skew allowed on exp/iat
+TOKEN_LEEWAY_SECONDS = 60
+# a failed renewal (provider unreachable) is retried after this long
+REFRESH_RETRY_SECONDS = 30
+
+EXPIRATION_SESSION_KEY = "oidc_id_token_expiration"
+REFRESH_TOKEN_SESSION_KEY = "oidc_refresh_token"
+SUBJECT_SESSION_KEY = "oidc_sub"
+PENDING_SESSION_KEY = "oidc_refresh_pending"
+
+# JWKS and token refreshes, off the request path
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="oidc")
+
+
+def _request_options():
+    return {
+        "verify": getattr(settings, "OIDC_VERIFY_SSL", True),
+        "timeout": getattr(settings, "OIDC_TIMEOUT", None),
+        "proxies": getattr(settings, "OIDC_PROXY", None),
+    }
+
+
+def _match(keys, kid, alg):
+    verify_kid = getattr(settings, "OIDC_VERIFY_KID", True)
+    for jwk in keys:
+        if verify_kid and jwk.get("kid") != kid:
+            continue
+        if "alg" in jwk and jwk["alg"] != alg:
+            continue
+        if jwk.get("use", "sig") != "sig":
+            continue
+        return jwk
+    return None
+
+
+class JWKSCache:
+    def __init__(self, url, ttl):
+        self.url = url
+        self.ttl = ttl
+        self._keys = None
+        self._fetched_at = 0.0
+        self._refetched_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def _fetch(self):
+        response = requests.get(self.url, **_request_options())
+        response.raise_for_status()
+        keys = response.json()["keys"]
+        fetched_at = time.time()
+        with self._lock:
+            self._keys, self._fetched_at = keys, fetched_at
+        # no timeout: stale keys beat none while the provider is down
+        cache.set(JWKS_CACHE_KEY, {"url": self.url, "keys": keys, "fetched_at": fetched_at}, None)
+        return keys
+
+    def _background_fetch(self):
+        try:
+            self._fetch()
+        except (requests.RequestException, ValueError, KeyError):
+            logger.warning("Refreshing the keys of %s failed", self.url, exc_info=True)
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def keys(self):
+        with self._lock:
+            keys, fetched_at = self._keys, self._fetched_at
+        if keys is None:
+            shared = cache.get(JWKS_CACHE_KEY)
+            if not shared or shared["url"] != self.url:
+                return self._fetch()
+            keys, fetched_at = shared["keys"], shared["fetched_at"]
+            with self._lock:
+                self._keys, self._fetched_at = keys, fetched_at
+        if time.time() - fetched_at > self.ttl:
+            with self._lock:
+                start, self._refreshing = not self._refreshing, True
+            if start:
+                _executor.submit(self._background_fetch)
+        return keys
+
+    def find(self, kid, alg):
+        """
+        The key for a token's kid and alg, None if the provider has none.
+        """
+        key = _match(self.keys(), kid, alg)
+        if key is None:
+            with self._lock:
+                refetch = time.time() - self._refetched_at >= JWKS_REFETCH_SECONDS
+                if refetch:
+                    self._refetched_at = time.time()
+            if refetch:
+                key = _match(self._fetch(), kid, alg)
+        return key
+
+
+_jwks = None
+_jwks_lock = threading.Lock()
+
+
+def get_jwks():
+    global _jwks
+    with _jwks_lock:
+        if _jwks is None or _jwks.url != settings.OIDC_OP_JWKS_ENDPOINT:
+            _jwks = JWKSCache(settings.OIDC_OP_JWKS_ENDPOINT, settings.OIDC_JWKS_CACHE_SECONDS)
+        return _jwks
+
+
+class OIDCBackend(OIDCAuthenticationBackend):
+    """
+    The library's backend with cached keys, the ID token's claims checked
+    and the refresh token kept for silent renewal.
+    """
+    refresh_token = None
+    id_token_claims = None
+
+    def retrieve_matching_jwk(self, token):
+        header = Header.json_loads(JWS.from_compact(token).signature.protected)
+        key = get_jwks().find(smart_str(header.kid), smart_str(header.alg))
+        if key is None:
+            raise SuspiciousOperation("Could not find a valid JWKS.")
+        return key
+
+    def _check_claims(self, payload):
+        now = time.time()
+        if payload.get("exp", 0) + TOKEN_LEEWAY_SECONDS < now:
+            raise SuspiciousOperation("ID token has expired.")
+        if payload.get("iat", 0) - TOKEN_LEEWAY_SECONDS > now:
+            raise SuspiciousOperation("ID token is issued in the future.")
+        audience = payload.get("aud")
+        if self.OIDC_RP_CLIENT_ID not in (audience if isinstance(audience, list) else [audience]):
+            raise SuspiciousOperation("ID token is not for this client.")
+        issuer = getattr(settings, "OIDC_OP_ISSUER", None)
+        if issuer and payload.get("iss") != issuer:
+            raise SuspiciousOperation("ID token is from another issuer.")
+
+    def verify_token(self, token, **kwargs):
+        payload = super().verify_token(token, **kwargs)
+        self._check_claims(payload)
+        self.id_token_claims = payload
+        return payload
+
+    def verify_refreshed_token(self, token, subject):
+        """
+        Verify an ID token from a refresh: like at sign-in, but without a
+        nonce and for the same subject.
+        """
+        token = force_bytes(token)
+        if self.OIDC_RP_SIGN_ALGO.startswith(("RS", "ES")):
+            key = self.OIDC_RP_IDP_SIGN_KEY or self.retrieve_matching_jwk(token)
+        else:
+            key = self.OIDC_RP_CLIENT_SECRET
+        payload = json.loads(self.get_payload_data(token, key).decode("utf-8"))
+        self._check_claims(payload)
+        if subject and payload.get("sub") != subject:
+            raise SuspiciousOperation("ID token is for another subject.")
+        return payload
+
+    def get_token(self, payload):
+        token_info = super().get_token(payload)
+        self.refresh_token = token_info.get("refresh_token")
+        return token_info
+
+    def store_tokens(self, access_token, id_token):
+        super().store_tokens(access_token, id_token)
+        session = self.request.session
+        session.pop(PENDING_SESSION_KEY, None)
+        session[SUBJECT_SESSION_KEY] = (self.id_token_claims or {}).get("sub")
+        if settings.OIDC_SILENT_REFRESH and self.refresh_token:
+            session[REFRESH_TOKEN_SESSION_KEY] = self.refresh_token
+        else:
+            session.pop(REFRESH_TOKEN_SESSION_KEY, None)
+
+
+def _lock_key(session_key):
+    return f"oidc_refresh_lock:{session_key}"
+
+
+def _result_key(session_key):
+    return f"oidc_refresh:{session_key}"
+
+
+def refresh_session_tokens(session_key, refresh_token, subject):
+    """
+    Renew a session's tokens with its refresh token. The outcome is left in
+    the cache for the session's next request (SessionRefresh); a provider
+    that can't be reached is tried again after REFRESH_RETRY_SECONDS.
+    """
+    backend = OIDCBackend()
+    try:
+        token_info = backend.get_token({
+            "client_id": backend.OIDC_RP_CLIENT_ID,
+            "client_secret": backend.OIDC_RP_CLIENT_SECRET,
+            "grant_type": "refresh_token",
+            "refresh_token": refresh_token,
+            "scope": getattr(settings, "OIDC_RP_SCOPES", "openid email"),
+        })
+        if token_info.get("id_token"):
+            backend.verify_refreshed_token(token_info["id_token"], subject)
+    except requests.HTTPError as e:
+        if e.response is None or e.response.status_code >= 500:
+            logger.warning("Renewing OIDC tokens failed: %s", e)
+            return
+        # refused (invalid_grant): the session at the provider is over
+        logger.info("OIDC token renewal refused: %s", e)
+        result = {"failed": True}
+    except requests.RequestException as e:
+        logger.warning("Renewing OIDC tokens failed: %s", e)
+        return
+    except (SuspiciousOperation, ValueError, KeyError) as e:
+        logger.warning("Renewed OIDC tokens are invalid: %s", e)
+        result = {"failed": True}
+    else:
+        result = {
+            "expiration": time.time() + settings.OIDC_RENEW_ID_TOKEN_EXPIRY_SECONDS,
+            # providers may rotate refresh tokens
+            "refresh_token": token_info.get("refresh_token") or refresh_token,
+            "access_token": token_info.get("access_token"),
+            "id_token": token_info.get("id_token"),
+        }
+    cache.set(_result_key(session_key), result, settings.OIDC_SILENT_REFRESH_GRACE_SECONDS)
+    cache.delete(_lock_key(session_key))
+
+
+class SessionRefresh(BaseSessionRefresh):
+    """
+    The library's SessionRefresh, renewing in the background first when a
+    refresh token is available.
+    """
+    def _apply_refresh(self, request):
+        """
+        Take over a finished background renewal; False if it was refused.
+        """
+        session = request.session
+        result = cache.get(_result_key(session.session_key))
+        if result is None:
+            return True
+        cache.delete(_result_key(session.session_key))
+        session.pop(PENDING_SESSION_KEY, None)
+        if result.get("failed"):
+            session.pop(REFRESH_TOKEN_SESSION_KEY, None)
+            return False
+        session[EXPIRATION_SESSION_KEY] = result["expiration"]
+        session[REFRESH_TOKEN_SESSION_KEY] = result["refresh_token"]
+        if self.get_settings("OIDC_STORE_ACCESS_TOKEN", False) and result["access_token"]:
+            session["oidc_access_token"] = result["access_token"]
+        if self.get_settings("OIDC_STORE_ID_TOKEN", False) and result["id_token"]:
+            session["oidc_id_token"] = result["id_token"]
+        return True
+
+    def process_request(self, request):
+        if not settings.OIDC_SILENT_REFRESH or not self.is_refreshable_url(request):
+            return super().process_request(request)
+
+        session = request.session
+        if session.get(PENDING_SESSION_KEY) and not self._apply_refresh(request):
+            return super().process_request(request)
+        expiration = session.get(EXPIRATION_SESSION_KEY, 0)
+        now = time.time()
+        refresh_token = session.get(REFRESH_TOKEN_SESSION_KEY)
+        if expiration > now or not refresh_token:
+            return super().process_request(request)
+        if now > expiration + settings.OIDC_SILENT_REFRESH_GRACE_SECONDS:
+            # renewal didn't come through in time
+            return super().process_request(request)
+
+        if session.session_key and cache.add(_lock_key(session.session_key), True, REFRESH_RETRY_SECONDS):
+            session[PENDING_SESSION_KEY] = True
+            _executor.submit(
+                refresh_session_tokens,
+                session.session_key,
+                refresh_token,
+                session.get(SUBJECT_SESSION_KEY),
+            )
+        return None
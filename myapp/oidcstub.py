@@ -0,0 +1,215 @@
+# myapp/oidcstub.py
+"""
+A local OpenID provider to develop and test the OIDC sign-in against
+(`manage.py oidc_stub_idp`): it signs everyone in as one user without
+asking, issues RS256 ID tokens, refresh tokens and a JWKS, and can
+rotate its signing key or revoke refresh tokens on demand. It counts the
+requests per endpoint, so tests can assert which ones a page load made.
+
+Not for anything but localhost.
+"""
+import json
+import secrets
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import josepy
+from cryptography.hazmat.primitives.asymmetric import rsa
+from josepy.jws import JWS
+
+
+class StubIdP:
+    def __init__(self, host="127.0.0.1", port=0, email="dev@example.com",
+                 client_id="memelord", client_secret="memelord", token_lifetime=300):
+        self.email = email
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.token_lifetime = token_lifetime
+        self.requests = Counter()
+        self._keys = []
+        self._codes = {}
+        self._access_tokens = set()
+        self._refresh_tokens = set()
+        self._lock = threading.Lock()
+        self.rotate_key(keep_old=False)
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def settings(self):
+        """
+        The OIDC_* settings (and environment variables) pointing at this
+        provider.
+        """
+        return {
+            "OIDC_RP_CLIENT_ID": self.client_id,
+            "OIDC_RP_CLIENT_SECRET": self.client_secret,
+            "OIDC_RP_SIGN_ALGO": "RS256",
+            "OIDC_OP_ISSUER": self.url,
+            "OIDC_OP_AUTHORIZATION_ENDPOINT": f"{self.url}/authorize",
+            "OIDC_OP_TOKEN_ENDPOINT": f"{self.url}/token",
+            "OIDC_OP_USER_ENDPOINT": f"{self.url}/userinfo",
+            "OIDC_OP_JWKS_ENDPOINT": f"{self.url}/jwks",
+        }
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    # --- state ---
+
+    def rotate_key(self, keep_old=True):
+        """
+        Sign with a new key; the JWKS keeps publishing the old one if
+        `keep_old`.
+        """
+        key = josepy.JWKRSA(key=rsa.generate_private_key(public_exponent=65537, key_size=2048))
+        with self._lock:
+            self._keys = [(secrets.token_hex(8), key)] + (self._keys[:1] if keep_old else [])
+
+    def revoke_refresh_tokens(self):
+        with self._lock:
+            self._refresh_tokens.clear()
+
+    def jwks(self):
+        with self._lock:
+            keys = list(self._keys)
+        return {
+            "keys": [
+                {**key.public_key().to_json(), "kid": kid, "alg": "RS256", "use": "sig"}
+                for kid, key in keys
+            ]
+        }
+
+    def id_token(self, nonce=None, lifetime=None):
+        now = int(time.time())
+        claims = {
+            "iss": self.url,
+            "sub": self.email,
+            "aud": self.client_id,
+            "iat": now,
+            "exp": now + (lifetime or self.token_lifetime),
+            "email": self.email,
+        }
+        if nonce:
+            claims["nonce"] = nonce
+        with self._lock:
+            kid, key = self._keys[0]
+        return JWS.sign(
+            json.dumps(claims).encode(), key=key, alg=josepy.RS256,
+            protect=frozenset(["alg", "kid"]), kid=kid,
+        ).to_compact().decode()
+
+    def _tokens(self, nonce=None):
+        access_token, refresh_token = secrets.token_urlsafe(), secrets.token_urlsafe()
+        with self._lock:
+            self._access_tokens.add(access_token)
+            self._refresh_tokens.add(refresh_token)
+        return {
+            "token_type": "Bearer",
+            "expires_in": self.token_lifetime,
+            "access_token": access_token,
+            "refresh_token": refresh_token,
+            "id_token": self.id_token(nonce),
+        }
+
+    # --- endpoints ---
+
+    def authorize(self, query):
+        code = secrets.token_urlsafe()
+        with self._lock:
+            self._codes[code] = query.get("nonce")
+        params = {"code": code, "state": query.get("state", "")}
+        return 302, {"Location": f"{query['redirect_uri']}?{urlencode(params)}"}, None
+
+    def token(self, form):
+        if (form.get("client_id"), form.get("client_secret")) != (self.client_id, self.client_secret):
+            return 401, {}, {"error": "invalid_client"}
+        grant_type = form.get("grant_type")
+        with self._lock:
+            if grant_type == "authorization_code" and form.get("code") in self._codes:
+                nonce = self._codes.pop(form["code"])
+            elif grant_type == "refresh_token" and form.get("refresh_token") in self._refresh_tokens:
+                # refresh tokens are single use
+                self._refresh_tokens.discard(form["refresh_token"])
+                nonce = None
+            else:
+                return 400, {}, {"error": "invalid_grant"}
+        return 200, {}, self._tokens(nonce)
+
+    def userinfo(self, headers):
+        token = (headers.get("Authorization") or "").removeprefix("Bearer ")
+        with self._lock:
+            valid = token in self._access_tokens
+        if not valid:
+            return 401, {}, {"error": "invalid_token"}
+        return 200, {}, {"sub": self.email, "email": self.email, "email_verified": True}
+
+    def discovery(self):
+        settings = self.settings()
+        return 200, {}, {
+            "issuer": self.url,
+            "authorization_endpoint": settings["OIDC_OP_AUTHORIZATION_ENDPOINT"],
+            "token_endpoint": settings["OIDC_OP_TOKEN_ENDPOINT"],
+            "userinfo_endpoint": settings["OIDC_OP_USER_ENDPOINT"],
+            "jwks_uri": settings["OIDC_OP_JWKS_ENDPOINT"],
+            "id_token_signing_alg_values_supported": ["RS256"],
+        }
+
+    def _handler(self):
+        idp = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _send(self, status, headers, body):
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                data = json.dumps(body).encode() if body is not None else b""
+                if body is not None:
+                    self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                idp.requests[url.path] += 1
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                if url.path == "/authorize":
+                    self._send(*idp.authorize(query))
+                elif url.path == "/userinfo":
+                    self._send(*idp.userinfo(self.headers))
+                elif url.path == "/jwks":
+                    self._send(200, {}, idp.jwks())
+                elif url.path == "/.well-known/openid-configuration":
+                    self._send(*idp.discovery())
+                else:
+                    self._send(404, {}, {"error": "not_found"})
+
+            def do_POST(self):
+                url = urlsplit(self.path)
+                idp.requests[url.path] += 1
+                if url.path != "/token":
+                    return self._send(404, {}, {"error": "not_found"})
+                length = int(self.headers.get("Content-Length") or 0)
+                form = {
+                    key: values[0]
+                    for key, values in parse_qs(self.rfile.read(length).decode()).items()
+                }
+                self._send(*idp.token(form))
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
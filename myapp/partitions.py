@@ -0,0 +1,132 @@
+# myapp/partitions.py
+"""
+Monthly range partitions of the comment table (PostgreSQL only).
+
+Migration 0005 turns myapp_comment into a table partitioned by created_at,
+one partition per month plus a default partition as a safety net. The
+`comment_partitions` command (run at start-up and from Celery beat)
+creates partitions ahead of time and drops old ones that archival has
+emptied, so indexes and vacuum work stay proportional to recent months.
+"""
+import datetime
+import re
+
+TABLE = "myapp_comment"
+DEFAULT_PARTITION = f"{TABLE}_default"
+PARTITION_RE = re.compile(rf"^{TABLE}_p(\d{{4}})(\d{{2}})$")
+
+
+def month_start(value):
+    return datetime.date(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"{TABLE}_p{month:%Y%m}"
+
+
+def is_partitioned(connection):
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass", [TABLE])
+        return cursor.fetchone() is not None
+
+
+def monthly_partitions(connection):
+    """
+    {month: partition name} for the existing monthly partitions.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname FROM pg_inherits
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = %s::regclass
+            """,
+            [TABLE],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+
+    partitions = {}
+    for name in names:
+        match = PARTITION_RE.match(name)
+        if match:
+            partitions[datetime.date(int(match[1]), int(match[2]), 1)] = name
+    return partitions
+
+
+def create_partitions(connection, first, last):
+    """
+    Create the monthly partitions from `first` to `last` (inclusive) and the
+    default partition. Returns the names of the partitions created.
+    """
+    existing = monthly_partitions(connection)
+    created = []
+    with connection.cursor() as cursor:
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT")
+        month = month_start(first)
+        while month <= last:
+            if month not in existing:
+                _create_partition(cursor, month)
+                created.append(partition_name(month))
+            month = add_months(month, 1)
+    return created
+
+
+def _create_partition(cursor, month):
+    # bounds in UTC, the same as Django stores created_at
+    start = f"{month:%Y-%m-%d} 00:00:00+00"
+    end = f"{add_months(month, 1):%Y-%m-%d} 00:00:00+00"
+    create = f"CREATE TABLE {partition_name(month)} PARTITION OF {TABLE} FOR VALUES FROM ('{start}') TO ('{end}')"
+
+    cursor.execute(
+        f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE created_at >= %s AND created_at < %s)",
+        [start, end],
+    )
+    if not cursor.fetchone()[0]:
+        cursor.execute(create)
+        return
+
+    # the month's rows went to the default partition, which would now
+    # violate its constraint: move them over while it is detached
+    cursor.execute(f"ALTER TABLE {TABLE} DETACH PARTITION {DEFAULT_PARTITION}")
+    cursor.execute(create)
+    cursor.execute(
+        f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE created_at >= %s AND created_at < %s RETURNING *) "
+        f"INSERT INTO {TABLE} SELECT * FROM moved",
+        [start, end],
+    )
+    cursor.execute(f"ALTER TABLE {TABLE} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT")
+
+
+def drop_empty_partitions(connection, before):
+    """
+    Drop monthly partitions that end before `before` and hold no rows.
+    Returns the names of the partitions dropped.
+    """
+    dropped = []
+    with connection.cursor() as cursor:
+        for month, name in sorted(monthly_partitions(connection).items()):
+            if add_months(month, 1) > before:
+                continue
+            cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {name})")
+            if cursor.fetchone()[0]:
+                continue
+            cursor.execute(f"ALTER TABLE {TABLE} DETACH PARTITION {name}")
+            cursor.execute(f"DROP TABLE {name}")
+            dropped.append(name)
+    return dropped
+
+
+def oldest_default_row(connection):
+    """
+    created_at of the oldest comment that ended up in the default partition.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT min(created_at) FROM {DEFAULT_PARTITION}")
+        return cursor.fetchone()[0]
@@ -0,0 +1,430 @@
+# myapp/ratelimit.py
+"""
+Admission control for the write endpoints, so one script flooding
+comments or uploads can't take the database and the workers from everyone
+else.
+
+- rate_limit(name) gives every user a token bucket per endpoint
+  (RATE_LIMITS[name], "<requests>/<period>"): bursts of up to <requests>,
+  refilled evenly over <period>. An empty bucket answers 429 with the
+  seconds until the next token in Retry-After.
+- concurrency_limit(name) / slot(name) cap how many requests run the
+  expensive paths (uploads, exports) at once over all users
+  (CONCURRENCY_LIMITS[name]). A full path answers 503 right away instead
+  of queueing behind the running ones. Slots are leases: one whose worker
+  died frees up after CONCURRENCY_LEASE_SECONDS.
+
+With REDIS_HOST the buckets and slots are shared by all workers and
+replicas, each check one atomic Lua script. Otherwise they are kept in
+process, per worker. A limiter that fails (Redis down) admits the
+request: throttling must never take the site down with it.
+"""
+import logging
+import math
+import re
+import secrets
+import threading
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "memelord:ratelimit:"
+RATE_PATTERN = re.compile(r"^\s*(\d+)\s*/\s*(\d*)\s*([smhd])\s*$")
+PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+# methods that are never limited
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+# local buckets are swept of full (idle) ones beyond this many
+MAX_LOCAL_BUCKETS = 10000
+
+# KEYS[1]: bucket; ARGV: capacity, tokens per second, cost.
+# Returns {allowed, seconds until `cost` tokens are available}.
+TOKEN_BUCKET_SCRIPT = """
+if redis.replicate_commands then redis.replicate_commands() end
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local wait = 0
+if tokens >= cost then
+  tokens = tokens - cost
+  allowed = 1
+else
+  wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate * 1000) + 1000)
+return {allowed, tostring(wait)}
+"""
+
+# KEYS[1]: sorted set of slot tokens by lease expiry; ARGV: limit, lease
+# seconds, token. Returns 1 if the slot was taken.
+ACQUIRE_SCRIPT = """
+if redis.replicate_commands then redis.replicate_commands() end
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[1]) then
+  return 0
+end
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[2]), ARGV[3])
+redis.call('EXPIRE', KEYS[1], math.ceil(tonumber(ARGV[2])) + 1)
+return 1
+"""
+
+
+def parse_rate(value):
+    """
+    "<requests>/<period>" (10/m, 60/h, 5/30s) as (capacity, tokens per
+    second); None for an empty value.
+    """
+    if not value:
+        return None
+    match = RATE_PATTERN.match(value)
+    if match is None:
+        raise ValueError(f"Invalid rate {value!r}, expected e.g. 10/m or 60/h")
+    requests, count, unit = match.groups()
+    period = int(count or 1) * PERIODS[unit]
+    if not int(requests) or not period:
+        return None
+    return int(requests), int(requests) / period
+
+
+class LocalLimiter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._slots = {}
+
+    def take(self, key, capacity, rate, cost=1):
+        """
+        Take `cost` tokens from the bucket; returns (allowed, seconds to
+        wait until they would be there).
+        """
+        now = time.monotonic()
+        with self._lock:
+            if len(self._buckets) > MAX_LOCAL_BUCKETS:
+                self._sweep(now)
+            tokens, ts, *_ = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - ts) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now, capacity, rate)
+        return allowed, 0.0 if allowed else (cost - tokens) / rate
+
+    def _sweep(self, now):
+        # full buckets are as good as new ones
+        self._buckets = {
+            key: bucket for key, bucket in self._buckets.items()
+            if bucket[0] + (now - bucket[1]) * bucket[3] < bucket[2]
+        }
+
+    def acquire(self, key, limit, lease):
+        """
+        Take one of `limit` slots for at most `lease` seconds; returns its
+        token, None if they are all taken.
+        """
+        now = time.monotonic()
+        with self._lock:
+            slots = {
+                token: expires for token, expires in self._slots.get(key, {}).items()
+                if expires > now
+            }
+            if len(slots) >= limit:
+                self._slots[key] = slots
+                return None
+            token = secrets.token_hex(8)
+            slots[token] = now + lease
+            self._slots[key] = slots
+            return token
+
+    def release(self, key, token):
+        with self._lock:
+            self._slots.get(key, {}).pop(token, None)
+
+
+class RedisLimiter:
+    def __init__(self, host, port, db, password=None):
+        # a hanging Redis must not hang the requests it guards
+        self._params = {
+            "host": host, "port": int(port), "db": int(db), "password": password or None,
+            "socket_timeout": 1, "socket_connect_timeout": 1,
+        }
+        self._client = None
+        self._take = None
+        self._acquire = None
+
+    def _connect(self):
+        import redis
+
+        if self._client is None:
+            client = redis.Redis(**self._params)
+            self._take = client.register_script(TOKEN_BUCKET_SCRIPT)
+            self._acquire = client.register_script(ACQUIRE_SCRIPT)
+            self._client = client
+        return self._client
+
+    def take(self, key, capacity, rate, cost=1):
+        self._connect()
+        allowed, wait = self._take(keys=[KEY_PREFIX + key], args=[capacity, rate, cost])
+        return bool(allowed), float(wait)
+
+    def acquire(self, key, limit, lease):
+        self._connect()
+        token = secrets.token_hex(8)
+        if self._acquire(keys=[KEY_PREFIX + key], args=[limit, lease, token]):
+            return token
+        return None
+
+    def release(self, key, token):
+        self._connect().zrem(KEY_PREFIX + key, token)
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            if settings.REDIS_HOST:
+                _limiter = RedisLimiter(
+                    settings.REDIS_HOST,
+                    settings.REDIS_PORT,
+                    settings.REDIS_DB,
+                    settings.REDIS_PASSWORD,
+                )
+            else:
+                _limiter = LocalLimiter()
+        return _limiter
+
+
+def _identity(request, user):
+    if user is not None and user.is_authenticated:
+        return f"user:{user.pk}"
+    return f"ip:{request.META.get('REMOTE_ADDR', '')}"
+
+
+def _rate(name, user):
+    rate = parse_rate(settings.RATE_LIMITS.get(name))
+    if rate is None:
+        return None
+    if user is not None and user.is_staff and settings.RATE_LIMIT_EXEMPT_STAFF:
+        return None
+    return rate
+
+
+def capacity(name, user=None):
+    """
+    The most tokens `user` can take from `name` at once, None if unlimited.
+    """
+    rate = _rate(name, user)
+    return None if rate is None else rate[0]
+
+
+def check_rate(name, identity, user=None, cost=1):
+    """
+    Take from `identity`'s bucket for `name`; returns the seconds to wait
+    if it is empty, None if the request may go ahead.
+    """
+    rate = _rate(name, user)
+    if rate is None:
+        return None
+    capacity, per_second = rate
+    try:
+        allowed, wait = get_limiter().take(f"{name}:{identity}", capacity, per_second, cost)
+    except Exception:
+        logger.warning("Rate limiter failed, admitting the request", exc_info=True)
+        return None
+    return None if allowed else wait
+
+
+class Slot:
+    """
+    A concurrency slot of `name`; falsy if the path is full. Released
+    when leaving the `with` block or on release(), whichever comes first.
+    """
+    def __init__(self, name):
+        self.key = f"concurrency:{name}"
+        self.token = None
+        self.acquired = True
+        limit = settings.CONCURRENCY_LIMITS.get(name, 0)
+        if limit <= 0:
+            return
+        try:
+            self.token = get_limiter().acquire(self.key, limit, settings.CONCURRENCY_LEASE_SECONDS)
+        except Exception:
+            logger.warning("Concurrency limiter failed, admitting the request", exc_info=True)
+            return
+        self.acquired = self.token is not None
+
+    def __bool__(self):
+        return self.acquired
+
+    def release(self):
+        token, self.token = self.token, None
+        if token is None:
+            return
+        try:
+            get_limiter().release(self.key, token)
+        except Exception:
+            # the lease runs out on its own
+            logger.warning("Releasing a concurrency slot failed", exc_info=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def slot(name):
+    return Slot(name)
+
+
+def limited_response(request, status, message, retry_after):
+    """
+    429/503 with Retry-After: JSON for scripts, XHR and tus clients, text
+    for browser form posts.
+    """
+    if "text/html" in request.headers.get("Accept", "") and not request.headers.get("x-requested-with"):
+        response = HttpResponse(message, status=status, content_type="text/plain; charset=utf-8")
+    else:
+        response = JsonResponse({"ok": False, "error": message}, status=status)
+    response["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    response["Cache-Control"] = "no-store"
+    return response
+
+
+def _rate_limited(request, wait):
+    return limited_response(request, 429, "Too many requests, slow down a little.", wait)
+
+
+def _busy(request):
+    return limited_response(
+        request, 503, "Too busy right now, try again shortly.", settings.CONCURRENCY_RETRY_AFTER
+    )
+
+
+async def acheck_request(request, name, cost=1):
+    """
+    rate_limit()'s check from inside an async view, for costs only known
+    once the request is parsed; returns the 429 response, None to go ahead.
+    """
+    user = await request.auser()
+    wait = await sync_to_async(check_rate, thread_sensitive=False)(
+        name, _identity(request, user), user, cost
+    )
+    return None if wait is None else _rate_limited(request, wait)
+
+
+def rate_limit(name, methods=None):
+    """
+    Throttle a view with the per-user token bucket RATE_LIMITS[name].
+    Only `methods` (default: all but GET/HEAD/OPTIONS) take tokens.
+    """
+    def applies(request):
+        return request.method in methods if methods else request.method not in SAFE_METHODS
+
+    def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def _wrapped_view(request, *args, **kwargs):
+                if applies(request):
+                    limited = await acheck_request(request, name)
+                    if limited is not None:
+                        return limited
+                return await view_func(request, *args, **kwargs)
+        else:
+            @wraps(view_func)
+            def _wrapped_view(request, *args, **kwargs):
+                if applies(request):
+                    wait = check_rate(name, _identity(request, request.user), request.user)
+                    if wait is not None:
+                        return _rate_limited(request, wait)
+                return view_func(request, *args, **kwargs)
+        return _wrapped_view
+    return decorator
+
+
+def _release_after(response, held):
+    """
+    Hold the slot until a streaming response is sent, release it now
+    otherwise.
+    """
+    if not response.streaming:
+        held.release()
+        return response
+    content = response.streaming_content
+    if response.is_async:
+        async def stream():
+            try:
+                async for part in content:
+                    yield part
+            finally:
+                await sync_to_async(held.release, thread_sensitive=False)()
+    else:
+        def stream():
+            try:
+                yield from content
+            finally:
+                held.release()
+    response.streaming_content = stream()
+    return response
+
+
+def concurrency_limit(name, methods=None):
+    """
+    Cap the requests running a view at once at CONCURRENCY_LIMITS[name];
+    the rest are turned away with a 503. Only `methods` (default: all but
+    GET/HEAD/OPTIONS) take a slot.
+    """
+    def applies(request):
+        return request.method in methods if methods else request.method not in SAFE_METHODS
+
+    def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def _wrapped_view(request, *args, **kwargs):
+                if not applies(request):
+                    return await view_func(request, *args, **kwargs)
+                held = await sync_to_async(slot, thread_sensitive=False)(name)
+                if not held:
+                    return _busy(request)
+                try:
+                    response = await view_func(request, *args, **kwargs)
+                except BaseException:
+                    await sync_to_async(held.release, thread_sensitive=False)()
+                    raise
+                if response.streaming:
+                    return _release_after(response, held)
+                await sync_to_async(held.release, thread_sensitive=False)()
+                return response
+        else:
+            @wraps(view_func)
+            def _wrapped_view(request, *args, **kwargs):
+                if not applies(request):
+                    return view_func(request, *args, **kwargs)
+                held = slot(name)
+                if not held:
+                    return _busy(request)
+                try:
+                    response = view_func(request, *args, **kwargs)
+                except BaseException:
+                    held.release()
+                    raise
+                return _release_after(response, held)
+        return _wrapped_view
+    return decorator
@@ -0,0 +1,260 @@
+# myapp/resumable.py
+"""
+Resumable uploads, speaking the core of the tus 1.0.0 protocol (with the
+creation and termination extensions), so tus clients work unchanged.
+
+An upload is a staging file (<id>.part) plus a JSON sidecar (<id>.json)
+in RESUMABLE_UPLOAD_DIR. The staging file's size is the upload offset:
+every PATCH appends under an flock after checking the client's offset,
+so a retry after a dropped connection resends only what's missing, and
+no web worker is held between chunks.
+
+The PATCH that completes an upload runs the single upload's checks
+(validate_media_file) on the assembled file and moves it into place:
+with the staging directory on the MEDIA_ROOT filesystem that's a link and
+an unlink, atomic and without a copy. Other storages get a regular save.
+"""
+import base64
+import binascii
+import fcntl
+import json
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.utils.http import http_date
+
+from .forms import validate_media_file
+from .models import Media
+
+TUS_VERSION = "1.0.0"
+TUS_EXTENSIONS = "creation,termination"
+CHUNK_SIZE = 1024 * 1024
+
+# Upload-Metadata keys kept for the media row
+METADATA_KEYS = ("filename", "filetype", "title", "tags", "album")
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_metadata(header):
+    """
+    Upload-Metadata: comma separated "key base64(value)" pairs.
+    """
+    metadata = {}
+    for pair in filter(None, (part.strip() for part in (header or "").split(","))):
+        key, _, value = pair.partition(" ")
+        if key not in METADATA_KEYS:
+            continue
+        try:
+            metadata[key] = base64.b64decode(value, validate=True).decode()
+        except (binascii.Error, UnicodeDecodeError):
+            raise UploadError(f"Invalid Upload-Metadata value for {key}")
+    return metadata
+
+
+def _directory():
+    os.makedirs(settings.RESUMABLE_UPLOAD_DIR, exist_ok=True)
+    return settings.RESUMABLE_UPLOAD_DIR
+
+
+@contextmanager
+def _locked(path):
+    with open(f"{path}.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class ResumableUpload:
+    def __init__(self, upload_id, info):
+        self.id = upload_id
+        self.info = info
+        self.base = os.path.join(_directory(), upload_id)
+
+    @property
+    def part_path(self):
+        return f"{self.base}.part"
+
+    @property
+    def length(self):
+        return self.info["length"]
+
+    @property
+    def media_id(self):
+        return self.info.get("media_id")
+
+    @classmethod
+    def create(cls, user, length, metadata):
+        if length > settings.RESUMABLE_UPLOAD_MAX_MB * 1024 * 1024:
+            raise UploadError("Upload too large", status=413)
+        if not metadata.get("filename"):
+            raise UploadError("Upload-Metadata must include the filename")
+        upload = cls(uuid.uuid4().hex, {"user": user.pk, "length": length, **metadata})
+        open(upload.part_path, "xb").close()
+        upload._write_info()
+        return upload
+
+    @classmethod
+    def get(cls, upload_id, user):
+        """
+        The user's upload, None if it doesn't exist (or isn't theirs).
+        """
+        try:
+            uuid.UUID(hex=upload_id)
+            with open(os.path.join(_directory(), f"{upload_id}.json")) as f:
+                info = json.load(f)
+        except (ValueError, FileNotFoundError):
+            return None
+        return cls(upload_id, info) if info["user"] == user.pk else None
+
+    def _write_info(self):
+        tmp = f"{self.base}.json.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.info, f)
+        os.replace(tmp, f"{self.base}.json")
+
+    def offset(self):
+        if self.media_id:
+            return self.length
+        try:
+            return os.path.getsize(self.part_path)
+        except FileNotFoundError:
+            return self.length
+
+    def expires(self):
+        try:
+            modified = os.path.getmtime(self.part_path)
+        except FileNotFoundError:
+            modified = time.time()
+        return http_date(modified + settings.RESUMABLE_UPLOAD_EXPIRE_HOURS * 3600)
+
+    def append(self, stream, offset, content_length):
+        """
+        Append a chunk read from `stream` at `offset`; returns the new
+        offset. The chunk must not run past the declared length.
+        """
+        with _locked(self.base):
+            current = self.offset()
+            if offset != current:
+                raise UploadError(f"Upload-Offset is {current}", status=409)
+            if content_length is not None and offset + content_length > self.length:
+                raise UploadError("Chunk exceeds Upload-Length", status=413)
+            with open(self.part_path, "ab") as f:
+                remaining = self.length - offset
+                while remaining > 0:
+                    chunk = stream.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    remaining -= len(chunk)
+                if stream.read(1):
+                    # whatever did fit is kept, the offset tells the client
+                    raise UploadError("Chunk exceeds Upload-Length", status=413)
+            return self.offset()
+
+    def assemble(self, user):
+        """
+        Validate the complete file and move it into the media storage.
+        Returns (storage name, media type, metadata); a file that fails the
+        checks is deleted with the upload (forms.ValidationError).
+        """
+        with _locked(self.base):
+            if self.media_id or self.info.get("name"):
+                raise UploadError("Upload is already complete", status=409)
+            filename = os.path.basename(self.info["filename"])
+            with open(self.part_path, "rb") as f:
+                try:
+                    media_type, metadata = validate_media_file(
+                        File(f, name=filename), self.info.get("filetype", "")
+                    )
+                except Exception:
+                    self.delete()
+                    raise
+            name = Media._meta.get_field("file").generate_filename(Media(uploader=user), filename)
+            name = self._move(name)
+            self.info["name"] = name
+            self._write_info()
+            return name, media_type, metadata
+
+    def _move(self, name):
+        storage = default_storage
+        try:
+            storage.path(name)
+        except NotImplementedError:
+            with open(self.part_path, "rb") as f:
+                name = storage.save(name, File(f))
+            os.unlink(self.part_path)
+            return name
+        while True:
+            name = storage.get_available_name(name)
+            path = storage.path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                # link() never replaces an existing file, unlike rename()
+                os.link(self.part_path, path)
+            except FileExistsError:
+                continue
+            except OSError:
+                # not on the MEDIA_ROOT filesystem
+                with open(self.part_path, "rb") as f:
+                    name = storage.save(name, File(f))
+                break
+            if storage.file_permissions_mode is not None:
+                os.chmod(path, storage.file_permissions_mode)
+            break
+        os.unlink(self.part_path)
+        return name
+
+    def completed(self, media):
+        with _locked(self.base):
+            self.info["media_id"] = media.pk
+            self._write_info()
+
+    def delete(self):
+        for suffix in (".part", ".json", ".lock"):
+            try:
+                os.unlink(self.base + suffix)
+            except FileNotFoundError:
+                pass
+
+
+def delete_stale(max_age=None):
+    """
+    Remove uploads untouched for RESUMABLE_UPLOAD_EXPIRE_HOURS; returns
+    how many.
+    """
+    if max_age is None:
+        max_age = timedelta(hours=settings.RESUMABLE_UPLOAD_EXPIRE_HOURS)
+    cutoff = (datetime.now(timezone.utc) - max_age).timestamp()
+    directory = settings.RESUMABLE_UPLOAD_DIR
+    if not os.path.isdir(directory):
+        return 0
+    removed = 0
+    for entry in os.scandir(directory):
+        if not entry.name.endswith(".json") or entry.stat().st_mtime >= cutoff:
+            continue
+        base = entry.path[: -len(".json")]
+        try:
+            if os.path.getmtime(f"{base}.part") >= cutoff:
+                continue
+        except FileNotFoundError:
+            pass
+        for suffix in (".part", ".json", ".lock"):
+            try:
+                os.unlink(base + suffix)
+            except FileNotFoundError:
+                pass
+        removed += 1
+    return removed
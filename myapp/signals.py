@@ -1,8 +1,112 @@
 # myapp/signals.py
 
-from django.db.models.signals import post_save
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_save, post_delete, post_migrate, m2m_changed
+from django.contrib.auth.signals import user_logged_out
 from django.dispatch import receiver
 from django.contrib.auth.models import User
 from .models import *
+from . import background, events, titlesearch, transcode, usercache
+from .mediacache import get_media_cache
+from .versioning import bump_feed_version
 
 
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, **kwargs):
+    if created:
+        Media.objects.filter(pk=instance.media_id).update(
+            comment_count=F("comment_count") + 1,
+            comment_version=F("comment_version") + 1,
+        )
+        transaction.on_commit(bump_feed_version)
+        transaction.on_commit(lambda: events.publish(
+            events.comments_channel(instance.media_id), "comment", {"id": instance.pk}
+        ))
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    Media.objects.filter(pk=instance.media_id).update(
+        comment_count=Greatest(F("comment_count") - 1, 0),
+        comment_version=F("comment_version") + 1,
+    )
+    transaction.on_commit(bump_feed_version)
+    comment_id = instance.pk
+    transaction.on_commit(lambda: events.publish(
+        events.comments_channel(instance.media_id), "comment_deleted", {"id": comment_id}
+    ))
+
+
+@receiver(post_save, sender=Media)
+def media_created(sender, instance, created, **kwargs):
+    if created and instance.is_public:
+        transaction.on_commit(lambda: events.publish(
+            events.FEED_CHANNEL, "media", {"id": instance.pk}
+        ))
+
+
+# anything rendered on a feed card changed → feed ETags must change too
+@receiver(post_save, sender=Media)
+@receiver(post_delete, sender=Media)
+def media_changed(sender, instance, **kwargs):
+    transaction.on_commit(bump_feed_version)
+
+
+@receiver(post_delete, sender=Media)
+def media_deleted(sender, instance, **kwargs):
+    if settings.MEDIA_PROXY and instance.file.name:
+        name = instance.file.name
+        transaction.on_commit(lambda: get_media_cache().evict(name))
+    if instance.video_file or instance.webp_file or instance.hls_playlist:
+        pk = instance.pk
+        transaction.on_commit(lambda: transcode.delete_renditions(pk))
+
+
+@receiver(m2m_changed, sender=Media.tags.through)
+def media_tags_changed(sender, action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        transaction.on_commit(bump_feed_version)
+
+
+# renamed or deleted tags show on the cards and in /api/v1/tags/
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_changed(sender, instance, **kwargs):
+    transaction.on_commit(bump_feed_version)
+
+
+# cached snapshots and display names (myapp/usercache.py)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: usercache.invalidate(pk))
+
+
+# their live comments go with the cascade, the archived ones are rewritten
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    from .tasks import forget_comment_authors
+
+    pk = instance.pk
+    transaction.on_commit(lambda: background.send(forget_comment_authors, [pk]))
+
+
+@receiver(user_logged_out)
+def user_logged_out_(sender, request, user, **kwargs):
+    if user is not None:
+        usercache.invalidate(user.pk)
+
+
+@receiver(post_migrate)
+def title_search_index(sender, using, **kwargs):
+    # SQLite drops the search triggers whenever a migration rebuilds the media table
+    if sender.name != "myapp":
+        return
+    connection = connections[using]
+    if ("myapp", "0013_media_search_indexes") in MigrationRecorder(connection).applied_migrations():
+        titlesearch.ensure_index(connection)
@@ -0,0 +1,16 @@
+'use strict';
+// Changelist filters picked with select2 (myapp/adminlist.py): show the
+// filtered list as soon as a row is picked or the filter is cleared.
+{
+    const $ = django.jQuery;
+
+    $(function() {
+        $('.autocomplete-filter').on('change', function() {
+            const params = new URLSearchParams(this.dataset.queryString);
+            if (this.value) {
+                params.set(this.dataset.parameter, this.value);
+            }
+            window.location.search = params.toString();
+        });
+    });
+}
@@ -0,0 +1,128 @@
+# myapp/staticassets.py
+"""
+Static asset pipeline: what gets collected and how it is served.
+
+PrunedAppDirectoriesFinder keeps unused vendor assets out of STATIC_ROOT.
+myapp/static/assets/vendor holds complete upstream distributions (every
+locale, plugin and build variant); only a handful of files are used. Under
+STATIC_PRUNE_PREFIXES, collectstatic only picks up files that a template
+references with {% static %}, plus whatever those reference in turn
+(fonts and images in CSS url()s, source maps), which is exactly what
+ManifestStaticFilesStorage needs to rewrite them.
+
+StaticFilesMiddleware is WhiteNoise's middleware made async-capable, so
+under ASGI ordinary requests (and long-lived SSE streams) don't get pushed
+through a thread by a sync-only middleware.
+"""
+import posixpath
+import re
+from functools import lru_cache
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.finders import AppDirectoriesFinder
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+STATIC_TAG_RE = re.compile(r"""{%\s*static\s+["']([^"']+)["']""")
+CSS_URL_RE = re.compile(r"""url\(\s*["']?([^"')]+)["']?\s*\)""")
+SOURCE_MAP_RE = re.compile(r"""[#@]\s*sourceMappingURL=(\S+?)(?:\s*\*/)?\s*$""", re.MULTILINE)
+
+
+def _template_dirs():
+    for engine in settings.TEMPLATES:
+        yield from engine.get("DIRS", [])
+    for app_config in apps.get_app_configs():
+        yield Path(app_config.path) / "templates"
+
+
+def _dependencies(path, text):
+    """
+    Static paths referenced from inside the (CSS/JS) file at `path`.
+    """
+    targets = SOURCE_MAP_RE.findall(text)
+    if path.endswith(".css"):
+        targets += CSS_URL_RE.findall(text)
+    for target in targets:
+        if target.startswith(("data:", "#", "/")) or "//" in target:
+            continue
+        target = re.split(r"[?#]", target)[0]
+        yield posixpath.normpath(posixpath.join(posixpath.dirname(path), target))
+
+
+@lru_cache(maxsize=None)
+def referenced_assets():
+    """
+    Every static path the templates use, directly or through CSS/JS files.
+    """
+    pending = set()
+    for directory in _template_dirs():
+        for template in Path(directory).rglob("*.html"):
+            pending.update(STATIC_TAG_RE.findall(template.read_text(errors="ignore")))
+
+    referenced = set()
+    while pending:
+        path = pending.pop()
+        if path in referenced:
+            continue
+        referenced.add(path)
+        if path.endswith((".css", ".js")):
+            found = finders.find(path)
+            if found:
+                pending.update(_dependencies(path, Path(found).read_text(errors="ignore")))
+    return referenced
+
+
+class PrunedAppDirectoriesFinder(AppDirectoriesFinder):
+    """
+    AppDirectoriesFinder that lists files under STATIC_PRUNE_PREFIXES only
+    if they are referenced (see referenced_assets()). find() is unchanged,
+    so DEBUG serving still sees everything.
+    """
+    def list(self, ignore_patterns):
+        prefixes = tuple(getattr(settings, "STATIC_PRUNE_PREFIXES", ()))
+        for path, storage in super().list(ignore_patterns):
+            if prefixes and path.replace("\\", "/").startswith(prefixes) and path not in referenced_assets():
+                continue
+            yield path, storage
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file, thread_sensitive=False)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            # stat()/open() of the file, keep it off the event loop
+            response = await sync_to_async(self.serve, thread_sensitive=False)(static_file, request)
+            if response.streaming and response.file_to_stream is not None:
+                # Django would otherwise read the whole file in one go to
+                # serve a sync iterator from an async handler
+                response.streaming_content = _aread_chunks(response.file_to_stream)
+            return response
+        return await self.get_response(request)
+
+
+async def _aread_chunks(file, chunk_size=64 * 1024):
+    read = sync_to_async(file.read, thread_sensitive=False)
+    try:
+        while chunk := await read(chunk_size):
+            yield chunk
+    finally:
+        await sync_to_async(file.close, thread_sensitive=False)()
@@ -1,5 +1,90 @@
 # myapp/tasks.py
+import os
+import shutil
+import tempfile
+
 from celery import shared_task
+from django.core.files.storage import default_storage
 from django.core.management import call_command
 
 
+@shared_task
+def rotate_comment_partitions():
+    call_command("comment_partitions")
+
+
+@shared_task
+def archive_cold_comments():
+    call_command("archive_comments")
+
+
+@shared_task
+def forget_comment_authors(user_ids):
+    """
+    Archived comments of deleted users (myapp/archive.py).
+    """
+    from .archive import forget_authors
+
+    forget_authors(user_ids)
+
+
+@shared_task
+def transcode_media(media_id):
+    call_command("transcode_media", media_id)
+
+
+@shared_task
+def import_media(name):
+    """
+    Import an export the admin uploaded to the media storage, then delete
+    it; an interrupted import is finished by uploading it again.
+    """
+    try:
+        with tempfile.NamedTemporaryFile(suffix=os.path.splitext(name)[1]) as tmp:
+            with default_storage.open(name, "rb") as src:
+                shutil.copyfileobj(src, tmp, 1024 * 1024)
+            tmp.flush()
+            call_command("import_media", tmp.name)
+    finally:
+        default_storage.delete(name)
+
+
+@shared_task
+def delete_media_files(names, rendition_pks):
+    """
+    Storage cleanup after a bulk delete (myapp/bulkactions.py).
+    """
+    from .bulkactions import delete_files
+
+    delete_files(names, rendition_pks)
+
+
+# periodic upkeep (myapp/maintenance.py), scheduled by migration 0014
+@shared_task
+def optimize_database():
+    call_command("maintenance", "optimize")
+
+
+@shared_task
+def vacuum_database():
+    call_command("maintenance", "vacuum")
+
+
+@shared_task
+def reconcile_comment_counts():
+    call_command("maintenance", "reconcile")
+
+
+@shared_task
+def sweep_orphaned_files():
+    call_command("maintenance", "sweep")
+
+
+@shared_task
+def warm_caches():
+    call_command("maintenance", "warm")
+
+
+@shared_task
+def delete_stale_uploads():
+    call_command("maintenance", "uploads")
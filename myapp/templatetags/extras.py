@@ -11,5 +11,11 @@ def env(key):
         return settings.OIDC_ENABLED
     if key == "OIDC_AUTOLOGIN":
         return settings.OIDC_AUTOLOGIN
+    if key == "REALTIME_UPDATES":
+        return settings.REALTIME_UPDATES
+    if key == "FRAGMENT_CACHE_TTL":
+        return settings.FRAGMENT_CACHE_TTL
+    if key == "RESUMABLE_UPLOADS":
+        return settings.RESUMABLE_UPLOADS
     if key == "VERSION":
         return settings.VERSION        
@@ -1,3 +1,589 @@
-from django.test import TestCase
+import asyncio
+import base64
+import datetime
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import warnings
+import zipfile
+from importlib import import_module
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.cache.backends.base import CacheKeyWarning
+from django.core.exceptions import SuspiciousOperation
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import include, path
+from django.utils import timezone
+
+from . import api, archive, background, bulkactions, maintenance, mediaimport, oidc, ratelimit, tasks, views
+from .decorators import aetag
+from .models import Album, Comment, CommentArchive, Media, Tag
+from .oidcstub import StubIdP
+from .writequeue import WriteQueue
+
+MEDIA_ROOT = tempfile.mkdtemp()
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+        "OPTIONS": {"location": MEDIA_ROOT, "base_url": "/media/"},
+    },
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+def tearDownModule():
+    shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+
+@override_settings(STORAGES=STORAGES, CACHES=CACHES, MEDIA_PROXY=True, MEDIA_SENDFILE="")
+class MediaFileAccessTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user("owner")
+        self.other = User.objects.create_user("other")
+        self.private = Media.objects.create(
+            uploader=self.owner,
+            file=default_storage.save("memes/user_1/secret.png", ContentFile(b"secret")),
+            media_type=Media.MediaType.IMAGE,
+            is_public=False,
+        )
+        self.public = Media.objects.create(
+            uploader=self.owner,
+            file=default_storage.save("memes/user_1/public.png", ContentFile(b"public")),
+            media_type=Media.MediaType.IMAGE,
+        )
+        self.rendition = default_storage.save(f"renditions/{self.public.pk}/image.webp", ContentFile(b"webp"))
+        Media.objects.filter(pk=self.public.pk).update(webp_file=self.rendition)
+
+    def get(self, name):
+        return self.client.get(f"/media/{name}")
+
+    def test_private_upload_is_hidden_from_others(self):
+        self.client.force_login(self.other)
+        self.assertEqual(self.get(self.private.file.name).status_code, 404)
+        self.client.force_login(self.owner)
+        self.assertEqual(self.get(self.private.file.name).status_code, 200)
+
+    def test_renditions_of_visible_media(self):
+        self.client.force_login(self.other)
+        response = self.get(self.rendition)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"webp")
+
+    @override_settings(REALTIME_UPDATES=True)
+    def test_comments_of_private_media_are_hidden_from_others(self):
+        self.client.force_login(self.other)
+        pk = self.private.pk
+        self.assertEqual(self.client.get(f"/memes/{pk}/events/").status_code, 404)
+        self.assertEqual(self.client.get(f"/memes/{pk}/comments/", {"after": 0}).status_code, 404)
+        self.assertEqual(self.client.post(f"/memes/{pk}/comments/add/", {"text": "hi"}).status_code, 404)
+
+    def test_rendition_path_traversal(self):
+        self.client.force_login(self.other)
+        for name in (
+            f"renditions/{self.public.pk}/../../{self.private.file.name}",
+            f"renditions/{self.public.pk}/x/../../../{self.private.file.name}",
+            f"renditions/{self.public.pk}//../../{self.private.file.name}",
+            f"renditions/{self.public.pk}/./image.webp",
+        ):
+            self.assertEqual(self.get(name).status_code, 404, name)
+
+
+@override_settings(STORAGES=STORAGES, CACHES=CACHES)
+class FeedVisibilityTests(TestCase):
+    def setUp(self):
+        owner = User.objects.create_user("album-owner")
+        album = Album.objects.create(owner=owner, title="Private", is_private=True)
+        self.shown = Media.objects.create(uploader=owner, file="memes/user_1/shown.png", media_type=Media.MediaType.IMAGE)
+        self.hidden = Media.objects.create(uploader=owner, file="memes/user_1/hidden.png", media_type=Media.MediaType.IMAGE, album=album)
+        self.client.force_login(User.objects.create_user("viewer"))
+
+    def test_public_media_in_private_albums_are_left_out(self):
+        for url in ("/memes/", "/memes/random/"):
+            html = self.client.get(url, headers={"x-requested-with": "XMLHttpRequest"}).json()["html"]
+            self.assertIn(f"/memes/{self.shown.pk}/", html, url)
+            self.assertNotIn(f"/memes/{self.hidden.pk}/", html, url)
+
+
+@override_settings(CACHES=CACHES)
+class CommentCursorTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("reader")
+        self.media = Media.objects.create(uploader=self.user, file="memes/user_1/a.png", media_type=Media.MediaType.IMAGE)
+        self.client.force_login(self.user)
+
+    def comment(self, text):
+        return Comment.objects.create(media=self.media, author=self.user, text=text)
+
+    def newer(self, after):
+        return self.client.get(f"/memes/{self.media.pk}/comments/", {"after": after}).json()
+
+    def test_burst_longer_than_a_page_is_fetched_in_order(self):
+        first = self.comment("first")
+        comments = [self.comment(f"c{i}") for i in range(views.COMMENTS_PER_PAGE + 5)]
+
+        data = self.newer(first.pk)
+        self.assertTrue(data["has_more"])
+        self.assertEqual(data["cursor"], comments[views.COMMENTS_PER_PAGE - 1].pk)
+        # newest first, for the client to prepend
+        self.assertLess(data["html"].index(f'data-comment-id="{comments[1].pk}"'), data["html"].index(f'data-comment-id="{comments[0].pk}"'))
+
+        data = self.newer(data["cursor"])
+        self.assertFalse(data["has_more"])
+        self.assertEqual(data["cursor"], comments[-1].pk)
+        self.assertEqual(data["html"].count("data-comment-id"), 5)
+
+        self.assertEqual(self.newer(data["cursor"])["cursor"], comments[-1].pk)
+
+    def test_posting_does_not_move_the_cursor(self):
+        response = self.client.post(
+            f"/memes/{self.media.pk}/comments/add/",
+            {"text": "mine"},
+            headers={"x-requested-with": "XMLHttpRequest"},
+        )
+        self.assertTrue(response.json()["ok"])
+        self.assertNotIn("cursor", response.json())
+
+
+@override_settings(CACHES=CACHES)
+class CommentArchiveTests(TestCase):
+    def setUp(self):
+        self.stays = User.objects.create_user("stays")
+        self.leaves = User.objects.create_user("leaves")
+        self.media = Media.objects.create(uploader=self.stays, file="memes/user_1/a.png", media_type=Media.MediaType.IMAGE)
+        for user in (self.stays, self.leaves, self.stays):
+            Comment.objects.create(media=self.media, author=user, text=user.username)
+        archive.archive_thread(self.media.pk, timezone.now() + datetime.timedelta(seconds=1))
+
+    def test_deleting_a_user_drops_their_archived_comments(self):
+        pk = self.leaves.pk
+        with mock.patch("myapp.background.send") as send, self.captureOnCommitCallbacks(execute=True):
+            self.leaves.delete()
+        send.assert_called_once_with(tasks.forget_comment_authors, [pk])
+
+        self.assertEqual(archive.forget_authors([pk]), 1)
+        entries = archive.unpack(CommentArchive.objects.get(media=self.media).data)
+        self.assertEqual([entry["author"] for entry in entries], [self.stays.pk, self.stays.pk])
+        self.media.refresh_from_db()
+        self.assertEqual(self.media.comment_count, 2)
+        self.assertEqual(archive.forget_authors([pk]), 0)
+
+    async def test_comments_of_missing_authors_are_skipped(self):
+        # as left by a user deleted before forget_authors() ran
+        entries = archive.unpack((await CommentArchive.objects.aget(media=self.media)).data)
+        for entry in entries:
+            if entry["author"] == self.leaves.pk:
+                entry["author"] = self.leaves.pk + 1000
+        await CommentArchive.objects.filter(media=self.media).aupdate(data=archive.pack(entries))
+
+        media = await Media.objects.aget(pk=self.media.pk)
+        thread = await archive.athread(media, media.comments.all())
+        comments = await thread[0:3].aresolve()
+        self.assertEqual([comment.author for comment in comments], [self.stays, self.stays])
+
+    def test_cursor_without_timezone_is_rejected(self):
+        self.client.force_login(self.stays)
+        url = f"/api/v1/media/{self.media.pk}/comments/"
+        naive = api._encode_cursor(datetime.datetime(2030, 1, 1).isoformat(), 1)
+        response = self.client.get(url, {"cursor": naive})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"error": "Invalid cursor"})
+        aware = api._encode_cursor(timezone.now().isoformat(), 1)
+        self.assertEqual(self.client.get(url, {"cursor": aware}).status_code, 200)
+
+
+@override_settings(CACHES=CACHES)
+class TagSuggestionTests(TestCase):
+    def setUp(self):
+        Tag.objects.create(name="Funny cats")
+        self.client.force_login(User.objects.create_user("tagger"))
+
+    def suggest(self, q):
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", CacheKeyWarning)
+            return [tag["name"] for tag in self.client.get("/memes/tags/suggest/", {"q": q}).json()["results"]]
+
+    def test_cache_keys_of_any_term(self):
+        self.assertEqual(self.suggest("NY C"), ["Funny cats"])
+        self.assertEqual(self.suggest("ny\tcats"), [])
+        self.assertEqual(self.suggest("x" * 300), [])
+
+
+class ETagTests(TestCase):
+    async def etag(self, path):
+        async def version(request):
+            return 1
+
+        @aetag(version)
+        async def view(request):
+            return HttpResponse("")
+
+        request = AsyncRequestFactory().get(path)
+
+        async def auser():
+            return AnonymousUser()
+        request.auser = auser
+        return (await view(request))["ETag"]
+
+    async def test_covers_the_path(self):
+        self.assertEqual(await self.etag("/memes/"), await self.etag("/memes/"))
+        self.assertNotEqual(await self.etag("/memes/"), await self.etag("/api/v1/media/"))
+
+    @override_settings(MEDIA_PROXY=False)
+    async def test_changes_before_signed_urls_expire(self):
+        storage = mock.Mock(querystring_auth=True, querystring_expire=3600)
+        with mock.patch("myapp.decorators.default_storage", storage):
+            with mock.patch("time.time", return_value=0):
+                first = await self.etag("/memes/")
+            with mock.patch("time.time", return_value=1799):
+                self.assertEqual(await self.etag("/memes/"), first)
+            with mock.patch("time.time", return_value=1800):
+                self.assertNotEqual(await self.etag("/memes/"), first)
+
+class MediaImportChecksumTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("importer")
+        self.storage = FileSystemStorage(location=tempfile.mkdtemp(dir=MEDIA_ROOT))
+
+    def record(self, name, **fields):
+        return {"model": "myapp.media", "fields": {"file": name, "media_type": "image", **fields}}
+
+    def test_checksums_of_imported_media(self):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as zf:
+            zf.writestr("memes/old.png", b"old")
+            zf.writestr("memes/new.png", b"new")
+        self.storage.save("memes/stored.png", ContentFile(b"stored"))
+        with zipfile.ZipFile(buffer) as zf:
+            mediaimport.MediaImporter(storage=self.storage, archive=zf, default_user=self.user).run([
+                # exports from before checksums
+                self.record("memes/old.png"),
+                self.record("memes/new.png", checksum="carried"),
+                self.record("memes/stored.png"),
+            ])
+        checksums = dict(Media.objects.values_list("file", "checksum"))
+        self.assertEqual(checksums, {
+            "memes/old.png": hashlib.sha256(b"old").hexdigest(),
+            "memes/new.png": "carried",
+            "memes/stored.png": "",
+        })
+
+        with override_settings(STORAGES={**STORAGES, "default": {**STORAGES["default"], "OPTIONS": {"location": self.storage.location}}}):
+            call_command("media_metadata", stdout=io.StringIO())
+        self.assertEqual(Media.objects.get(file="memes/stored.png").checksum, hashlib.sha256(b"stored").hexdigest())
+
+
+PNG = b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x10\x00\x00\x00\x08" + b"x" * 200
+
+
+@override_settings(
+    STORAGES=STORAGES, CACHES=CACHES, TRANSCODE_VIDEOS=False,
+    RESUMABLE_UPLOADS=True, RESUMABLE_UPLOAD_DIR=f"{MEDIA_ROOT}/.resumable",
+)
+class ResumableUploadTests(TestCase):
+    headers = {"Tus-Resumable": "1.0.0"}
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user("resumer"))
+        metadata = ",".join(
+            f"{key} {base64.b64encode(value.encode()).decode()}"
+            for key, value in (("filename", "a.png"), ("filetype", "image/png"), ("title", "Resumed"))
+        )
+        response = self.client.post(
+            "/memes/upload/resumable/",
+            headers={**self.headers, "Upload-Length": str(len(PNG)), "Upload-Metadata": metadata},
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response["Upload-Offset"], "0")
+        self.url = response["Location"]
+
+    def patch(self, offset, data):
+        return self.client.generic(
+            "PATCH", self.url, data, "application/offset+octet-stream",
+            headers={**self.headers, "Upload-Offset": str(offset)},
+        )
+
+    def offset(self):
+        return self.client.head(self.url, headers=self.headers)["Upload-Offset"]
+
+    def test_resume_after_a_conflict(self):
+        response = self.patch(0, PNG[:100])
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response["Upload-Offset"], "100")
+        # a retried chunk the server already has
+        self.assertEqual(self.patch(0, PNG[:100]).status_code, 409)
+        self.assertEqual(self.offset(), "100")
+
+        response = self.patch(100, PNG[100:])
+        self.assertEqual(response.status_code, 204)
+        media = Media.objects.get()
+        self.assertEqual(response["Upload-Media-Url"], f"/memes/{media.pk}/")
+        self.assertEqual(media.title, "Resumed")
+        with default_storage.open(media.file.name) as f:
+            self.assertEqual(f.read(), PNG)
+        self.assertEqual(self.offset(), str(len(PNG)))
+
+
+class LocalLimiterTests(TestCase):
+    def setUp(self):
+        self.limiter = ratelimit.LocalLimiter()
+        patcher = mock.patch("time.monotonic", return_value=100.0)
+        self.clock = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_token_bucket(self):
+        # 3 tokens, one more every 10 seconds
+        self.assertEqual(self.limiter.take("k", 3, 0.1, cost=2), (True, 0.0))
+        self.assertEqual(self.limiter.take("k", 3, 0.1), (True, 0.0))
+        allowed, wait = self.limiter.take("k", 3, 0.1)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(wait, 10)
+        self.clock.return_value = 110.0
+        self.assertTrue(self.limiter.take("k", 3, 0.1)[0])
+        # refills up to the capacity only
+        self.clock.return_value = 1000.0
+        self.assertTrue(self.limiter.take("k", 3, 0.1, cost=3)[0])
+        self.assertFalse(self.limiter.take("k", 3, 0.1)[0])
+
+    def test_concurrency_slots(self):
+        first = self.limiter.acquire("k", 2, 30)
+        self.assertIsNotNone(self.limiter.acquire("k", 2, 30))
+        self.assertIsNone(self.limiter.acquire("k", 2, 30))
+        self.limiter.release("k", first)
+        self.assertIsNotNone(self.limiter.acquire("k", 2, 30))
+        # leases of crashed holders run out
+        self.clock.return_value = 131.0
+        self.assertIsNotNone(self.limiter.acquire("k", 2, 30))
+        self.assertIsNotNone(self.limiter.acquire("k", 2, 30))
+
+
+@override_settings(RATE_LIMITS={"upload": "3/h"}, CONCURRENCY_LIMITS={})
+class BatchUploadTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("uploader")
+        self.client.force_login(self.user)
+        patcher = mock.patch.object(ratelimit, "_limiter", ratelimit.LocalLimiter())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def upload(self, count):
+        files = [SimpleUploadedFile(f"{i}.png", b"png", "image/png") for i in range(count)]
+        return self.client.post("/memes/upload/batch/", {"files": files})
+
+    def test_larger_than_the_bucket(self):
+        response = self.upload(4)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["error"], "At most 3 files per batch")
+
+    def test_unknown_album(self):
+        for album in ("abc", "999"):
+            response = self.client.post("/memes/upload/batch/", {"files": [SimpleUploadedFile("a.png", b"png")], "album": album})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()["error"], "Unknown album")
+
+    def test_costs_a_token_per_file(self):
+        ratelimit.check_rate("upload", f"user:{self.user.pk}", self.user, cost=2)
+        self.assertEqual(self.upload(2).status_code, 429)
+
+
+@override_settings(STORAGES=STORAGES, CACHES=CACHES)
+class BulkDeleteTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("bulk")
+        self.tag = Tag.objects.create(name="bulk")
+        self.media = [
+            Media.objects.create(uploader=self.user, file=f"memes/user_1/bulk{i}.png", media_type=Media.MediaType.IMAGE)
+            for i in range(3)
+        ]
+        for media in self.media:
+            media.tags.add(self.tag)
+            Comment.objects.create(media=media, author=self.user, text="bye")
+        Media.objects.filter(pk=self.media[0].pk).update(webp_file=f"renditions/{self.media[0].pk}/image.webp")
+
+    def test_delete_media(self):
+        doomed = Media.objects.filter(pk__in=[self.media[0].pk, self.media[1].pk])
+        with mock.patch("myapp.background.send") as send, self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(bulkactions.delete_media(doomed), 2)
+
+        self.assertEqual(list(Media.objects.values_list("pk", flat=True)), [self.media[2].pk])
+        self.assertEqual(list(Comment.objects.values_list("media", flat=True)), [self.media[2].pk])
+        self.assertEqual(list(Media.tags.through.objects.values_list("media", flat=True)), [self.media[2].pk])
+        self.assertEqual(send.call_args_list, [
+            mock.call(tasks.delete_media_files, ["memes/user_1/bulk0.png", "memes/user_1/bulk1.png"], []),
+            mock.call(tasks.delete_media_files, [], [self.media[0].pk]),
+        ])
+
+
+@override_settings(STORAGES=STORAGES, ORPHAN_GRACE_HOURS=24)
+class SweepOrphansTests(TestCase):
+    def setUp(self):
+        self.storage = FileSystemStorage(location=tempfile.mkdtemp(dir=MEDIA_ROOT))
+        self.user = User.objects.create_user("sweeper")
+
+    def save(self, name, hours_old=0):
+        name = self.storage.save(name, ContentFile(b"x"))
+        mtime = time.time() - hours_old * 3600
+        os.utime(self.storage.path(name), (mtime, mtime))
+        return name
+
+    def test_files_within_the_grace_period_are_kept(self):
+        known = self.save("memes/user_1/known.png", hours_old=48)
+        Media.objects.create(uploader=self.user, file=known, media_type=Media.MediaType.IMAGE)
+        orphan = self.save("memes/user_1/orphan.png", hours_old=48)
+        fresh = self.save("memes/user_1/fresh.png", hours_old=1)
+        gone = self.save("renditions/999999/image.webp", hours_old=48)
+        old_import = self.save("imports/old.zip", hours_old=48)
+        new_import = self.save("imports/new.zip", hours_old=1)
+
+        self.assertEqual(maintenance.sweep_orphans(self.storage), (1, 1, 1))
+        for name in (known, fresh, new_import):
+            self.assertTrue(self.storage.exists(name), name)
+        for name in (orphan, gone, old_import):
+            self.assertFalse(self.storage.exists(name), name)
+
+
+class WriteQueueTests(TransactionTestCase):
+    async def test_concurrent_writes_share_a_batch(self):
+        batches = []
+
+        class Recording(WriteQueue):
+            def _next_batch(self):
+                batch = super()._next_batch()
+                batches.append(len(batch))
+                return batch
+
+        writes = Recording(window=0.5)
+        results = await asyncio.gather(*(writes.asubmit(lambda i=i: i * 2) for i in range(5)))
+        self.assertEqual(results, [0, 2, 4, 6, 8])
+        self.assertEqual(batches, [5])
+
+
+class BackgroundTests(TestCase):
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+    def test_without_broker_the_sender_does_not_wait(self):
+        release, ran = threading.Event(), []
+
+        def task(value):
+            release.wait(5)
+            ran.append(value)
+        task.name = "test"
+
+        background.send(task, 1)
+        self.assertEqual(ran, [])
+        release.set()
+        background.wait()
+        self.assertEqual(ran, [1])
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=False)
+    def test_with_broker_the_task_is_sent_through_the_configured_app(self):
+        from celery import current_app
+
+        with mock.patch("celery.app.task.Task.apply_async") as apply_async:
+            background.send(tasks.forget_comment_authors, [1])
+        apply_async.assert_called_once_with(([1],), {})
+        self.assertEqual(current_app.main, "myproject")
+
+
+urlpatterns = [path("oidc/", include("mozilla_django_oidc.urls"))]
+
+
+@override_settings(
+    CACHES=CACHES, ROOT_URLCONF=__name__, OIDC_JWKS_CACHE_SECONDS=3600, OIDC_TIMEOUT=10,
+    OIDC_SILENT_REFRESH=True, OIDC_SILENT_REFRESH_GRACE_SECONDS=300,
+    OIDC_RENEW_ID_TOKEN_EXPIRY_SECONDS=900,
+)
+class OIDCTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.idp = StubIdP().start()
+        cls.addClassCleanup(cls.idp.stop)
+        cls.enterClassContext(override_settings(**cls.idp.settings()))
+
+    def setUp(self):
+        oidc._jwks = None
+        cache.clear()
+
+    def verify(self, token):
+        return oidc.OIDCBackend().verify_refreshed_token(token, self.idp.email)
+
+    def test_claims_are_checked(self):
+        self.assertEqual(self.verify(self.idp.id_token())["sub"], self.idp.email)
+        with self.assertRaisesMessage(SuspiciousOperation, "ID token has expired."):
+            self.verify(self.idp.id_token(lifetime=-3600))
+        with override_settings(OIDC_RP_CLIENT_ID="someone-else"):
+            with self.assertRaisesMessage(SuspiciousOperation, "ID token is not for this client."):
+                self.verify(self.idp.id_token())
+        with override_settings(OIDC_OP_ISSUER="https://idp.example.com"):
+            with self.assertRaisesMessage(SuspiciousOperation, "ID token is from another issuer."):
+                self.verify(self.idp.id_token())
+
+    def test_rotated_key_is_fetched_once(self):
+        self.verify(self.idp.id_token())
+        fetches = self.idp.requests["/jwks"]
+        self.idp.rotate_key()
+        self.verify(self.idp.id_token())
+        self.verify(self.idp.id_token())
+        self.assertEqual(self.idp.requests["/jwks"], fetches + 1)
+
+    def test_unknown_kid_refetches_at_most_once_a_minute(self):
+        jwks = oidc.get_jwks()
+        jwks.keys()
+        fetches = self.idp.requests["/jwks"]
+        for _ in range(3):
+            self.assertIsNone(jwks.find("forged", "RS256"))
+        self.assertEqual(self.idp.requests["/jwks"], fetches + 1)
+        later = time.time() + oidc.JWKS_REFETCH_SECONDS
+        with mock.patch("myapp.oidc.time.time", return_value=later):
+            self.assertIsNone(jwks.find("forged", "RS256"))
+        self.assertEqual(self.idp.requests["/jwks"], fetches + 2)
+
+    def expired_session(self):
+        _, headers, _ = self.idp.authorize({"redirect_uri": "http://testserver/oidc/callback/"})
+        code = parse_qs(urlsplit(headers["Location"]).query)["code"][0]
+        _, _, tokens = self.idp.token({
+            "client_id": self.idp.client_id, "client_secret": self.idp.client_secret,
+            "grant_type": "authorization_code", "code": code,
+        })
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session[oidc.EXPIRATION_SESSION_KEY] = time.time() - 10
+        session[oidc.REFRESH_TOKEN_SESSION_KEY] = tokens["refresh_token"]
+        session[oidc.SUBJECT_SESSION_KEY] = self.idp.email
+        session.save()
+        return session
+
+    def get(self, session):
+        request = RequestFactory().get("/memes/")
+        request.session = session
+        request.user = User(username="dev", pk=1)
+        return oidc.SessionRefresh(lambda request: HttpResponse()).process_request(request)
+
+    def test_silent_refresh(self):
+        session = self.expired_session()
+        with mock.patch.object(oidc._executor, "submit", side_effect=lambda fn, *args: fn(*args)):
+            self.assertIsNone(self.get(session))
+            self.assertIsNone(self.get(session))
+        self.assertGreater(session[oidc.EXPIRATION_SESSION_KEY], time.time())
+        self.assertNotIn(oidc.PENDING_SESSION_KEY, session)
+
+    def test_refused_refresh_redirects_to_sign_in(self):
+        session = self.expired_session()
+        self.idp.revoke_refresh_tokens()
+        with mock.patch.object(oidc._executor, "submit", side_effect=lambda fn, *args: fn(*args)):
+            self.assertIsNone(self.get(session))
+            response = self.get(session)
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response["Location"].startswith(f"{self.idp.url}/authorize?"))
@@ -0,0 +1,128 @@
+# myapp/titlesearch.py
+"""
+Substring search on media titles through an index.
+
+title__icontains can't use a B-tree index, so every search reads the whole
+media table. ensure_index() (migration 0013, and again after every
+migrate) adds a trigram index:
+
+- PostgreSQL: a pg_trgm GIN index on UPPER(title::text), the expression
+  Django's icontains compares, so plain title__icontains uses it.
+- SQLite: an FTS5 table with the trigram tokenizer, kept in step with
+  myapp_media by triggers. Rebuilding myapp_media (SQLite's way to alter a
+  table) drops the triggers, which is why ensure_index() also runs after
+  migrate. title_filter() queries it with LIKE, which FTS5 answers from
+  the index for terms of MIN_INDEXED_LENGTH characters or more.
+
+Without either (no pg_trgm, SQLite without FTS5) searches scan as before.
+"""
+import logging
+
+from django.db import DatabaseError, connections, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+logger = logging.getLogger(__name__)
+
+TABLE = "myapp_media"
+PG_INDEX = "myapp_media_title_trgm_idx"
+FTS_TABLE = "myapp_media_title_fts"
+MIN_INDEXED_LENGTH = 3
+
+FTS_TRIGGERS = {
+    f"{FTS_TABLE}_ai": f"""
+        CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON {TABLE} BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, title) VALUES (new.id, new.title);
+        END
+    """,
+    f"{FTS_TABLE}_ad": f"""
+        CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON {TABLE} BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title) VALUES ('delete', old.id, old.title);
+        END
+    """,
+    f"{FTS_TABLE}_au": f"""
+        CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF title ON {TABLE} BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title) VALUES ('delete', old.id, old.title);
+            INSERT INTO {FTS_TABLE}(rowid, title) VALUES (new.id, new.title);
+        END
+    """,
+}
+
+
+def _ensure_postgresql(connection):
+    with connection.cursor() as cursor:
+        try:
+            with transaction.atomic(using=connection.alias):
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        except DatabaseError:
+            logger.warning("pg_trgm is not available, title search scans the table")
+            return
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {PG_INDEX} ON {TABLE} "
+            f"USING gin ((UPPER(title::text)) gin_trgm_ops)"
+        )
+
+
+def _ensure_sqlite(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s", [TABLE]
+        )
+        triggers = {row[0] for row in cursor.fetchall()}
+        if _has_fts(connection) and triggers >= FTS_TRIGGERS.keys():
+            return
+        try:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                f"title, content='{TABLE}', content_rowid='id', tokenize='trigram')"
+            )
+        except DatabaseError:
+            logger.warning("SQLite lacks FTS5 trigram support, title search scans the table")
+            return
+        for name, sql in FTS_TRIGGERS.items():
+            if name not in triggers:
+                cursor.execute(sql)
+        # titles changed while the triggers were missing
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    connection.title_fts = True
+
+
+def ensure_index(connection):
+    if connection.vendor == "postgresql":
+        _ensure_postgresql(connection)
+    elif connection.vendor == "sqlite":
+        _ensure_sqlite(connection)
+
+
+def drop_index(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute(f"DROP INDEX IF EXISTS {PG_INDEX}")
+        elif connection.vendor == "sqlite":
+            for name in FTS_TRIGGERS:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    connection.title_fts = False
+
+
+def _has_fts(connection):
+    if getattr(connection, "title_fts", None) is None:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+            connection.title_fts = cursor.fetchone() is not None
+    return connection.title_fts
+
+
+def title_filter(term, using="default"):
+    """
+    Q for media whose title contains `term`, case-insensitively.
+    """
+    connection = connections[using]
+    if (
+        connection.vendor == "sqlite"
+        and len(term) >= MIN_INDEXED_LENGTH
+        and not any(char in term for char in "%_\\")
+        and _has_fts(connection)
+    ):
+        return Q(pk__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE title LIKE %s", [f"%{term}%"]))
+    return Q(title__icontains=term)
@@ -0,0 +1,320 @@
+# myapp/transcode.py
+"""
+Web renditions of uploads, made with ffmpeg by the Celery worker.
+
+- video_file: H.264/AAC MP4 with the moov atom up front (faststart), so
+  playback starts before the download is complete. Uploads that already
+  are H.264/AAC are only remuxed.
+- video_low_file: a TRANSCODE_LOW_HEIGHT, low bitrate MP4 for the grid and
+  slow connections; skipped if the upload isn't any bigger than that.
+- hls_playlist (TRANSCODE_HLS): a master playlist over both renditions,
+  cut into fMP4 segments without re-encoding, for players that adapt the
+  bitrate. Segments are referenced relatively, so this needs media to be
+  served by the app (MEDIA_PROXY or local storage), not signed S3 URLs.
+
+Animated GIFs get a muted, looping MP4 (video_file) and an animated WebP
+(webp_file), usually a fraction of the GIF's size and far cheaper to
+decode; the GIF stays the download. Either is only kept if it is smaller.
+
+Renditions live under renditions/<media pk>/ in the media storage. Until
+they exist the templates use the original upload.
+
+Videos also get the metadata fields that header parsing at upload can't
+fill (WebM, MP4s with odd box layouts) from ffprobe.
+"""
+import json
+import logging
+import os
+import posixpath
+import re
+import shutil
+import subprocess
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from . import background, mediainfo
+from .models import Media
+from .versioning import bump_feed_version
+
+logger = logging.getLogger(__name__)
+
+RENDITIONS_DIR = "renditions"
+HLS_SEGMENT_SECONDS = 4
+
+_RENDITION_NAME_RE = re.compile(rf"^{RENDITIONS_DIR}/(\d+)/")
+
+
+class TranscodeError(Exception):
+    pass
+
+
+def enabled():
+    return settings.TRANSCODE_VIDEOS and shutil.which(settings.FFMPEG_BINARY) is not None
+
+
+def rendition_dir(media_pk):
+    return f"{RENDITIONS_DIR}/{media_pk}"
+
+
+def media_pk_from_name(name):
+    """
+    The media a rendition file belongs to, None for other names, including
+    ones that leave renditions/<pk>/ through "..".
+    """
+    if posixpath.normpath(name) != name or ".." in name.split("/"):
+        return None
+    match = _RENDITION_NAME_RE.match(name)
+    return int(match.group(1)) if match else None
+
+
+def _run(args):
+    try:
+        subprocess.run(
+            args,
+            check=True,
+            stdin=subprocess.DEVNULL,
+            capture_output=True,
+            timeout=settings.TRANSCODE_TIMEOUT,
+        )
+    except subprocess.CalledProcessError as e:
+        raise TranscodeError(e.stderr.decode(errors="replace").strip()[-2000:]) from e
+    except subprocess.TimeoutExpired as e:
+        raise TranscodeError(f"{args[0]} timed out after {settings.TRANSCODE_TIMEOUT}s") from e
+
+
+def _ffmpeg(*args):
+    _run([settings.FFMPEG_BINARY, "-hide_banner", "-nostdin", "-y", *args])
+
+
+def probe(path):
+    """
+    ffprobe's view of a file: {"format": {...}, "streams": [...]}.
+    """
+    args = [
+        settings.FFPROBE_BINARY, "-v", "error", "-print_format", "json",
+        "-show_format", "-show_streams", str(path),
+    ]
+    try:
+        result = subprocess.run(
+            args, check=True, stdin=subprocess.DEVNULL, capture_output=True, timeout=60
+        )
+    except subprocess.CalledProcessError as e:
+        raise TranscodeError(e.stderr.decode(errors="replace").strip()) from e
+    return json.loads(result.stdout)
+
+
+def _stream(info, codec_type):
+    return next((s for s in info.get("streams", []) if s.get("codec_type") == codec_type), None)
+
+
+def _bandwidth(path):
+    info = probe(path)
+    bit_rate = info["format"].get("bit_rate")
+    if bit_rate:
+        return int(bit_rate)
+    duration = float(info["format"].get("duration") or 1)
+    return int(os.path.getsize(path) * 8 / duration)
+
+
+def _web_codec_args(info):
+    video, audio = _stream(info, "video"), _stream(info, "audio")
+    if (
+        "mp4" in info["format"].get("format_name", "")
+        and video["codec_name"] == "h264"
+        and video.get("pix_fmt") == "yuv420p"
+        and (audio is None or audio["codec_name"] == "aac")
+    ):
+        # already playable everywhere, only the moov atom has to move
+        return ["-c", "copy"]
+    return [
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", "23", "-pix_fmt", "yuv420p",
+        # H.264 wants even dimensions
+        "-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2",
+        "-c:a", "aac", "-b:a", "128k",
+    ]
+
+
+def _low_codec_args():
+    height = settings.TRANSCODE_LOW_HEIGHT
+    bitrate = settings.TRANSCODE_LOW_BITRATE
+    return [
+        "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p",
+        "-vf", f"scale=-2:min({height}\\,trunc(ih/2)*2)",
+        "-b:v", bitrate, "-maxrate", bitrate, "-bufsize", bitrate,
+        "-c:a", "aac", "-b:a", "64k",
+    ]
+
+
+def _hls(source, directory):
+    _ffmpeg(
+        "-i", str(source), "-c", "copy",
+        "-f", "hls", "-hls_time", str(HLS_SEGMENT_SECONDS), "-hls_playlist_type", "vod",
+        "-hls_segment_type", "fmp4", "-hls_fmp4_init_filename", "init.mp4",
+        "-hls_segment_filename", os.path.join(directory, "%03d.m4s"),
+        os.path.join(directory, "index.m3u8"),
+    )
+
+
+def _master_playlist(variants):
+    lines = ["#EXTM3U", "#EXT-X-VERSION:7"]
+    for name, path in variants:
+        video = _stream(probe(path), "video")
+        lines.append(
+            f"#EXT-X-STREAM-INF:BANDWIDTH={_bandwidth(path)},"
+            f"RESOLUTION={video['width']}x{video['height']}"
+        )
+        lines.append(f"{name}/index.m3u8")
+    return "\n".join(lines) + "\n"
+
+
+def _save(storage, name, path):
+    # renditions keep their names, replace earlier runs' files
+    if storage.exists(name):
+        storage.delete(name)
+    with open(path, "rb") as f:
+        return storage.save(name, File(f))
+
+
+def _video_renditions(base, source, tmp, storage):
+    info = probe(source)
+    video = _stream(info, "video")
+    if video is None:
+        raise TranscodeError("no video stream")
+
+    maps = ["-map", "0:v:0", "-map", "0:a:0?"]
+    web = os.path.join(tmp, "web.mp4")
+    _ffmpeg("-i", source, *maps, *_web_codec_args(info), "-movflags", "+faststart", web)
+    variants = [("web", web)]
+    if int(video.get("height") or 0) > settings.TRANSCODE_LOW_HEIGHT:
+        low = os.path.join(tmp, "low.mp4")
+        _ffmpeg("-i", source, *maps, *_low_codec_args(), "-movflags", "+faststart", low)
+        # the cheaper variant first, players start with it
+        variants.insert(0, ("low", low))
+
+    names = {"video_file": _save(storage, f"{base}/web.mp4", web), "video_low_file": ""}
+    if len(variants) > 1:
+        names["video_low_file"] = _save(storage, f"{base}/low.mp4", variants[0][1])
+
+    names["hls_playlist"] = ""
+    if settings.TRANSCODE_HLS:
+        for name, path in variants:
+            directory = os.path.join(tmp, "hls", name)
+            os.makedirs(directory)
+            _hls(path, directory)
+            for segment in sorted(os.listdir(directory)):
+                _save(storage, f"{base}/hls/{name}/{segment}", os.path.join(directory, segment))
+        master = os.path.join(tmp, "hls", "master.m3u8")
+        with open(master, "w") as f:
+            f.write(_master_playlist(variants))
+        names["hls_playlist"] = _save(storage, f"{base}/hls/master.m3u8", master)
+    names.update(mediainfo.metadata_from_probe(info))
+    return names
+
+
+def _gif_renditions(base, source, tmp, storage):
+    with open(source, "rb") as f:
+        if not mediainfo.is_animated_gif(f):
+            return {}
+
+    loop = os.path.join(tmp, "loop.mp4")
+    _ffmpeg(
+        "-i", source, "-an",
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", "23", "-pix_fmt", "yuv420p",
+        "-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2",
+        "-movflags", "+faststart", loop,
+    )
+    webp = os.path.join(tmp, "anim.webp")
+    _ffmpeg(
+        "-i", source, "-an",
+        "-c:v", "libwebp_anim", "-lossless", "0", "-quality", "75", "-loop", "0",
+        webp,
+    )
+
+    names = {"video_file": "", "webp_file": ""}
+    size = os.path.getsize(source)
+    if os.path.getsize(loop) < size:
+        names["video_file"] = _save(storage, f"{base}/loop.mp4", loop)
+    if os.path.getsize(webp) < size:
+        names["webp_file"] = _save(storage, f"{base}/anim.webp", webp)
+    return names
+
+
+def needs_renditions(media):
+    return media.media_type == Media.MediaType.VIDEO or media.file.name.lower().endswith(".gif")
+
+
+def make_renditions(media, storage=default_storage):
+    """
+    Transcode the media's upload; returns {field name: value}, the storage
+    names of the renditions and the probed metadata.
+    """
+    with tempfile.TemporaryDirectory(prefix="transcode-") as tmp:
+        source = os.path.join(tmp, "source" + os.path.splitext(media.file.name)[1])
+        with media.file.open("rb") as src, open(source, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        if media.media_type == Media.MediaType.VIDEO:
+            return _video_renditions(rendition_dir(media.pk), source, tmp, storage)
+        return _gif_renditions(rendition_dir(media.pk), source, tmp, storage)
+
+
+def process(media):
+    """
+    Make the media's renditions and record them. Returns False on failure.
+    """
+    try:
+        names = make_renditions(media)
+        state = Media.Processing.READY
+    except TranscodeError as e:
+        logger.warning("Transcoding media #%s failed: %s", media.pk, e)
+        names, state = {}, Media.Processing.FAILED
+    if media.byte_size is None:
+        names["byte_size"] = media.file.size
+
+    # plain update: the upload may have been edited (or deleted) meanwhile
+    updated = Media.objects.filter(pk=media.pk).update(
+        processing=state, updated_at=timezone.now(), **names
+    )
+    if not updated:
+        delete_renditions(media.pk)
+        return False
+    # the feed's cards change with updated_at, its ETags with the version
+    bump_feed_version()
+    return state == Media.Processing.READY
+
+
+def schedule(media):
+    """
+    Queue the renditions of a freshly uploaded media.
+    """
+    if not needs_renditions(media) or not enabled():
+        return
+    from .tasks import transcode_media
+
+    Media.objects.filter(pk=media.pk).update(processing=Media.Processing.PENDING)
+    media.processing = Media.Processing.PENDING
+    transaction.on_commit(lambda: background.send(transcode_media, media.pk))
+
+
+def _walk(storage, directory):
+    try:
+        directories, files = storage.listdir(directory)
+    except FileNotFoundError:
+        return
+    for name in files:
+        yield f"{directory}/{name}"
+    for name in directories:
+        yield from _walk(storage, f"{directory}/{name}")
+
+
+def delete_renditions(media_pk, storage=default_storage):
+    from .mediacache import get_media_cache
+
+    for name in list(_walk(storage, rendition_dir(media_pk))):
+        storage.delete(name)
+        if settings.MEDIA_PROXY:
+            get_media_cache().evict(name)
@@ -2,6 +2,7 @@ from django.urls import path, include
 from . import views
 import uuid
 from django.utils import timezone
+from django.utils.functional import lazy
 from django.contrib.auth.models import User
 from django.contrib.auth import views as auth_views
 from django.contrib import admin
@@ -9,15 +10,18 @@ from django.urls import path
 from django.conf import settings
 from django.conf.urls.static import static
 from django.views.generic import RedirectView
-from django.contrib.staticfiles.storage import staticfiles_storage
+from django.templatetags.static import static as static_url
 
-from . import views
+from . import api, views
 
 app_name = "myapp"
 
 urlpatterns = [
     path("memes/", views.meme_list, name="meme_list"),
     path("memes/upload/", views.meme_upload, name="meme_upload"),
+    path("memes/upload/batch/", views.meme_upload_batch, name="meme_upload_batch"),
+    path("memes/upload/resumable/", views.resumable_uploads, name="resumable_uploads"),
+    path("memes/upload/resumable/<str:upload_id>/", views.resumable_upload, name="resumable_upload"),
     path("memes/random/", views.meme_random, name="meme_random"),
     path("memes/<int:pk>/", views.meme_detail, name="meme_detail"),
     path("memes/<int:pk>/delete/", views.meme_delete, name="meme_delete"),
@@ -27,10 +31,18 @@ urlpatterns = [
     path("memes/tags/suggest/", views.tag_suggestions, name="tag_suggestions"),
     path("memes/<int:pk>/comments/", views.meme_comments, name="meme_comments"),
     path("memes/<int:pk>/comments/add/", views.meme_add_comment, name="meme_add_comment",),
+    path("memes/<int:pk>/events/", views.meme_events, name="meme_events"),
+    path("memes/events/", views.feed_events, name="feed_events"),
+    path("media/<path:name>", views.media_file, name="media_file"),
+    path("api/v1/media/", api.media_list, name="api_media"),
+    path("api/v1/media/<int:pk>/comments/", api.comment_list, name="api_comments"),
+    path("api/v1/tags/", api.tag_list, name="api_tags"),
     path('', views.meme_list, name="meme_list"),
     path('logout/', auth_views.LogoutView.as_view(), name='logout'),
     path('post-logout/', views.post_logout, name='post_logout'),
-    path("favicon.ico", RedirectView.as_view(url=staticfiles_storage.url("assets/img/favicon.ico"),permanent=True,),
+    # lazy: the hashed name comes from the manifest, which may not exist at import time;
+    # not permanent, the hashed name changes with the file
+    path("favicon.ico", RedirectView.as_view(url=lazy(static_url, str)("assets/img/favicon.ico"),permanent=False,),
     ),
 ]
 
@@ -0,0 +1,183 @@
+# myapp/usercache.py
+"""
+Authentication and user names without the user table.
+
+Django's AuthenticationMiddleware loads the session and then the user's
+row on every request. CachedAuthenticationMiddleware keeps a snapshot of
+the user (the columns views and templates read, plus the session auth
+hash) in the cache next to the session. A request whose session hash
+matches the snapshot gets its user from there. Anything else (no
+snapshot, a password change, a rotated SECRET_KEY, an unknown backend, an
+inactive user) takes Django's own path, which then stores a new
+snapshot. Saving or deleting a user and logging out drop it
+(signals.py).
+
+Users built from a snapshot have their other columns deferred: reading
+one (password, date_joined) fetches the row, and save() only writes the
+loaded columns, so a snapshot never writes stale defaults back.
+
+UserNames resolves the display names (usernames) of a page of media in
+one batch: per request from a dict, across requests from the cache, and
+the misses with one query.
+"""
+from functools import partial
+
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.crypto import constant_time_compare
+from django.utils.functional import SimpleLazyObject
+
+# what request.user is read for; the rest is deferred
+SNAPSHOT_FIELDS = (
+    "id", "username", "first_name", "last_name", "email",
+    "is_active", "is_staff", "is_superuser",
+)
+
+
+def _snapshot_key(pk):
+    return f"user_snapshot:{pk}"
+
+
+def _name_key(pk):
+    return f"user_name:{pk}"
+
+
+def invalidate(pk):
+    cache.delete_many([_snapshot_key(pk), _name_key(pk)])
+
+
+def snapshot(user):
+    fields = [
+        field.attname for field in user._meta.concrete_fields
+        if field.attname in SNAPSHOT_FIELDS
+    ]
+    return {
+        "fields": fields,
+        "values": [getattr(user, name) for name in fields],
+        "hash": user.get_session_auth_hash(),
+    }
+
+
+def _user_pk(value):
+    try:
+        return get_user_model()._meta.pk.to_python(value)
+    except ValidationError:
+        return None
+
+
+def _from_snapshot(data, pk, backend_path, session_hash):
+    """
+    The session's user from its snapshot, None if it can't be trusted.
+    """
+    if (
+        data is None
+        or backend_path not in settings.AUTHENTICATION_BACKENDS
+        or not session_hash
+        or not constant_time_compare(session_hash, data["hash"])
+    ):
+        return None
+    user = get_user_model().from_db(DEFAULT_DB_ALIAS, data["fields"], data["values"])
+    if user.pk != pk or not user.is_active:
+        return None
+    return user
+
+
+def get_user(request):
+    if not hasattr(request, "_cached_user"):
+        request._cached_user = _get_user(request)
+    return request._cached_user
+
+
+def _get_user(request):
+    pk = _user_pk(request.session.get(SESSION_KEY))
+    if pk is not None:
+        user = _from_snapshot(
+            cache.get(_snapshot_key(pk)),
+            pk,
+            request.session.get(BACKEND_SESSION_KEY),
+            request.session.get(HASH_SESSION_KEY),
+        )
+        if user is not None:
+            return user
+    user = auth.get_user(request)
+    if user.is_authenticated:
+        cache.set(_snapshot_key(user.pk), snapshot(user), settings.USER_CACHE_TTL)
+    return user
+
+
+async def aget_user(request):
+    if not hasattr(request, "_acached_user"):
+        request._acached_user = await _aget_user(request)
+    return request._acached_user
+
+
+async def _aget_user(request):
+    pk = _user_pk(await request.session.aget(SESSION_KEY))
+    if pk is not None:
+        user = _from_snapshot(
+            await cache.aget(_snapshot_key(pk)),
+            pk,
+            await request.session.aget(BACKEND_SESSION_KEY),
+            await request.session.aget(HASH_SESSION_KEY),
+        )
+        if user is not None:
+            return user
+    user = await auth.aget_user(request)
+    if user.is_authenticated:
+        await cache.aset(_snapshot_key(user.pk), snapshot(user), settings.USER_CACHE_TTL)
+    return user
+
+
+class CachedAuthenticationMiddleware(AuthenticationMiddleware):
+    """
+    AuthenticationMiddleware reading request.user from the snapshot.
+    """
+    def process_request(self, request):
+        super().process_request(request)
+        request.user = SimpleLazyObject(lambda: get_user(request))
+        request.auser = partial(aget_user, request)
+
+
+class UserNames:
+    """
+    Display names by user id, resolved in batches.
+    """
+    def __init__(self):
+        self._names = {}
+
+    async def aresolve(self, pks):
+        """
+        Resolve the names of `pks`; returns {pk: name} of all resolved so far.
+        """
+        missing = {pk for pk in pks if pk is not None} - self._names.keys()
+        if missing:
+            keys = {_name_key(pk): pk for pk in missing}
+            cached = await cache.aget_many(list(keys))
+            self._names.update({keys[key]: name for key, name in cached.items()})
+            missing -= self._names.keys()
+        if missing:
+            User = get_user_model()
+            found = {
+                pk: name async for pk, name in
+                User.objects.filter(pk__in=missing).values_list("pk", User.USERNAME_FIELD)
+            }
+            if found:
+                await cache.aset_many(
+                    {_name_key(pk): name for pk, name in found.items()}, settings.USER_CACHE_TTL
+                )
+            self._names.update(found)
+        return self._names
+
+
+def user_names(request):
+    """
+    The request's UserNames, shared by everything rendering it.
+    """
+    if not hasattr(request, "_user_names"):
+        request._user_names = UserNames()
+    return request._user_names
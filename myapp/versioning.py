@@ -0,0 +1,29 @@
+# myapp/versioning.py
+"""
+Cheap version stamps for conditional requests (ETag / 304).
+
+Per-media state lives on the row (updated_at, comment_version); the feed
+as a whole has one counter in the cache, bumped whenever anything shown
+in the feed changes.
+"""
+import time
+
+from django.core.cache import cache
+
+FEED_VERSION_KEY = "feed_version"
+
+
+def bump_feed_version():
+    try:
+        cache.incr(FEED_VERSION_KEY)
+    except ValueError:
+        # evicted or never set: restart from a value no earlier ETag used
+        cache.set(FEED_VERSION_KEY, time.time_ns(), None)
+
+
+async def aget_feed_version():
+    version = await cache.aget(FEED_VERSION_KEY)
+    if version is None:
+        await cache.aadd(FEED_VERSION_KEY, time.time_ns(), None)
+        version = await cache.aget(FEED_VERSION_KEY)
+    return version
@@ -1,43 +1,147 @@
-import os, base64, io, json
-from django.http import HttpResponse
-from django.shortcuts import render, redirect, get_object_or_404
-from django.views.decorators.http import require_GET, require_POST
-from django.db.models import Q
-from django.db.models import Sum
-from django.utils import timezone
-from django.http import JsonResponse
+import asyncio
+import datetime
+import hashlib
+import json
+import math
+import mimetypes
+import os
+import posixpath
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.utils.translation import gettext_lazy as _
-from django.contrib import messages
-from django.views.decorators.csrf import csrf_exempt
-from django.contrib.auth.decorators import login_required
-from .forms import *
-from .models import *
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
 from django.contrib.auth.decorators import login_required
+from django.core.cache import cache
 from django.core.paginator import Paginator
+from django.db.models import Count, F
 from django.http import (
     JsonResponse,
     Http404,
+    HttpResponse,
     HttpResponseForbidden,
+    HttpResponseRedirect,
+    StreamingHttpResponse,
 )
-from django.shortcuts import get_object_or_404, redirect, render
-from django.views.decorators.http import require_POST, require_GET
-from django.template.loader import render_to_string
-from .forms import *
-from .models import *
-import re
-from django.db.models import Count
-from django.core.paginator import Paginator
+from django.shortcuts import aget_object_or_404, get_object_or_404, redirect, render
 from django.template.loader import render_to_string
-from django.views.decorators.http import require_GET
+from django.urls import reverse
+from django.views.decorators.http import require_http_methods, require_POST, require_GET, require_safe
+
+from . import archive, batchupload, events, ratelimit, resumable, transcode
+from .dbrouting import replica_reads
+from .decorators import aetag
+from .forms import CommentForm, MediaTagForm, MediaTitleForm, MediaUploadForm, get_tags
+from .mediacache import get_media_cache
+from .mediaserve import offload_response, serve_file
+from .models import Album, Comment, Media, Tag
+from .ratelimit import concurrency_limit, rate_limit
+from .usercache import user_names
+from .versioning import aget_feed_version
+from .writequeue import arun_write, run_write
+
+COMMENTS_PER_PAGE = 50
+MEDIA_PER_PAGE = 24
+# ?sort= of the feed; the metadata columns are indexed, media without
+# metadata (not read yet) go last
+FEED_SORTS = {
+    "largest": (F("byte_size").desc(nulls_last=True), "-pk"),
+    "smallest": (F("byte_size").asc(nulls_last=True), "-pk"),
+    "longest": (F("duration").desc(nulls_last=True), "-pk"),
+    "shortest": (F("duration").asc(nulls_last=True), "-pk"),
+}
+TAG_SUGGESTIONS_TTL = 60
+
+
+async def _aload_user(request):
+    """
+    Templates and context processors read request.user synchronously,
+    which must not hit the DB from the event loop; resolve it up front.
+    """
+    request.user = await request.auser()
+
+
+async def _aget_page(qs, number, per_page):
+    """
+    Async counterpart of Paginator.get_page(); the page is fully fetched.
+    """
+    paginator = Paginator(qs, per_page)
+    paginator.count = await qs.acount()
+    page = paginator.get_page(number)
+    page.object_list = [obj async for obj in page.object_list]
+    return page
+
+
+async def _aget_comments_page(media, number):
+    """
+    A page of the media's comments, newest first, continuing into the
+    archived comments of cold threads.
+    """
+    live = media.comments.select_related("author").order_by("-created_at")
+    paginator = Paginator(await archive.athread(media, live), COMMENTS_PER_PAGE)
+    page = paginator.get_page(number)
+    page.object_list = await page.object_list.aresolve()
+    return page
+
+
+async def _aresolve_file_urls(media_items):
+    """
+    Compute storage URLs for a page of media concurrently, off the event loop.
+    """
+    async def resolve(media):
+        await sync_to_async(media.resolve_urls, thread_sensitive=False)()
+
+    await asyncio.gather(*(resolve(media) for media in media_items))
+
+
+async def _aresolve_uploaders(request, media_items):
+    """
+    Uploader names for a page of media, in one batch.
+    """
+    names = await user_names(request).aresolve(media.uploader_id for media in media_items)
+    for media in media_items:
+        media.uploader_name = names.get(media.uploader_id, "")
+
+
+def _float_param(request, name):
+    try:
+        value = float(request.GET[name])
+    except (KeyError, ValueError):
+        return None
+    return value if math.isfinite(value) and value >= 0 else None
+
+
+async def _feed_version(request):
+    return await aget_feed_version()
+
+
+async def _media_version(request, pk):
+    return await (
+        Media.objects.filter(pk=pk)
+        .values_list("updated_at", "comment_version")
+        .afirst()
+    )
+
+
+async def _comments_version(request, pk):
+    return await (
+        Media.objects.filter(pk=pk)
+        .values_list("comment_version", flat=True)
+        .afirst()
+    )
+
 
 @login_required
-def meme_list(request):
+@replica_reads
+@aetag(_feed_version)
+async def meme_list(request):
+    await _aload_user(request)
+
+    # as the API: public media in private albums only for their owner
     qs = (
-        Media.objects.filter(is_public=True)
-        .select_related("uploader", "album")
+        Media.objects.visible_to(request.user)
+        .select_related("album")
         .prefetch_related("tags")
-        .annotate(comment_count=Count("comments"))
     )
 
     tag_slug = request.GET.get("tag") or ""
@@ -45,12 +149,22 @@ def meme_list(request):
     if tag_slug:
         qs = qs.filter(tags__slug=tag_slug)
         qs = qs.distinct()
-        from .models import Tag  # or keep the import at top
-        current_tag = Tag.objects.filter(slug=tag_slug).first()
+        current_tag = await Tag.objects.filter(slug=tag_slug).afirst()
+
+    sort = request.GET.get("sort") or ""
+    if sort in FEED_SORTS:
+        qs = qs.order_by(*FEED_SORTS[sort])
+    max_duration = _float_param(request, "max_duration")
+    if max_duration is not None:
+        qs = qs.filter(duration__lte=max_duration)
+    max_size_mb = _float_param(request, "max_size_mb")
+    if max_size_mb is not None:
+        qs = qs.filter(byte_size__lte=max_size_mb * 1024 * 1024)
 
-    paginator = Paginator(qs, 24)
     page_number = request.GET.get("page") or 1
-    page_obj = paginator.get_page(page_number)
+    page_obj = await _aget_page(qs, page_number, MEDIA_PER_PAGE)
+    await _aresolve_file_urls(page_obj.object_list)
+    await _aresolve_uploaders(request, page_obj.object_list)
 
     # Infinite scroll / AJAX
     if request.headers.get("x-requested-with") == "XMLHttpRequest":
@@ -73,10 +187,13 @@ def meme_list(request):
     context = {
         "page_obj": page_obj,
         "current_tag": current_tag,
+        "sort": sort if sort in FEED_SORTS else "",
     }
     return render(request, "myapp/meme_list.html", context)
 
 @login_required
+@rate_limit("upload")
+@concurrency_limit("upload")
 def meme_upload(request):
     if request.method == "POST":
         form = MediaUploadForm(request.POST, request.FILES)
@@ -86,6 +203,7 @@ def meme_upload(request):
             media = form.save(user=request.user, commit=True)
             media.is_public = True  # for now, album privacy is separate
             media.save(update_fields=["is_public"])
+            transcode.schedule(media)
             return redirect("myapp:meme_detail", pk=media.pk)
     else:
         form = MediaUploadForm()
@@ -96,6 +214,191 @@ def meme_upload(request):
     }
     return render(request, "myapp/meme_upload.html", context)
 
+@login_required
+@require_POST
+@rate_limit("upload")
+@concurrency_limit("upload")
+async def meme_upload_batch(request):
+    """
+    Upload many files (`files`) and/or a ZIP (`archive`) with shared tags
+    and album; streams one NDJSON line per file as it is done, then a
+    summary.
+    """
+    await _aload_user(request)
+    user = request.user
+    # multipart parsing touches the spooled body, keep it off the event loop
+    files = await sync_to_async(lambda: request.FILES)()
+    post = request.POST
+
+    tag_form = MediaTagForm(post)
+    if not tag_form.is_valid():
+        return JsonResponse({"error": "Invalid tags"}, status=400)
+    album = None
+    if post.get("album"):
+        if post["album"].isdigit():
+            album = await Album.objects.filter(owner=user, pk=post["album"]).afirst()
+        if album is None:
+            return JsonResponse({"error": "Unknown album"}, status=400)
+
+    try:
+        items = batchupload.items_from_files(files.getlist("files"))
+        for upload in files.getlist("archive"):
+            items += await sync_to_async(batchupload.items_from_zip)(upload)
+        batchupload.check_limits(items)
+    except batchupload.BatchUploadError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    # one upload token per file; @rate_limit took the first
+    capacity = ratelimit.capacity("upload", user)
+    if capacity is not None and len(items) > capacity:
+        return JsonResponse({"error": f"At most {capacity} files per batch"}, status=400)
+    if len(items) > 1:
+        limited = await ratelimit.acheck_request(request, "upload", cost=len(items) - 1)
+        if limited is not None:
+            return limited
+    tags = await arun_write(get_tags, tag_form.parse_tags())
+
+    async def stream():
+        counts = {"created": 0, "duplicate": 0, "error": 0}
+        async for event in batchupload.process(user, items, tags, album):
+            counts[event["status"]] += 1
+            yield json.dumps(event) + "\n"
+        yield json.dumps({"summary": counts}) + "\n"
+
+    response = StreamingHttpResponse(stream(), content_type="application/x-ndjson")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+def _tus_response(status=204, upload=None, body=None, **headers):
+    response = HttpResponse(status=status) if body is None else JsonResponse(body, status=status)
+    response["Tus-Resumable"] = resumable.TUS_VERSION
+    response["Cache-Control"] = "no-store"
+    if upload is not None:
+        response["Upload-Offset"] = str(upload.offset())
+        response["Upload-Length"] = str(upload.length)
+        response["Upload-Expires"] = upload.expires()
+        if upload.media_id:
+            response["Upload-Media-Url"] = reverse("myapp:meme_detail", args=[upload.media_id])
+    for name, value in headers.items():
+        response[name.replace("_", "-")] = value
+    return response
+
+
+def _tus_error(e):
+    return _tus_response(e.status, body={"error": str(e)})
+
+
+async def _afinish_upload(upload, user):
+    """
+    Turn a complete upload into its media, like meme_upload does.
+    """
+    name, media_type, metadata = await sync_to_async(upload.assemble, thread_sensitive=False)(user)
+    try:
+        tag_form = MediaTagForm({"tags_input": upload.info.get("tags", "")})
+        tags = await arun_write(
+            get_tags, tag_form.parse_tags() if tag_form.is_valid() else []
+        )
+        album = None
+        if upload.info.get("album", "").isdigit():
+            album = await Album.objects.filter(owner=user, pk=upload.info["album"]).afirst()
+        title = upload.info.get("title", "")[:Media._meta.get_field("title").max_length]
+        media = await arun_write(
+            batchupload.create_media, user, name, title, media_type, metadata, tags, album
+        )
+    except Exception:
+        await sync_to_async(default_storage.delete, thread_sensitive=False)(name)
+        await sync_to_async(upload.delete, thread_sensitive=False)()
+        raise
+    await sync_to_async(upload.completed, thread_sensitive=False)(media)
+
+
+def _tus_preflight(request):
+    if not settings.RESUMABLE_UPLOADS:
+        raise Http404("Resumable uploads are disabled")
+    if request.method == "OPTIONS":
+        return _tus_response(
+            Tus_Version=resumable.TUS_VERSION,
+            Tus_Extension=resumable.TUS_EXTENSIONS,
+            Tus_Max_Size=str(settings.RESUMABLE_UPLOAD_MAX_MB * 1024 * 1024),
+        )
+    if request.headers.get("Tus-Resumable") != resumable.TUS_VERSION:
+        return _tus_response(412, Tus_Version=resumable.TUS_VERSION)
+    return None
+
+
+@login_required
+@require_http_methods(["OPTIONS", "POST"])
+@rate_limit("upload")
+async def resumable_uploads(request):
+    """
+    tus creation: POST with Upload-Length and Upload-Metadata (filename,
+    filetype, title, tags, album) answers with the upload's Location.
+    """
+    if response := _tus_preflight(request):
+        return response
+    await _aload_user(request)
+    try:
+        length = int(request.headers.get("Upload-Length", ""))
+        if length <= 0:
+            raise ValueError
+    except ValueError:
+        return _tus_response(400, body={"error": "Upload-Length is required"})
+    try:
+        metadata = resumable.parse_metadata(request.headers.get("Upload-Metadata"))
+        upload = await sync_to_async(resumable.ResumableUpload.create, thread_sensitive=False)(
+            request.user, length, metadata
+        )
+    except resumable.UploadError as e:
+        return _tus_error(e)
+    return _tus_response(
+        201, upload, Location=reverse("myapp:resumable_upload", args=[upload.id])
+    )
+
+
+@login_required
+@require_http_methods(["OPTIONS", "HEAD", "PATCH", "DELETE"])
+@concurrency_limit("upload", methods=["PATCH"])
+async def resumable_upload(request, upload_id):
+    """
+    tus: HEAD for the offset to resume from, PATCH to append a chunk at it,
+    DELETE to give up. The PATCH completing the upload creates the media
+    (Upload-Media-Url) or fails with the validation error (422).
+    """
+    if response := _tus_preflight(request):
+        return response
+    await _aload_user(request)
+    upload = await sync_to_async(resumable.ResumableUpload.get, thread_sensitive=False)(
+        upload_id, request.user
+    )
+    if upload is None:
+        return _tus_response(404)
+
+    if request.method == "HEAD":
+        return _tus_response(200, upload)
+    if request.method == "DELETE":
+        await sync_to_async(upload.delete, thread_sensitive=False)()
+        return _tus_response(204)
+
+    if request.content_type != "application/offset+octet-stream":
+        return _tus_response(415)
+    try:
+        offset = int(request.headers.get("Upload-Offset", ""))
+    except ValueError:
+        return _tus_response(400, body={"error": "Upload-Offset is required"})
+    content_length = request.headers.get("Content-Length", "")
+    content_length = int(content_length) if content_length.isdigit() else None
+    try:
+        new_offset = await sync_to_async(upload.append, thread_sensitive=False)(
+            request, offset, content_length
+        )
+        if new_offset == upload.length and offset < upload.length:
+            await _afinish_upload(upload, request.user)
+    except resumable.UploadError as e:
+        return _tus_error(e)
+    except ValidationError as e:
+        return _tus_response(422, body={"error": " ".join(e.messages)})
+    return _tus_response(204, upload)
+
 @login_required
 @require_POST
 def meme_update_title(request, pk):
@@ -106,24 +409,22 @@ def meme_update_title(request, pk):
 
     form = MediaTitleForm(request.POST, instance=media)
     if form.is_valid():
-        form.save()
+        run_write(form.save)
 
     return redirect("myapp:meme_detail", pk=media.pk)
 
 @login_required
-def meme_detail(request, pk):
-    media = get_object_or_404(
-        Media.objects.select_related("uploader", "album")
-        .prefetch_related("tags", "comments__author"),
+@aetag(_media_version)
+async def meme_detail(request, pk):
+    await _aload_user(request)
+
+    media = await aget_object_or_404(
+        Media.objects.visible_to(request.user)
+        .select_related("uploader", "album")
+        .prefetch_related("tags"),
         pk=pk,
     )
 
-    if not media.is_public:
-        if not request.user.is_superuser and (
-            not media.album or media.album.owner != request.user
-        ):
-            raise Http404("Media not found")
-
     # only used if some non-AJAX POST still hits meme_detail
     if request.method == "POST":
         comment_form = CommentForm(request.POST)
@@ -131,7 +432,7 @@ def meme_detail(request, pk):
             comment = comment_form.save(commit=False)
             comment.media = media
             comment.author = request.user
-            comment.save()
+            await arun_write(comment.save)
             return redirect("myapp:meme_detail", pk=media.pk)
     else:
         comment_form = CommentForm()
@@ -141,10 +442,11 @@ def meme_detail(request, pk):
     tag_form = MediaTagForm(initial={"tags_input": tag_initial})
 
     # comment pagination (newest first)
-    comments_qs = media.comments.select_related("author").order_by("-created_at")
     cpage = request.GET.get("cpage") or 1
-    comments_paginator = Paginator(comments_qs, 50)
-    comments_page = comments_paginator.get_page(cpage)
+    comments_page, _ = await asyncio.gather(
+        _aget_comments_page(media, cpage),
+        _aresolve_file_urls([media]),
+    )
 
     context = {
         "media": media,
@@ -155,9 +457,9 @@ def meme_detail(request, pk):
     }
     return render(request, "myapp/meme_detail.html", context)
 
-
 @login_required
 @require_POST
+@rate_limit("tags")
 def meme_update_tags(request, pk):
     media = get_object_or_404(Media, pk=pk)
 
@@ -166,18 +468,15 @@ def meme_update_tags(request, pk):
 
     form = MediaTagForm(request.POST)
     if form.is_valid():
-        names = form.parse_tags()
-        tags = []
-        for name in names:
-            tag, _ = Tag.objects.get_or_create(
-                name__iexact=name,
-                defaults={"name": name},
-            )
-            tags.append(tag)
-        media.tags.set(tags)
+        run_write(_set_tags, media, form.parse_tags())
 
     return redirect("myapp:meme_detail", pk=media.pk)
 
+def _set_tags(media, names):
+    media.tags.set(get_tags(names))
+    # tags are part of the cached feed card, bump its version
+    media.save(update_fields=["updated_at"])
+
 @login_required
 @require_POST
 def meme_delete(request, pk):
@@ -199,13 +498,24 @@ def comment_delete(request, pk):
         return HttpResponseForbidden("You are not allowed to delete this comment.")
 
     media_pk = comment.media_id
-    comment.delete()
+    run_write(comment.delete)
     return redirect("myapp:meme_detail", pk=media_pk)
 
 @login_required
 @require_GET
-def tag_suggestions(request):
+@replica_reads
+async def tag_suggestions(request):
     q = (request.GET.get("q") or "").strip()
+    # no tag contains a longer term; don't let it into the cache either
+    if len(q) > Tag._meta.get_field("name").max_length:
+        return JsonResponse({"results": []})
+
+    # hashed: raw input makes keys of any characters Django warns about
+    # (CacheKeyWarning), and "Cat" and "cat" share the entry
+    cache_key = f"tag_suggestions:{hashlib.sha256(q.lower().encode()).hexdigest()}"
+    results = await cache.aget(cache_key)
+    if results is not None:
+        return JsonResponse({"results": results})
 
     if q:
         # Filter by search string, order by popularity then name
@@ -223,8 +533,9 @@ def tag_suggestions(request):
 
     results = [
         {"id": t.id, "name": t.name, "slug": t.slug, "count": t.num_media or 0}
-        for t in tags
+        async for t in tags
     ]
+    await cache.aset(cache_key, results, TAG_SUGGESTIONS_TTL)
     return JsonResponse({"results": results})
 
 @require_GET
@@ -235,7 +546,8 @@ def post_logout(request):
         return render(request, 'registration/post-logout.html')
 
 @login_required
-def meme_random(request):
+@replica_reads
+async def meme_random(request):
     """
     Random meme feed.
 
@@ -243,29 +555,29 @@ def meme_random(request):
     - Orders matching media randomly with order_by("?")
     - Uses same template and infinite scroll JSON shape as meme_list
     """
+    await _aload_user(request)
+
     page_number = request.GET.get("page") or 1
-    per_page = 24  # keep in sync with meme_list
 
     tag_slug = request.GET.get("tag")
     current_tag = None
 
     qs = (
-        Media.objects
-        .select_related("uploader")
+        Media.objects.visible_to(request.user)
         .prefetch_related("tags")
-        .annotate(comment_count=Count("comments"))
     )
 
     # Apply same tag filter logic as meme_list
     if tag_slug:
-        current_tag = get_object_or_404(Tag, slug=tag_slug)
+        current_tag = await aget_object_or_404(Tag, slug=tag_slug)
         qs = qs.filter(tags=current_tag)
 
     # Random order after filtering
     qs = qs.order_by("?")
 
-    paginator = Paginator(qs, per_page)
-    page_obj = paginator.get_page(page_number)
+    page_obj = await _aget_page(qs, page_number, MEDIA_PER_PAGE)
+    await _aresolve_file_urls(page_obj.object_list)
+    await _aresolve_uploaders(request, page_obj.object_list)
 
     random_mode = True
 
@@ -297,19 +609,44 @@ def meme_random(request):
 
 @login_required
 @require_GET
-def meme_comments(request, pk):
-    media = get_object_or_404(Media, pk=pk)
+@replica_reads
+@aetag(_comments_version)
+async def meme_comments(request, pk):
+    await _aload_user(request)
+
+    media = await aget_object_or_404(Media.objects.visible_to(request.user), pk=pk)
+
+    # ?after=<comment id> → only comments newer than the client's cursor
+    after = request.GET.get("after")
+    if after is not None:
+        try:
+            after = int(after)
+        except ValueError:
+            return JsonResponse({"ok": False, "errors": {"after": ["Invalid cursor."]}}, status=400)
+
+        comments = [
+            comment async for comment in
+            media.comments
+            .select_related("author")
+            .filter(pk__gt=after)
+            .order_by("pk")[:COMMENTS_PER_PAGE]
+        ]
+        # oldest first, so a burst longer than a page is fetched from the
+        # cursor on rather than skipped; the client prepends newest first
+        html = render_to_string(
+            "myapp/partials/comment_items.html",
+            {"comments": comments[::-1]},
+            request=request,
+        )
+        return JsonResponse({
+            "html": html,
+            "count": media.comment_count,
+            "cursor": comments[-1].pk if comments else after,
+            "has_more": len(comments) == COMMENTS_PER_PAGE,
+        })
 
     cpage = request.GET.get("cpage") or 1
-
-    comments_qs = (
-        media.comments
-        .select_related("author")
-        .order_by("-created_at")    # <── match detail view
-    )
-
-    paginator = Paginator(comments_qs, 50)
-    comments_page = paginator.get_page(cpage)
+    comments_page = await _aget_comments_page(media, cpage)
 
     html = render_to_string(
         "myapp/partials/comments_block.html",
@@ -327,8 +664,9 @@ def meme_comments(request, pk):
 
 @login_required
 @require_POST
+@rate_limit("comment")
 def meme_add_comment(request, pk):
-    media = get_object_or_404(Media, pk=pk)
+    media = get_object_or_404(Media.objects.visible_to(request.user), pk=pk)
 
     form = CommentForm(request.POST)
     if not form.is_valid():
@@ -347,25 +685,136 @@ def meme_add_comment(request, pk):
     comment = form.save(commit=False)
     comment.media = media
     comment.author = request.user
-    comment.save()
-
-    # Rebuild the first comments page (newest first)
-    comments_qs = media.comments.select_related("author").order_by("-created_at")
-    paginator = Paginator(comments_qs, 50)
-    comments_page = paginator.get_page(1)
+    run_write(comment.save)
 
+    # Only render the new comment; the client prepends it to the list
     html = render_to_string(
-        "myapp/partials/comments_block.html",
-        {"comments_page": comments_page},
+        "myapp/partials/comment_items.html",
+        {"comments": [comment]},
         request=request,
     )
+    media.refresh_from_db(fields=["comment_count"])
 
     return JsonResponse(
         {
             "ok": True,
             "html": html,
-            "count": paginator.count,
-            "page": comments_page.number,
-            "num_pages": paginator.num_pages,
+            "id": comment.pk,
+            "count": media.comment_count,
         }
     )
+
+
+def _event_stream(channels):
+    """
+    Server-Sent Events response for the given broker channels.
+    Only sensible under ASGI: each client is an idle coroutine, not a thread.
+    """
+    async def stream():
+        yield "retry: 5000\n\n"
+        async for message in events.subscribe(channels):
+            if message is None:
+                yield ": ping\n\n"
+                continue
+            yield f"event: {message['event']}\ndata: {json.dumps(message['data'])}\n\n"
+
+    response = StreamingHttpResponse(stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+@login_required
+@require_GET
+async def meme_events(request, pk):
+    if not settings.REALTIME_UPDATES:
+        raise Http404("Live updates are disabled")
+
+    await _aload_user(request)
+
+    # as meme_detail: the stream tells which comments appear on private media
+    media = await aget_object_or_404(Media.objects.visible_to(request.user).only("pk"), pk=pk)
+    return _event_stream([events.comments_channel(media.pk)])
+
+@login_required
+@require_GET
+async def feed_events(request):
+    if not settings.REALTIME_UPDATES:
+        raise Http404("Live updates are disabled")
+
+    return _event_stream([events.FEED_CHANNEL])
+
+def _local_path(storage, name):
+    try:
+        return storage.path(name)
+    except NotImplementedError:
+        return None
+
+
+def _open_media_file(storage, name, path):
+    """
+    Open a media file for serving: straight from disk for local storage,
+    otherwise through the read-through cache of the bucket.
+    """
+    if path is not None:
+        file = open(path, "rb")
+        stat = os.fstat(file.fileno())
+        last_modified = datetime.datetime.fromtimestamp(stat.st_mtime, tz=datetime.timezone.utc)
+        etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+        content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        return file, stat.st_size, etag, last_modified, content_type
+
+    cache = get_media_cache()
+    entry = cache.get(storage, name)
+    try:
+        file = entry.open()
+    except FileNotFoundError:
+        # evicted between the lookup and the open
+        entry = cache.get(storage, name)
+        file = entry.open()
+    return file, entry.size, entry.etag, entry.last_modified, entry.content_type
+
+@login_required
+@require_safe
+async def media_file(request, name):
+    """
+    Protected media: one indexed visibility query, then the bytes are
+    handed to the front server (local storage, MEDIA_SENDFILE) or to S3
+    (signed redirect, MEDIA_S3_DELIVERY) where possible, so the worker
+    is done in microseconds whatever the file size.
+    """
+    # "renditions/<public pk>/../../memes/..." would be checked against the
+    # public media and then opened as the private upload it points to
+    if posixpath.normpath(name) != name or ".." in name.split("/"):
+        raise Http404("Media not found")
+    user = await request.auser()
+    rendition_of = transcode.media_pk_from_name(name)
+    if rendition_of is not None:
+        media = Media.objects.filter(pk=rendition_of)
+    else:
+        # myapp_media_file_idx
+        media = Media.objects.filter(file=name)
+    # the album is joined by primary key
+    if not await media.visible_to(user).aexists():
+        raise Http404("Media not found")
+
+    storage = Media._meta.get_field("file").storage
+    # the name changes whenever the file does
+    cache_control = f"private, max-age={settings.MEDIA_CACHE_MAX_AGE}"
+    path = _local_path(storage, name)
+
+    if path is not None and settings.MEDIA_SENDFILE:
+        return offload_response(name, path, cache_control)
+
+    if path is None and settings.MEDIA_S3_DELIVERY == "redirect":
+        url = await sync_to_async(storage.url, thread_sensitive=False)(
+            name, expire=settings.MEDIA_REDIRECT_EXPIRE
+        )
+        response = HttpResponseRedirect(url)
+        # the browser may reuse the redirect while the signature is valid
+        response["Cache-Control"] = f"private, max-age={settings.MEDIA_REDIRECT_EXPIRE // 2}"
+        return response
+
+    file, size, etag, last_modified, content_type = await sync_to_async(
+        _open_media_file, thread_sensitive=False
+    )(storage, name, path)
+    return serve_file(request, file, size, etag, last_modified, content_type, cache_control)
@@ -0,0 +1,119 @@
+# myapp/writequeue.py
+"""
+In-process write serializer for SQLite.
+
+SQLite allows a single writer at a time. Instead of having every request
+thread race for the lock, short writes are handed to one writer thread
+which commits whatever has queued up in a single transaction. Each write
+runs in its own savepoint, so one failing write doesn't undo the others.
+
+With PostgreSQL (or SQLITE_WRITE_QUEUE=False) writes just run inline.
+
+Async views use arun_write(): it awaits the write's future instead of
+blocking a thread on it. sync_to_async(run_write) would block the one
+thread all thread-sensitive calls share, so no two writes would ever be
+queued at once and nothing would be batched.
+"""
+import asyncio
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH = 64
+BATCH_WINDOW_SECONDS = 0.002
+
+
+class WriteQueue:
+    def __init__(self, max_batch=MAX_BATCH, window=BATCH_WINDOW_SECONDS):
+        self._queue = queue.Queue()
+        self._max_batch = max_batch
+        self._window = window
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Run fn(*args, **kwargs) on the writer thread and return its result
+        (or raise its exception) once the batch it ran in is committed.
+        """
+        return self._put(fn, args, kwargs).result()
+
+    async def asubmit(self, fn, *args, **kwargs):
+        return await asyncio.wrap_future(self._put(fn, args, kwargs))
+
+    def _put(self, fn, args, kwargs):
+        self._ensure_started()
+        future = Future()
+        self._queue.put((future, fn, args, kwargs))
+        return future
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+                self._thread.start()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        try:
+            while len(batch) < self._max_batch:
+                batch.append(self._queue.get(timeout=self._window))
+        except queue.Empty:
+            pass
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            close_old_connections()
+            results = []
+            try:
+                with transaction.atomic():
+                    for future, fn, args, kwargs in batch:
+                        try:
+                            with transaction.atomic():
+                                results.append((future, fn(*args, **kwargs), None))
+                        except Exception as e:
+                            results.append((future, None, e))
+            except Exception as e:
+                # the commit itself failed, nothing in this batch was written
+                logger.exception("SQLite write batch failed")
+                results = [(future, None, e) for future, *_ in batch]
+
+            for future, result, error in results:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+
+_write_queue = WriteQueue()
+
+
+def enabled():
+    return getattr(settings, "SQLITE_WRITE_QUEUE", False) and not connection.is_in_memory_db()
+
+
+def run_write(fn, *args, **kwargs):
+    """
+    Run a short DB write, serialized through the writer thread on SQLite.
+    """
+    if enabled():
+        return _write_queue.submit(fn, *args, **kwargs)
+    return fn(*args, **kwargs)
+
+
+async def arun_write(fn, *args, **kwargs):
+    """
+    run_write() for async code.
+    """
+    if enabled():
+        return await _write_queue.asubmit(fn, *args, **kwargs)
+    return await sync_to_async(fn)(*args, **kwargs)
@@ -1,7 +1,14 @@
 # myproject/__init__.py
 from __future__ import absolute_import, unicode_literals
 
-# This will make sure the app is always imported when Django starts so that shared_task will use this app.
-from .celery import app as celery_app
-
+# The Celery app is imported on first use instead of on every Django start;
+# `celery -A myproject` and myapp.background (before sending a task) import it
+# explicitly, so shared_task still binds to this app.
 __all__ = ('celery_app',)
+
+
+def __getattr__(name):
+    if name == 'celery_app':
+        from .celery import app
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -8,9 +8,16 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 """
 
 import os
-
+from dotenv import load_dotenv
 from django.core.asgi import get_asgi_application
 
+project_folder = os.path.expanduser('/opt/app')  # adjust as appropriate
+load_dotenv(os.path.join(project_folder, '.env'))
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.settings')
 
+# /static is served by myapp.staticassets.StaticFilesMiddleware (WhiteNoise)
 application = get_asgi_application()
+
+if os.environ.get('WARMUP', 'True').lower() in ['true']:
+    from .warmup import warm_up
+    warm_up()
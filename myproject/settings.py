@@ -13,11 +13,9 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 from pathlib import Path
 from dotenv import load_dotenv
 import os
-import pytz
 import secrets
 from django.utils.html import escape
 from django.utils.translation import gettext_lazy as _
-from csp.constants import NONE, SELF, UNSAFE_INLINE, UNSAFE_EVAL
 
 # Load environment variables from .env file
 load_dotenv()
@@ -58,6 +56,7 @@ if DOMAIN:
 REDIS_HOST = os.environ.get("REDIS_HOST", "")
 REDIS_PORT = os.environ.get("REDIS_PORT", "6379")
 REDIS_DB = os.environ.get("REDIS_DB", "0")
+REDIS_PASSWORD = os.environ.get("REDIS_PASSWORD", "")
 
 if REDIS_HOST:
     CACHES = {
@@ -65,13 +64,50 @@ if REDIS_HOST:
             "BACKEND": "django_redis.cache.RedisCache",
             "LOCATION": "redis://%s:%s/%s" % (REDIS_HOST, REDIS_PORT, REDIS_DB),
             "OPTIONS": {
-                "PASSWORD": os.environ.get("REDIS_PASSWORD", ""),
+                "PASSWORD": REDIS_PASSWORD,
             }
         }
     }
 
     SESSION_ENGINE = "django.contrib.sessions.backends.cache"
     SESSION_CACHE_ALIAS = "default"
+else:
+    # shared by all worker processes on the node, unlike the per-process default
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": os.environ.get("CACHE_DIR", "/tmp/memelord-cache"),
+        }
+    }
+
+# lifetime of cached template fragments (feed cards); keep it below the
+# expiry of signed storage URLs
+FRAGMENT_CACHE_TTL = int(os.environ.get("FRAGMENT_CACHE_TTL", "300"))
+
+# Live comment/feed updates via Server-Sent Events; needs an ASGI server
+# fan-out goes through Redis pub/sub if REDIS_HOST is set, in-process otherwise:
+# then an event only reaches browsers connected to the process that sent it,
+# so gunicorn.conf.py runs a single worker unless WEB_CONCURRENCY says otherwise
+REALTIME_UPDATES = os.environ.get('REALTIME_UPDATES', 'False').lower() in ['true']
+
+# Admission control (myapp/ratelimit.py), shared through Redis if REDIS_HOST
+# is set, per worker otherwise.
+# Token buckets per user and endpoint, "<requests>/<period>" (s, m, h, d,
+# e.g. 10/m or 5/30s); empty disables
+RATE_LIMITS = {
+    "upload": os.environ.get("RATE_LIMIT_UPLOAD", "60/h"),
+    "comment": os.environ.get("RATE_LIMIT_COMMENT", "10/m"),
+    "tags": os.environ.get("RATE_LIMIT_TAGS", "30/m"),
+}
+RATE_LIMIT_EXEMPT_STAFF = os.environ.get('RATE_LIMIT_EXEMPT_STAFF', 'True').lower() in ['true']
+# requests running at once over all users, the rest get a 503; 0 disables
+CONCURRENCY_LIMITS = {
+    "upload": int(os.environ.get("CONCURRENCY_LIMIT_UPLOAD", "4")),
+    "export": int(os.environ.get("CONCURRENCY_LIMIT_EXPORT", "1")),
+}
+# a slot whose request died is freed after this long
+CONCURRENCY_LEASE_SECONDS = int(os.environ.get("CONCURRENCY_LEASE_SECONDS", "900"))
+CONCURRENCY_RETRY_AFTER = int(os.environ.get("CONCURRENCY_RETRY_AFTER", "5"))
 
 #Session Management
 CSRF_COOKIE_HTTPONLY = True
@@ -79,6 +115,9 @@ SESSION_EXPIRE_AT_BROWSER_CLOSE = os.environ.get('SESSION_EXPIRE_AT_BROWSER_CLOS
 SESSION_COOKIE_AGE = int(os.environ.get('SESSION_COOKIE_AGE', '30')) * 60
 SESSION_COOKIE_NAME = 'Session'
 SESSION_COOKIE_SAMESITE = 'Lax'
+# lifetime of cached user snapshots and display names; both are dropped
+# when the user changes
+USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', '900'))
 
 SECURE_COOKIES = os.environ.get('SECURE_COOKIES', 'False').lower() in ['true']
 
@@ -100,6 +139,8 @@ SECURE_BROWSER_XSS_FILTER = True
 SECURE_CONTENT_TYPE_NOSNIFF = True
 X_FRAME_OPTIONS = 'DENY'
 REFERRER_POLICY = 'same-origin'
+# set by SecurityMiddleware; the third-party referrer middleware isn't ASGI-safe
+SECURE_REFERRER_POLICY = REFERRER_POLICY
 
 # Load from environment, default to "'self'"
 raw_frame_ancestors = os.environ.get("CSP_FRAME_ANCESTORS", "'none'")
@@ -111,8 +152,8 @@ AWS_S3_ENDPOINT_URL = os.environ.get("AWS_S3_ENDPOINT_URL")
 CONTENT_SECURITY_POLICY = {
     "DIRECTIVES": {
         "default-src": ["'self'"],
-        "style-src": ["'self'", "'unsafe-inline'", "https://fonts.googleapis.com", "https://cdn.jsdelivr.net"],
-        "script-src": ["'self'", "'unsafe-inline'", "'unsafe-eval'", "https://cdn.jsdelivr.net"],
+        "style-src": ["'self'", "'unsafe-inline'", "https://fonts.googleapis.com"],
+        "script-src": ["'self'", "'unsafe-inline'", "'unsafe-eval'"],
         "font-src": ["'self'", "https://fonts.googleapis.com", "https://fonts.gstatic.com"],
         "img-src": ["'self'", "data:", "blob:", "https://img.logo.dev"] + ([AWS_S3_ENDPOINT_URL] if AWS_S3_ENDPOINT_URL else []),
         "object-src": ["'none'"],
@@ -136,13 +177,14 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'myapp.staticassets.StaticFilesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     #'django.middleware.locale.LocaleMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # request.user from a cached snapshot; see myapp/usercache.py
+    'myapp.usercache.CachedAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
-    'django_http_referrer_policy.middleware.ReferrerPolicyMiddleware',
     'csp.middleware.CSPMiddleware',
 ]
 
@@ -169,15 +211,40 @@ TEMPLATES = [
 
 DB_ENGINE = os.environ.get("DB_ENGINE", "sqlite3")
 
+# Persistent connections only pay off under the threaded uWSGI server; ASGI
+# runs ORM calls on short-lived threads whose connections would pile up
+DB_CONN_MAX_AGE = int(os.environ.get("DB_CONN_MAX_AGE", "600" if os.environ.get("APP_SERVER") == "uwsgi" else "0"))
+
 if DB_ENGINE == "sqlite3":
-    
+
+    # WAL lets readers run alongside the single writer; IMMEDIATE transactions
+    # take the write lock up front so concurrent writers queue on the busy
+    # timeout instead of failing with "database is locked"
+    SQLITE_PRAGMAS = [
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA mmap_size=%d" % (int(os.environ.get("SQLITE_MMAP_SIZE_MB", "256")) * 1024 * 1024),
+        "PRAGMA cache_size=-%d" % (int(os.environ.get("SQLITE_CACHE_SIZE_MB", "64")) * 1024),
+    ]
+
     DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'database', 'db.sqlite3'),
+        'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': int(os.environ.get("SQLITE_BUSY_TIMEOUT", "20")),
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': ';'.join(SQLITE_PRAGMAS),
+        },
     }
 }
 
+    # funnel short writes (comments, tags, titles) through one writer thread
+    SQLITE_WRITE_QUEUE = os.environ.get('SQLITE_WRITE_QUEUE', 'True').lower() in ['true']
+
 elif DB_ENGINE == "postgres":
 
     DB_HOST = os.environ.get("POSTGRES_HOST", "db")
@@ -186,17 +253,59 @@ elif DB_ENGINE == "postgres":
     DB_PASSWORD = os.environ.get("POSTGRES_PASSWORD", "memelord")
     DB_NAME = os.environ.get("POSTGRES_DB", "memelord")
 
-    DATABASES = {
-        'default': {
+    # psycopg: Django's built-in psycopg 3 pool, one per worker process
+    # pgbouncer: POSTGRES_HOST points at PgBouncer (transaction pooling)
+    # off: a new connection per request (or DB_CONN_MAX_AGE)
+    POSTGRES_POOL = os.environ.get("POSTGRES_POOL", "psycopg")
+
+    def postgres_database(host, port):
+        database = {
             'ENGINE': 'django.db.backends.postgresql',
             'NAME': DB_NAME,
-            'HOST': DB_HOST,
-            'PORT': DB_PORT,
+            'HOST': host,
+            'PORT': port,
             'USER': DB_USER,
             'PASSWORD': DB_PASSWORD,
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
         }
+        if POSTGRES_POOL == "psycopg":
+            # the pool owns connection lifetime, Django requires CONN_MAX_AGE=0;
+            # with CONN_HEALTH_CHECKS the pool pings connections on checkout so
+            # a failover or restart doesn't hand out dead connections
+            database['CONN_MAX_AGE'] = 0
+            database['OPTIONS']['pool'] = {
+                'min_size': int(os.environ.get("POSTGRES_POOL_MIN_SIZE", "2")),
+                'max_size': int(os.environ.get("POSTGRES_POOL_MAX_SIZE", "10")),
+                'timeout': int(os.environ.get("POSTGRES_POOL_TIMEOUT", "10")),
+                'max_idle': 300,
+            }
+        elif POSTGRES_POOL == "pgbouncer":
+            # transaction pooling can't keep server-side cursors open across
+            # statements; Django already avoids prepared statements
+            database['DISABLE_SERVER_SIDE_CURSORS'] = True
+        return database
+
+    DATABASES = {
+        'default': postgres_database(DB_HOST, DB_PORT),
     }
 
+    # comma separated host[:port] list, e.g. the CloudNativePG "-ro" service
+    for index, replica in enumerate(filter(None, os.environ.get("POSTGRES_REPLICA_HOSTS", "").split(","))):
+        host, port = (replica.strip().split(":") + [DB_PORT])[:2]
+        DATABASES['replica%d' % index] = postgres_database(host, port)
+        DATABASES['replica%d' % index]['TEST'] = {'MIRROR': 'default'}
+
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['myapp.dbrouting.ReplicaRouter']
+
+# after a write, a browser reads from the primary for this long so it
+# sees its own changes despite replication lag
+REPLICA_PIN_SECONDS = int(os.environ.get("REPLICA_PIN_SECONDS", "10"))
+if DATABASE_REPLICAS:
+    MIDDLEWARE.append('myapp.dbrouting.PinPrimaryMiddleware')
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -237,10 +346,61 @@ LOCALE_PATHS = [
 # Celery configuration
 # http://docs.celeryproject.org/en/latest/configuration.html
 
+if REDIS_HOST:
+    CELERY_BROKER_URL = "redis://:%s@%s:%s/%s" % (REDIS_PASSWORD, REDIS_HOST, REDIS_PORT, REDIS_DB)
+else:
+    # no broker, no worker: run tasks in the process that sends them, on
+    # its background thread (myapp/background.py)
+    CELERY_TASK_ALWAYS_EAGER = True
+CELERY_TIMEZONE = TIME_ZONE
+# periodic tasks live in the database (registered by data migrations, editable in the admin)
+CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
+
+# Video renditions (myapp/transcode.py), made by the Celery worker if ffmpeg is installed
+TRANSCODE_VIDEOS = os.environ.get('TRANSCODE_VIDEOS', 'True').lower() in ['true']
+TRANSCODE_HLS = os.environ.get('TRANSCODE_HLS', 'False').lower() in ['true']
+TRANSCODE_LOW_HEIGHT = int(os.environ.get('TRANSCODE_LOW_HEIGHT', 480))
+TRANSCODE_LOW_BITRATE = os.environ.get('TRANSCODE_LOW_BITRATE', '600k')
+TRANSCODE_TIMEOUT = int(os.environ.get('TRANSCODE_TIMEOUT', 1800))
+FFMPEG_BINARY = os.environ.get('FFMPEG_BINARY', 'ffmpeg')
+FFPROBE_BINARY = os.environ.get('FFPROBE_BINARY', 'ffprobe')
+
+# Batch upload (many files or a ZIP per request)
+BATCH_UPLOAD_WORKERS = int(os.environ.get('BATCH_UPLOAD_WORKERS', 8))
+BATCH_UPLOAD_MAX_FILES = int(os.environ.get('BATCH_UPLOAD_MAX_FILES', 1000))
+# uncompressed size of the files in one batch
+BATCH_UPLOAD_MAX_MB = int(os.environ.get('BATCH_UPLOAD_MAX_MB', 2048))
+DATA_UPLOAD_MAX_NUMBER_FILES = BATCH_UPLOAD_MAX_FILES
+
+# Comment storage
+# on PostgreSQL comments are partitioned by month; keep this many months ready
+COMMENT_PARTITION_PREMAKE_MONTHS = int(os.environ.get("COMMENT_PARTITION_PREMAKE_MONTHS", "3"))
+# compact threads without new comments for this many days, 0 disables archival
+COMMENT_ARCHIVE_AFTER_DAYS = int(os.environ.get("COMMENT_ARCHIVE_AFTER_DAYS", "0"))
+
+# Periodic maintenance (myapp/maintenance.py)
+# stored files without a media row are deleted once this old
+ORPHAN_GRACE_HOURS = int(os.environ.get("ORPHAN_GRACE_HOURS", "24"))
+# feed pages whose cards are rendered ahead of the visitors
+CACHE_WARM_FEED_PAGES = int(os.environ.get("CACHE_WARM_FEED_PAGES", "2"))
+
 LOGS_DIR = os.path.join(BASE_DIR, 'logs')
 
 STATIC_URL = '/static/'
-STATIC_ROOT = os.path.join(BASE_DIR, 'myapp', 'static')
+# build output, kept apart from the sources in myapp/static (collected in the Dockerfile)
+STATIC_ROOT = os.environ.get('STATIC_ROOT', os.path.join(BASE_DIR, 'staticfiles'))
+STATICFILES_FINDERS = [
+    'django.contrib.staticfiles.finders.FileSystemFinder',
+    'myapp.staticassets.PrunedAppDirectoriesFinder',
+]
+# only collect what templates reference from these (see myapp/staticassets.py)
+STATIC_PRUNE_PREFIXES = ['assets/vendor/']
+
+# WhiteNoise serves STATIC_ROOT: Brotli/gzip variants by Accept-Encoding and
+# "immutable" far-future caching for the hashed file names
+WHITENOISE_KEEP_ONLY_HASHED_FILES = True
+WHITENOISE_USE_FINDERS = DEBUG
+WHITENOISE_AUTOREFRESH = DEBUG
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -258,6 +418,24 @@ OIDC_AUTOLOGIN = os.environ.get('OIDC_AUTOLOGIN', 'False').lower() in ['true']
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
+# serve media through the app (from a local disk cache of the bucket)
+# instead of linking to storage URLs
+MEDIA_PROXY = os.environ.get('MEDIA_PROXY', 'False').lower() in ['true']
+# local storage (MEDIA_STORAGE=local): let the front server send the file,
+# 'x-sendfile' (uWSGI offload threads, Apache, lighttpd), 'x-accel-redirect'
+# (nginx, internal location at MEDIA_ACCEL_PREFIX) or '' to stream it from the app
+MEDIA_SENDFILE = os.environ.get('MEDIA_SENDFILE', 'x-sendfile' if os.environ.get("APP_SERVER") == "uwsgi" else '').lower()
+MEDIA_ACCEL_PREFIX = os.environ.get('MEDIA_ACCEL_PREFIX', '/protected-media/')
+# S3: 'cache' serves from the local disk cache, 'redirect' sends the client
+# to a presigned URL valid for MEDIA_REDIRECT_EXPIRE seconds
+MEDIA_S3_DELIVERY = os.environ.get('MEDIA_S3_DELIVERY', 'cache').lower()
+MEDIA_REDIRECT_EXPIRE = int(os.environ.get('MEDIA_REDIRECT_EXPIRE', 300))
+MEDIA_CACHE_DIR = os.environ.get('MEDIA_CACHE_DIR', BASE_DIR / "media-cache")
+MEDIA_CACHE_MAX_MB = int(os.environ.get('MEDIA_CACHE_MAX_MB', 2048))
+MEDIA_CACHE_MAX_AGE = int(os.environ.get('MEDIA_CACHE_MAX_AGE', 86400))
+
+MEDIA_STORAGE = os.environ.get('MEDIA_STORAGE', 's3').lower()
+
 STORAGES = {
     "default": {
         "BACKEND": "storages.backends.s3.S3Storage",
@@ -266,12 +444,25 @@ STORAGES = {
             "endpoint_url": AWS_S3_ENDPOINT_URL,
             "region_name": os.environ.get("AWS_S3_REGION_NAME"),
         },
+    } if MEDIA_STORAGE == 's3' else {
+        # files under MEDIA_ROOT, served by the access-checked media view
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
     },
     "staticfiles": {
-        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"
+        # hashed names + .br/.gz siblings; needs collectstatic, so not while developing
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage" if DEBUG
+        else "whitenoise.storage.CompressedManifestStaticFilesStorage",
     },
 }
 
+# Resumable (tus) uploads: chunks are appended to a staging file until the
+# upload is complete. Every web process must see the same staging directory;
+# under MEDIA_ROOT the finished file is moved in place without a copy.
+RESUMABLE_UPLOADS = os.environ.get('RESUMABLE_UPLOADS', str(MEDIA_STORAGE == 'local')).lower() in ['true']
+RESUMABLE_UPLOAD_DIR = os.environ.get('RESUMABLE_UPLOAD_DIR', MEDIA_ROOT / ".resumable")
+RESUMABLE_UPLOAD_MAX_MB = int(os.environ.get('RESUMABLE_UPLOAD_MAX_MB', 4096))
+RESUMABLE_UPLOAD_EXPIRE_HOURS = int(os.environ.get('RESUMABLE_UPLOAD_EXPIRE_HOURS', 24))
+
 if OIDC_ENABLED:
     # get oidc config from env
     OIDC_CREATE_USER = os.environ.get('OIDC_CREATE_USER', 'True').lower() in ['true']
@@ -284,20 +475,30 @@ if OIDC_ENABLED:
     OIDC_OP_TOKEN_ENDPOINT = os.environ.get('OIDC_OP_TOKEN_ENDPOINT')
     OIDC_OP_USER_ENDPOINT = os.environ.get('OIDC_OP_USER_ENDPOINT')
     OIDC_RENEW_ID_TOKEN_EXPIRY_SECONDS = float(os.environ.get('OIDC_RENEW_ID_TOKEN_EXPIRY_SECONDS', 900))
+    OIDC_RP_SCOPES = os.environ.get('OIDC_RP_SCOPES', 'openid email')
+    # checked against the iss claim of ID tokens if set
+    OIDC_OP_ISSUER = os.environ.get('OIDC_OP_ISSUER')
+    OIDC_TIMEOUT = float(os.environ.get('OIDC_TIMEOUT', 10))
+    # signing keys are refreshed in the background after this long; see myapp/oidc.py
+    OIDC_JWKS_CACHE_SECONDS = int(os.environ.get('OIDC_JWKS_CACHE_SECONDS', 3600))
+    # renew due sessions with the refresh token in the background instead of
+    # redirecting through the provider; may need offline_access in OIDC_RP_SCOPES
+    OIDC_SILENT_REFRESH = os.environ.get('OIDC_SILENT_REFRESH', 'False').lower() in ['true']
+    OIDC_SILENT_REFRESH_GRACE_SECONDS = int(os.environ.get('OIDC_SILENT_REFRESH_GRACE_SECONDS', 300))
     OIDC_USERNAME_ALGO = 'myapp.utils.generate_username'
 
     # Add 'mozilla_django_oidc.middleware.SessionRefresh' to INSTALLED_APPS
     INSTALLED_APPS.append('mozilla_django_oidc')
     
-    # Add 'mozilla_django_oidc' authentication backend
+    # Add 'mozilla_django_oidc' authentication backend, with cached keys
     AUTHENTICATION_BACKENDS = (
         'django.contrib.auth.backends.ModelBackend',
-        'mozilla_django_oidc.auth.OIDCAuthenticationBackend',
+        'myapp.oidc.OIDCBackend',
     )
 
-    # Add 'mozilla_django_oidc.middleware.SessionRefresh' to MIDDLEWARE
+    # Add mozilla_django_oidc's SessionRefresh to MIDDLEWARE, renewing in the background with OIDC_SILENT_REFRESH
     # https://mozilla-django-oidc.readthedocs.io/en/stable/installation.html#validate-id-tokens-by-renewing-them
-    MIDDLEWARE.append('mozilla_django_oidc.middleware.SessionRefresh')
+    MIDDLEWARE.append('myapp.oidc.SessionRefresh')
 
     # Fix http callback issue in mozilla-django-oidc by forcing https; https://github.com/mozilla/mozilla-django-oidc/issues/417
     # OIDC should only be setup behind a TLS reverse proxy anyways
@@ -18,7 +18,6 @@ from django.urls import include, path
 from django.contrib.auth import views as auth_views
 from django.conf import settings
 from django.conf.urls.i18n import i18n_patterns
-from django.conf.urls.static import static
 
 urlpatterns_i18n = i18n_patterns(
     path('admin/', admin.site.urls),
@@ -42,5 +41,4 @@ if not settings.OIDC_ENABLED:
 if settings.OIDC_ENABLED:
     urlpatterns.append(path('oidc/', include('mozilla_django_oidc.urls')))
 
-# Serve media files in development
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+# media is served by myapp.views.media_file, which checks visibility
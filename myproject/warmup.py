@@ -0,0 +1,41 @@
+# myproject/warmup.py
+"""
+Pay Django's lazy start-up costs once, before the app server forks.
+
+gunicorn (preload_app) and uWSGI (lazy-apps = false) import the app in the
+master process; everything loaded here is shared copy-on-write by all workers
+instead of being rebuilt on each worker's first requests.
+"""
+import logging
+from pathlib import Path
+
+from django.apps import apps
+from django.core.files.storage import storages
+from django.template import engines
+from django.urls import get_resolver
+
+logger = logging.getLogger(__name__)
+
+
+def _warm_templates():
+    # with DEBUG off Django wraps the loaders in the cached loader, so
+    # compiled templates stay in memory for the life of the process
+    template_dir = Path(apps.get_app_config("myapp").path) / "templates"
+    engine = engines["django"]
+    count = 0
+    for path in template_dir.rglob("*.html"):
+        try:
+            engine.get_template(path.relative_to(template_dir).as_posix())
+            count += 1
+        except Exception:
+            logger.warning("Could not pre-load template %s", path, exc_info=True)
+    return count
+
+
+def warm_up():
+    # imports every URLconf and view module and builds the reverse lookup tables
+    get_resolver()._populate()
+    templates = _warm_templates()
+    # instantiates the storage backend (imports boto3/botocore for S3)
+    storages["default"]
+    logger.info("Warm-up done: %d templates pre-loaded", templates)
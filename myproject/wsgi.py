@@ -16,3 +16,7 @@ load_dotenv(os.path.join(project_folder, '.env'))
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.settings')
 
 application = get_wsgi_application()
+
+if os.environ.get('WARMUP', 'True').lower() in ['true']:
+    from .warmup import warm_up
+    warm_up()